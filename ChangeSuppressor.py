@@ -0,0 +1,69 @@
+import numpy as np
+
+from ColorMath import delta_e, srgb_to_lab
+
+
+class ChangeSuppressor:
+    def __init__(self, threshold=2.3, max_staleness=10.0, brightness_threshold=3):
+        self.threshold = threshold
+        self.max_staleness = max_staleness
+        self.brightness_threshold = brightness_threshold
+
+        # entity -> (lab, brightness, time of the last confirmed send)
+        self.last_sent = {}
+
+        self.sent = 0
+        self.suppressed = 0
+
+    def measure(self, entities, colors, brightness, now):
+        lab = srgb_to_lab(np.asarray(colors, dtype=np.uint8).reshape(-1, 3))
+
+        known = np.array([entity in self.last_sent for entity in entities])
+        previous = np.array([self.last_sent[e][0] if e in self.last_sent else (0.0, 0.0, 0.0)
+                             for e in entities])
+        previous_brightness = np.array([self.last_sent[e][1] if e in self.last_sent else 0
+                                        for e in entities])
+        age = np.array([now - self.last_sent[e][2] if e in self.last_sent else 0.0
+                        for e in entities])
+
+        # Never sent lamps count as infinitely wrong
+        error = np.where(known, delta_e(lab, previous), np.inf)
+        brightness_error = np.abs(np.asarray(brightness) - previous_brightness)
+        return error, brightness_error, age, known
+
+    def select(self, entities, colors, brightness, now, budget=None):
+        if not entities:
+            return []
+
+        error, brightness_error, age, known = self.measure(entities, colors, brightness, now)
+        changed = ((error > self.threshold)
+                   | (brightness_error > self.brightness_threshold)
+                   | (age >= self.max_staleness)
+                   | ~known)
+        needed = int(changed.sum())
+
+        # Under a request budget only the most urgent of the changed lamps go out this tick
+        if budget is not None:
+            changed = np.array(budget.pick(entities, changed, error, age, now), dtype=bool)
+
+        self.sent += int(changed.sum())
+        self.suppressed += len(entities) - needed
+        return changed.tolist()
+
+    def mark_sent(self, entities, colors, brightness, now):
+        if not entities:
+            return
+
+        lab = srgb_to_lab(np.asarray(colors, dtype=np.uint8).reshape(-1, 3))
+        for entity, entity_lab, entity_brightness in zip(entities, lab, np.broadcast_to(brightness, len(entities))):
+            self.last_sent[entity] = (entity_lab, int(entity_brightness), now)
+
+    def forget(self, entities=None):
+        if entities is None:
+            self.last_sent.clear()
+        else:
+            for entity in entities:
+                self.last_sent.pop(entity, None)
+
+    def stats(self):
+        return {"sent": self.sent, "suppressed": self.suppressed}
@@ -0,0 +1,55 @@
+HEALTH_STATES = ("idle", "connecting", "ok", "degraded", "offline", "rejected")
+
+
+class HAUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=3, base_delay=1.0, max_delay=30.0):
+        # Opens after `threshold` failed ticks in a row, then lets one probe through after a
+        # delay that doubles with every failed probe
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.state = "closed"
+        self.failures = 0
+        self.delay = base_delay
+        self.retry_at = 0.0
+
+        self.trips = 0
+        self.probes = 0
+
+    def reset(self):
+        self.state = "closed"
+        self.failures = 0
+        self.delay = self.base_delay
+        self.retry_at = 0.0
+
+    def allow(self, now):
+        if self.state == "open":
+            if now < self.retry_at:
+                return False
+            self.state = "half_open"
+            self.probes += 1
+        return True
+
+    def success(self):
+        self.reset()
+
+    def failure(self, now, trip=False):
+        # trip: the failure already cost a full timeout, waiting for more would block for longer
+        self.failures += 1
+        if self.state == "half_open" or trip or self.failures >= self.threshold:
+            if self.state == "closed":
+                self.trips += 1
+            self.state = "open"
+            self.retry_at = now + self.delay
+            self.delay = min(self.delay * 2, self.max_delay)
+
+    def retry_in(self, now):
+        return max(0.0, self.retry_at - now) if self.state == "open" else 0.0
+
+    def stats(self):
+        return {"breaker_state": self.state, "breaker_trips": self.trips, "breaker_probes": self.probes}
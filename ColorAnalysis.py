@@ -0,0 +1,140 @@
+import numpy as np
+
+from TiledAnalysis import TilePool, row_tiles
+
+REDUCERS = ("mean", "saturated", "dominant", "kmeans", "mediancut")
+
+DOMINANT_BITS = 4
+
+
+class ColorAnalyzer:
+    def __init__(self, reducer="mean", pixel_budget=16384, palette_size=4, kmeans_iterations=4,
+                 cluster_sample=2048, pool=None):
+        self.reducer = reducer
+        # Pixels looked at per frame, 0 for every captured pixel
+        self.pixel_budget = pixel_budget
+        self.cluster_sample = cluster_sample
+        self.palette_size = palette_size
+        self.kmeans_iterations = kmeans_iterations
+
+        # Reused between ticks as long as the frame size does not change
+        self.small = None
+        self.centers = None
+
+        # Large frames are split into bands of rows that are analyzed in parallel
+        self.pool = pool if pool is not None else TilePool()
+
+    def strided(self, frame):
+        height, width = frame.pixels.shape[:2]
+        if self.pixel_budget <= 0:
+            return frame.pixels
+        step = max(1, int(np.ceil(np.sqrt(height * width / self.pixel_budget))))
+        return frame.pixels[step // 2::step, step // 2::step]
+
+    def tiles(self, pixels):
+        return row_tiles(pixels.shape[0], pixels.shape[1], self.pool.tile_pixels)
+
+    def downsample(self, frame):
+        strided = self.strided(frame)
+        if self.small is None or self.small.shape != strided.shape:
+            self.small = np.empty(strided.shape, dtype=np.float32)
+        self.pool.map(lambda band: np.copyto(self.small[band[0]:band[1]], strided[band[0]:band[1]]),
+                      self.tiles(strided))
+
+        return self.small.reshape(-1, 3)
+
+    def analyze(self, frame):
+        return self.palette(frame)[0]
+
+    def palette(self, frame):
+        if self.reducer == "kmeans":
+            colors = self.kmeans(self.downsample(frame))
+        elif self.reducer == "mediancut":
+            colors = self.median_cut(self.downsample(frame))
+        else:
+            # Sums over pixels, computed per tile and merged
+            colors = [self.tiled(self.strided(frame))]
+
+        return [tuple(int(round(c)) for c in np.clip(color, 0, 255)) for color in colors]
+
+    def tiled(self, pixels):
+        # Every tile returns its own sums, added up in tile order so the color does not depend on
+        # which thread finished first
+        if self.reducer == "dominant":
+            return self.dominant(pixels)
+
+        partial = self.saturated_sums if self.reducer == "saturated" else self.mean_sums
+        parts = self.pool.map(lambda band: partial(pixels[band[0]:band[1]]), self.tiles(pixels))
+        sums = sum(part[0] for part in parts)
+        weights = sum(part[1] for part in parts)
+        return sums / max(weights, 1e-9)
+
+    def mean_sums(self, block):
+        # Exact integer sums, a column of a tile cannot overflow 32 bits
+        return block.sum(axis=0, dtype=np.uint32).sum(axis=0, dtype=np.uint64), block.shape[0] * block.shape[1]
+
+    def saturated_sums(self, block):
+        pixels = block.reshape(-1, 3).astype(np.float32)
+        r, g, b = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+        high = np.maximum(np.maximum(r, g), b)
+        low = np.minimum(np.minimum(r, g), b)
+
+        # HSV saturation as weight, with a floor so a grey screen still averages to grey
+        weights = (high - low) / np.maximum(high, 1.0) + 0.05
+        return (weights @ pixels).astype(np.float64), float(weights.sum(dtype=np.float64))
+
+    def dominant(self, pixels, bits=DOMINANT_BITS):
+        tiles = self.tiles(pixels)
+
+        def histogram(band):
+            q = pixels[band[0]:band[1]].reshape(-1, 3) >> np.uint8(8 - bits)
+            # 4 bits per channel: 4096 bins
+            bins = (q[:, 0].astype(np.uint16) << (2 * bits)) | (q[:, 1].astype(np.uint16) << bits) | q[:, 2]
+            return bins, np.bincount(bins, minlength=1 << (3 * bits))
+
+        parts = self.pool.map(histogram, tiles)
+        counts = sum(part[1] for part in parts)
+
+        # Near black (bin 0) is ignored unless there is nothing else, so dark borders never win.
+        # The fullest bin wins and is averaged exactly
+        best = int(counts[1:].argmax()) + 1 if counts[1:].any() else 0
+        sums = self.pool.map(lambda item: pixels[item[0][0]:item[0][1]].reshape(-1, 3)[item[1][0] == best]
+                             .sum(axis=0, dtype=np.uint64), zip(tiles, parts))
+        return sum(sums) / max(int(counts[best]), 1)
+
+    def kmeans(self, pixels):
+        k = min(self.palette_size, len(pixels))
+        sample = pixels[::max(1, len(pixels) // self.cluster_sample)]
+
+        # Starting from last tick's centers keeps the palette stable between frames
+        if self.centers is None or len(self.centers) != k:
+            order = np.argsort(sample.sum(axis=1))
+            self.centers = sample[order[np.linspace(0, len(order) - 1, k).astype(np.intp)]].copy()
+
+        squared = (sample * sample).sum(axis=1)[:, None]
+        for _ in range(max(1, self.kmeans_iterations)):
+            distances = squared - 2 * sample @ self.centers.T + (self.centers * self.centers).sum(axis=1)
+            labels = distances.argmin(axis=1)
+            counts = np.bincount(labels, minlength=k)
+            for channel in range(3):
+                sums = np.bincount(labels, weights=sample[:, channel], minlength=k)
+                np.divide(sums, counts, out=self.centers[:, channel], where=counts > 0)
+
+        return list(self.centers[np.argsort(-counts)])
+
+    def median_cut(self, pixels):
+        boxes = [pixels[::max(1, len(pixels) // self.cluster_sample)]]
+        while len(boxes) < self.palette_size:
+            index = max(range(len(boxes)), key=lambda i: len(boxes[i]))
+            box = boxes[index]
+            if len(box) < 2:
+                break
+
+            channel = int(np.ptp(box, axis=0).argmax())
+            order = np.argsort(box[:, channel], kind="stable")
+            half = len(box) // 2
+            boxes[index:index + 1] = [box[order[:half]], box[order[half:]]]
+
+        # Equal populations by construction, so the tightest box is the most representative
+        boxes.sort(key=lambda box: (-len(box), float(np.prod(np.ptp(box, axis=0) + 1))))
+        return [box.mean(axis=0) for box in boxes]
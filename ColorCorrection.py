@@ -0,0 +1,117 @@
+import numpy as np
+
+BRIGHTNESS_MODES = ("fixed", "luminance")
+
+DEFAULT_CORRECTION = {
+    "gamma": 1.0,
+    "white_balance": [1.0, 1.0, 1.0],
+    "saturation": 1.0,
+    "min_brightness": 0,
+    "max_brightness": 255,
+    "brightness": "fixed",
+}
+
+# Rec. 709 luma weights
+LUMA = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def correction_settings(settings):
+    correction = dict(DEFAULT_CORRECTION)
+    correction.update(settings or {})
+    return correction
+
+
+def channel_lut(gamma, gain):
+    # Gamma first, then the white balance gain of the channel, one byte in and one byte out
+    levels = np.arange(256, dtype=np.float64) / 255.0
+    return np.clip(np.rint(255.0 * levels ** gamma * gain), 0, 255).astype(np.uint8)
+
+
+def brightness_lut(low, high):
+    # Luminance 0..255 -> Home Assistant brightness between min and max
+    return np.rint(np.linspace(low, high, 256)).astype(np.uint8)
+
+
+class ColorCorrector:
+    def __init__(self):
+        self.key = None
+        self.index = {}
+        self.rows = {}
+        self.identity = True
+        self.builds = 0
+
+        # Row 0 is the neutral correction used by lamps without settings
+        self.luts = None
+        self.saturation = None
+        self.levels = None
+        self.luminance = None
+        self.max_brightness = None
+        self.configure({})
+
+    def configure(self, corrections):
+        # corrections: entity -> settings, tables are only rebuilt when these change
+        key = tuple(sorted((entity, repr(sorted(correction_settings(settings).items())))
+                           for entity, settings in corrections.items()))
+        if key == self.key:
+            return
+        self.key = key
+        self.builds += 1
+
+        entities = [entity for entity, _ in key]
+        settings = [correction_settings(None)] + [correction_settings(corrections[e]) for e in entities]
+
+        # Lamps with the same gamma and white balance share their tables
+        tables = {}
+        for s in settings:
+            table = (s["gamma"], tuple(s["white_balance"]))
+            if table not in tables:
+                tables[table] = np.stack([channel_lut(max(s["gamma"], 0.01), gain) for gain in s["white_balance"]])
+        self.luts = np.stack([tables[(s["gamma"], tuple(s["white_balance"]))] for s in settings])
+        self.saturation = np.array([s["saturation"] for s in settings], dtype=np.float32)
+        self.levels = np.stack([brightness_lut(s["min_brightness"], s["max_brightness"]) for s in settings])
+        self.luminance = np.array([s["brightness"] == "luminance" for s in settings])
+        self.max_brightness = np.array([s["max_brightness"] for s in settings], dtype=np.uint8)
+
+        self.index = {entity: row + 1 for row, entity in enumerate(entities)}
+        self.rows = {}
+        self.identity = all(s == DEFAULT_CORRECTION for s in settings)
+
+    def lookup(self, entities):
+        key = tuple(entities)
+        if key not in self.rows:
+            self.rows = {key: np.array([self.index.get(entity, 0) for entity in key], dtype=np.intp)}
+        return self.rows[key]
+
+    def apply(self, entities, colors):
+        # One color row per entity (repeat the entity for strip segments).
+        # Returns the corrected colors and a brightness per row
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        if self.identity:
+            return colors, np.full(len(colors), 255, dtype=np.uint8)
+
+        rows = self.lookup(entities)[:len(colors)]
+
+        # Saturation scales the distance from the gray of the same luma
+        saturation = self.saturation[rows][:, None]
+        rgb = colors.astype(np.float32)
+        gray = rgb @ LUMA
+        rgb = np.clip(np.rint(gray[:, None] + (rgb - gray[:, None]) * saturation), 0, 255).astype(np.intp)
+
+        rgb = self.luts[rows[:, None], np.arange(3), rgb]
+
+        luma = np.clip(np.rint(rgb.astype(np.float32) @ LUMA), 0, 255).astype(np.intp)
+        luminance = self.luminance[rows]
+        brightness = np.where(luminance, self.levels[rows, luma], self.max_brightness[rows])
+
+        # With luminance brightness the color itself goes out at full level, the light dims it
+        peak = rgb.max(axis=1, keepdims=True)
+        scaled = np.rint(rgb.astype(np.float32) * 255.0 / np.maximum(peak, 1)).astype(np.uint8)
+        rgb = np.where(luminance[:, None] & (peak > 0), scaled, rgb)
+        return rgb, brightness
+
+    def dimmed(self, entities, colors):
+        # For outputs without a brightness of their own, e.g. WLED
+        rgb, brightness = self.apply(entities, colors)
+        if self.identity:
+            return rgb
+        return np.rint(rgb.astype(np.float32) * brightness[:, None] / 255.0).astype(np.uint8)
@@ -0,0 +1,77 @@
+import numpy as np
+
+FILTERS = ("none", "ema", "spring", "kalman")
+
+
+class ColorFilter:
+    def __init__(self, kind="ema", responsiveness=0.5, measurement_noise=16.0):
+        self.kind = kind
+        self.responsiveness = responsiveness
+        self.measurement_noise = measurement_noise
+
+        # One row per lamp, all lamps are stepped together
+        self.entities = None
+        self.value = None
+        self.velocity = None
+        self.variance = None
+        self.last_time = None
+
+    def reset(self):
+        self.entities = None
+        self.value = None
+        self.velocity = None
+        self.variance = None
+        self.last_time = None
+
+    def time_constant(self):
+        # responsiveness 1.0 follows the screen almost instantly, 0.0 settles over about a second
+        r = min(max(self.responsiveness, 0.0), 1.0)
+        return 0.02 + (1.0 - r) * 1.0
+
+    def apply(self, entities, colors, now):
+        target = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+
+        if self.kind == "none" or not len(target):
+            self.reset()
+            return [tuple(int(c) for c in color) for color in target]
+
+        if self.entities != tuple(entities) or self.value is None or self.value.shape != target.shape:
+            self.entities = tuple(entities)
+            self.value = target.copy()
+            self.velocity = np.zeros_like(target)
+            self.variance = np.full((len(target), 1), self.measurement_noise)
+            self.last_time = now
+            return [tuple(int(c) for c in color) for color in np.rint(target)]
+
+        dt = max(now - self.last_time, 0.0)
+        self.last_time = now
+        tau = self.time_constant()
+
+        if self.kind == "spring":
+            self.spring(target, dt, tau)
+        elif self.kind == "kalman":
+            self.kalman(target, dt, tau)
+        else:
+            self.value += (1.0 - np.exp(-dt / tau)) * (target - self.value)
+
+        np.clip(self.value, 0, 255, out=self.value)
+        return [tuple(color) for color in np.rint(self.value).astype(int).tolist()]
+
+    def spring(self, target, dt, tau):
+        # Exact step of a critically damped spring, stable for any dt
+        omega = 2.0 / tau
+        delta = self.value - target
+        decay = np.exp(-omega * dt)
+        temp = (self.velocity + omega * delta) * dt
+
+        self.velocity = (self.velocity - omega * temp) * decay
+        self.value = target + (delta + temp) * decay
+
+    def kalman(self, target, dt, tau):
+        # Random walk model: process noise grows with dt and with responsiveness
+        process_noise = self.measurement_noise * (dt / tau) ** 2
+        self.variance += process_noise
+
+        gain = self.variance / (self.variance + self.measurement_noise)
+        self.value += gain * (target - self.value)
+        self.variance *= 1.0 - gain
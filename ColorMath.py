@@ -0,0 +1,66 @@
+import numpy as np
+
+_srgb = np.arange(256) / 255.0
+SRGB_TO_LINEAR = np.where(_srgb <= 0.04045, _srgb / 12.92, ((_srgb + 0.055) / 1.055) ** 2.4)
+
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def srgb_to_lab(rgb):
+    rgb = np.asarray(rgb)
+    linear = SRGB_TO_LINEAR[rgb.astype(np.intp)]
+    xyz = linear @ RGB_TO_XYZ.T / D65_WHITE
+
+    eps = 216 / 24389
+    kappa = 24389 / 27
+    f = np.where(xyz > eps, np.cbrt(xyz), (kappa * xyz + 16) / 116)
+
+    lab = np.empty(f.shape)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def delta_e(lab1, lab2):
+    # CIE76: euclidean distance in Lab, ~2.3 is a just noticeable difference
+    return np.sqrt(np.sum((np.asarray(lab1) - np.asarray(lab2)) ** 2, axis=-1))
+
+
+# Chromaticity of the D65 white point, used for black where no chromaticity exists
+D65_XY = (0.3127, 0.3290)
+
+
+def srgb_to_xy(rgb):
+    linear = SRGB_TO_LINEAR[np.asarray(rgb).astype(np.intp)]
+    xyz = linear @ RGB_TO_XYZ.T
+    total = xyz.sum(axis=-1, keepdims=True)
+    xy = xyz[..., :2] / np.where(total > 0, total, 1.0)
+    return np.where(total > 0, xy, D65_XY)
+
+
+def srgb_to_hs(rgb):
+    # Hue in degrees and saturation in percent, the way Home Assistant's hs_color expects them
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    high = rgb.max(axis=-1)
+    spread = high - rgb.min(axis=-1)
+    safe = np.where(spread > 0, spread, 1.0)
+
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    hue = np.select([high == r, high == g], [(g - b) / safe % 6, (b - r) / safe + 2], (r - g) / safe + 4)
+    hue = np.where(spread > 0, hue * 60.0, 0.0)
+    saturation = np.where(high > 0, spread / np.where(high > 0, high, 1.0), 0.0) * 100.0
+    return np.stack([hue, saturation], axis=-1)
+
+
+def xy_to_kelvin(xy):
+    # McCamy's approximation, good enough near the Planckian locus
+    xy = np.asarray(xy, dtype=np.float64)
+    n = (xy[..., 0] - 0.3320) / (0.1858 - xy[..., 1])
+    return 449.0 * n ** 3 + 3525.0 * n ** 2 + 6823.3 * n + 5520.33
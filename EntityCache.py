@@ -0,0 +1,154 @@
+import threading
+
+import numpy as np
+
+from ColorMath import srgb_to_hs, srgb_to_xy, xy_to_kelvin
+
+# Home Assistant supported_color_modes -> the payload this lamp gets, cheapest first
+PAYLOAD_MODES = (
+    ("rgb", ("rgb", "rgbw", "rgbww")),
+    ("hs", ("hs",)),
+    ("xy", ("xy",)),
+    ("color_temp", ("color_temp",)),
+    ("brightness", ("brightness", "white")),
+    ("onoff", ("onoff",)),
+)
+
+UNUSABLE_STATES = ("unavailable",)
+
+
+def payload_mode(supported):
+    if not supported:
+        # Integrations without color modes still take rgb_color
+        return "rgb"
+    for mode, color_modes in PAYLOAD_MODES:
+        if any(color_mode in supported for color_mode in color_modes):
+            return mode
+    return "rgb"
+
+
+def light_payload(mode, color, brightness, min_kelvin=2000, max_kelvin=6500):
+    # Only what the lamp can show, converted here once instead of inside Home Assistant
+    if mode == "onoff":
+        return {}
+
+    rgb = np.array([color], dtype=np.uint8)
+    value = max(color) / 255.0
+    if mode == "hs":
+        hue, saturation = srgb_to_hs(rgb)[0]
+        return {"hs_color": [round(float(hue), 1), round(float(saturation), 1)], "brightness": brightness}
+    if mode == "xy":
+        x, y = srgb_to_xy(rgb)[0]
+        return {"xy_color": [round(float(x), 4), round(float(y), 4)], "brightness": brightness}
+    if mode == "color_temp":
+        kelvin = int(np.clip(xy_to_kelvin(srgb_to_xy(rgb))[0], min_kelvin, max_kelvin))
+        return {"color_temp_kelvin": kelvin, "brightness": round(brightness * value)}
+    if mode == "brightness":
+        return {"brightness": round(brightness * value)}
+    return {"rgb_color": list(color), "brightness": brightness}
+
+
+class EntityCache:
+    def __init__(self, ttl=60.0):
+        # Filled from /api/states, then kept current from call results and state_changed events
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.states = {}
+        self.loaded_at = None
+
+        self.refreshes = 0
+        self.events = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.states = {}
+            self.loaded_at = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def stale(self, now):
+        return self.loaded_at is None or now - self.loaded_at >= self.ttl
+
+    def load(self, states, now):
+        with self.lock:
+            self.states = {}
+            self.loaded_at = now
+            self.refreshes += 1
+        self.update(states)
+
+    def update(self, states):
+        with self.lock:
+            for state in states or []:
+                entity = state.get("entity_id", "")
+                if entity.startswith("light."):
+                    attributes = state.get("attributes", {})
+                    self.states[entity] = {
+                        "state": state.get("state"),
+                        "mode": payload_mode(attributes.get("supported_color_modes")),
+                        "min_kelvin": attributes.get("min_color_temp_kelvin", 2000),
+                        "max_kelvin": attributes.get("max_color_temp_kelvin", 6500),
+                    }
+
+    def on_event(self, event):
+        # state_changed from the WebSocket subscription, new_state is None when an entity is removed
+        data = event.get("data", {})
+        if data.get("new_state") is not None:
+            self.update([data["new_state"]])
+        else:
+            with self.lock:
+                self.states.pop(data.get("entity_id"), None)
+        self.events += 1
+
+    def assume(self, entities, state):
+        # After a successful call its lights are in the requested state, unless the states in the
+        # answer or a later event say otherwise
+        with self.lock:
+            for entity in entities:
+                if entity in self.states:
+                    self.states[entity]["state"] = state
+
+    def usable(self, entity):
+        if not self.loaded:
+            return True
+        with self.lock:
+            known = self.states.get(entity)
+        return known is not None and known["state"] not in UNUSABLE_STATES
+
+    def missing(self, entities):
+        return [entity for entity in entities if not self.usable(entity)]
+
+    def payload(self, entity, color, brightness):
+        with self.lock:
+            known = self.states.get(entity)
+        if known is None:
+            return light_payload("rgb", color, brightness)
+        return light_payload(known["mode"], color, brightness, known["min_kelvin"], known["max_kelvin"])
+
+    def mode(self, entity):
+        with self.lock:
+            known = self.states.get(entity)
+        return known["mode"] if known is not None else "rgb"
+
+    def capabilities(self, entity):
+        # Everything the payload depends on besides the color, lights that differ here cannot share a call.
+        # The kelvin range only matters to color temperature lights
+        with self.lock:
+            known = self.states.get(entity)
+        if known is None:
+            return ("rgb",)
+        if known["mode"] == "color_temp":
+            return known["mode"], known["min_kelvin"], known["max_kelvin"]
+        return (known["mode"],)
+
+    def is_on(self, entity):
+        with self.lock:
+            known = self.states.get(entity)
+        return known is not None and known["state"] == "on"
+
+    def any_on(self, entities):
+        return any(self.is_on(entity) for entity in entities)
+
+    def stats(self):
+        return {"entity_refreshes": self.refreshes, "entity_events": self.events}
@@ -0,0 +1,500 @@
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Which color attributes a light can take, by its supported_color_modes
+COLOR_MODES = ("hs", "xy", "rgb", "rgbw", "rgbww")
+COLOR_KEYS = ("rgb_color", "hs_color", "xy_color")
+
+# hang: requests are accepted but never answered, refuse: connections are refused or dropped
+OUTAGES = (None, "hang", "refuse")
+
+
+class FakeHAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def unavailable(self):
+        fake = self.server.fake
+        if fake.outage is None:
+            return False
+
+        # A hanging request is held until the outage ends and then dropped without an answer
+        fake.count("dropped")
+        fake.released.wait()
+        self.close_connection = True
+        return True
+
+    def authorized(self):
+        return self.headers.get("Authorization") == f"Bearer {self.server.fake.token}"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        fake = self.server.fake
+        if self.unavailable():
+            return
+
+        if not self.authorized():
+            fake.count("unauthorized")
+            self.send_json(401, {"message": "Unauthorized"})
+            return
+
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 4 or parts[:2] != ["api", "services"]:
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        fake.count("requests")
+        time.sleep(fake.delay())
+        if fake.should_fail():
+            fake.count("errors")
+            self.send_json(500, {"message": "Injected error"})
+            return
+
+        payload = json.loads(raw or b"{}")
+        fake.record(self.path, payload)
+        self.send_json(200, fake.call_service(parts[2], parts[3], payload))
+
+    def do_GET(self):
+        if self.unavailable():
+            return
+        if self.path == "/api/websocket" and self.headers.get("Upgrade", "").lower() == "websocket":
+            self.websocket_session()
+            return
+
+        fake = self.server.fake
+        if not self.authorized():
+            fake.count("unauthorized")
+            self.send_json(401, {"message": "Unauthorized"})
+            return
+
+        if self.path == "/api/":
+            self.send_json(200, {"message": "API running."})
+        elif self.path == "/api/states":
+            fake.count("state_requests")
+            time.sleep(fake.delay())
+            self.send_json(200, fake.get_states())
+        elif self.path.startswith("/api/states/"):
+            state = fake.get_state(self.path[len("/api/states/"):])
+            if state is None:
+                self.send_json(404, {"message": "Entity not found."})
+            else:
+                self.send_json(200, state)
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+    def websocket_session(self):
+        fake = self.server.fake
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        self.close_connection = True
+        self.ws_lock = threading.Lock()
+        self.ws_closed = False
+        fake.count("ws_connections")
+
+        self.ws_send({"type": "auth_required", "ha_version": "fake"})
+        message = self.ws_recv()
+        if message is None or message.get("access_token") != fake.token:
+            fake.count("unauthorized")
+            self.ws_send({"type": "auth_invalid", "message": "Invalid access token or password"})
+            self.ws_close(1008)
+            return
+        self.ws_send({"type": "auth_ok", "ha_version": "fake"})
+        self.ws_token = message.get("access_token")
+
+        try:
+            self.ws_loop()
+        finally:
+            fake.unsubscribe(self)
+
+    def ws_loop(self):
+        fake = self.server.fake
+        while True:
+            message = self.ws_recv()
+            if message is None:
+                return
+
+            if self.unavailable():
+                return
+
+            # Like Home Assistant, sessions of a revoked token are closed
+            if self.ws_token != fake.token:
+                fake.count("unauthorized")
+                self.ws_close(1008)
+                return
+
+            fake.count("ws_messages")
+            reply = self.ws_handle(message)
+
+            # Replies are delayed independently, like Home Assistant handling calls concurrently
+            delay = fake.delay()
+            if delay > 0:
+                threading.Timer(delay, self.ws_send, args=(reply,)).start()
+            else:
+                self.ws_send(reply)
+
+    def ws_handle(self, message):
+        fake = self.server.fake
+        msg_id = message.get("id")
+
+        if message.get("type") == "subscribe_events":
+            fake.subscribe(self, msg_id, message.get("event_type"))
+            return {"id": msg_id, "type": "result", "success": True, "result": None}
+
+        if fake.should_fail():
+            fake.count("errors")
+            return {"id": msg_id, "type": "result", "success": False,
+                    "error": {"code": "home_assistant_error", "message": "Injected error"}}
+
+        if message.get("type") == "call_service":
+            payload = dict(message.get("service_data", {}))
+            payload.update(message.get("target", {}))
+            fake.record(f"/api/services/{message['domain']}/{message['service']}", payload)
+            fake.call_service(message["domain"], message["service"], payload)
+            return {"id": msg_id, "type": "result", "success": True,
+                    "result": {"context": {"id": str(msg_id)}}}
+
+        if message.get("type") == "get_states":
+            fake.count("state_requests")
+            return {"id": msg_id, "type": "result", "success": True, "result": fake.get_states()}
+
+        return {"id": msg_id, "type": "result", "success": False,
+                "error": {"code": "unknown_command", "message": "Unknown command."}}
+
+    def ws_send(self, message, opcode=0x1):
+        data = message if isinstance(message, bytes) else json.dumps(message).encode("utf-8")
+
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x80 | opcode, len(data))
+        elif len(data) < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+
+        with self.ws_lock:
+            # Nothing follows a close frame, also not replies delayed on a timer
+            if self.ws_closed:
+                return
+            try:
+                self.wfile.write(header + data)
+                self.wfile.flush()
+            except (OSError, ValueError):
+                pass
+            self.ws_closed = opcode == 0x8
+
+    def ws_close(self, code):
+        # Server side close handshake: the socket is shut only after the client's close frame, a stream
+        # that just ends makes the client log an internal error
+        self.ws_send(struct.pack("!H", code), opcode=0x8)
+        self.connection.settimeout(1.0)
+        try:
+            while self.ws_recv() is not None:
+                pass
+        except (OSError, ValueError, struct.error):
+            pass
+
+    def ws_recv(self):
+        # Minimal server side framing: unfragmented frames, client payloads are always masked
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return None
+
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+
+            mask = self.rfile.read(4) if head[1] & 0x80 else b"\x00\x00\x00\x00"
+            raw = self.rfile.read(length)
+            mask = (mask * (length // 4 + 1))[:length]
+            data = (int.from_bytes(raw, "big") ^ int.from_bytes(mask, "big")).to_bytes(length, "big")
+
+            if opcode == 0x8:
+                self.ws_send(bytes(data[:2]), opcode=0x8)
+                return None
+            if opcode == 0x9:
+                self.ws_send(bytes(data), opcode=0xA)
+                continue
+            if opcode == 0x1:
+                return json.loads(data.decode("utf-8"))
+
+
+class FakeHA:
+    def __init__(self, token="fake-token", host="127.0.0.1", port=0, entities=None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, seed=0):
+        self.token = token
+
+        # Injected per request: latency +- jitter seconds, and a share of failing calls
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+        self.outage = None
+        self.released = threading.Event()
+        self.released.set()
+
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.calls = []
+
+        # (WebSocket session, subscription id) pairs that get state_changed events
+        self.subscribers = []
+
+        # Unknown entities are created on first use unless a fixed list is given
+        self.auto_create = entities is None
+        self.states = {}
+        for entity in entities or []:
+            self.add_entity(entity)
+
+        self.httpd = self.make_server((host, port))
+        self.thread = None
+
+    def make_server(self, address):
+        httpd = ThreadingHTTPServer(address, FakeHAHandler)
+        httpd.daemon_threads = True
+        httpd.fake = self
+        return httpd
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, path, payload):
+        with self.lock:
+            self.calls.append((path, payload))
+
+    def delay(self):
+        if not self.latency and not self.jitter:
+            return 0.0
+        with self.lock:
+            return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def subscribe(self, session, msg_id, event_type):
+        if event_type in (None, "state_changed"):
+            with self.lock:
+                self.subscribers.append((session, msg_id))
+
+    def unsubscribe(self, session):
+        with self.lock:
+            self.subscribers = [(s, i) for s, i in self.subscribers if s is not session]
+
+    def publish(self, entity, old_state, new_state):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for session, msg_id in subscribers:
+            session.ws_send({"id": msg_id, "type": "event", "event": {
+                "event_type": "state_changed",
+                "data": {"entity_id": entity, "old_state": old_state, "new_state": new_state},
+            }})
+
+    def add_entity(self, entity, color_modes=("rgb",), state="off"):
+        now = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            self.states[entity] = {
+                "entity_id": entity,
+                "state": state,
+                "attributes": {
+                    "supported_color_modes": list(color_modes),
+                    "color_mode": None,
+                    "rgb_color": None,
+                    "hs_color": None,
+                    "xy_color": None,
+                    "color_temp_kelvin": None,
+                    "brightness": None,
+                    "min_color_temp_kelvin": 2000,
+                    "max_color_temp_kelvin": 6500,
+                    "friendly_name": entity,
+                },
+                "last_changed": now,
+                "last_updated": now,
+            }
+
+    def set_state(self, entity, value):
+        # An outside change, e.g. a light going unavailable or being switched at the wall
+        with self.lock:
+            state = self.states[entity]
+            before = json.loads(json.dumps(state))
+            state["state"] = value
+            state["last_updated"] = datetime.now(timezone.utc).isoformat()
+            after = json.loads(json.dumps(state))
+        self.publish(entity, before, after)
+
+    def get_states(self):
+        with self.lock:
+            return json.loads(json.dumps(list(self.states.values())))
+
+    def get_state(self, entity):
+        with self.lock:
+            state = self.states.get(entity)
+            return json.loads(json.dumps(state)) if state is not None else None
+
+    def call_service(self, domain, service, data):
+        entity_ids = data.get("entity_id", [])
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+
+        if domain != "light" or service not in ("turn_on", "turn_off"):
+            return []
+
+        for entity in entity_ids:
+            if entity not in self.states and self.auto_create:
+                self.add_entity(entity)
+
+        # Like Home Assistant, the answer lists the states that changed during the call
+        changed = []
+        events = []
+        now = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            for entity in entity_ids:
+                state = self.states.get(entity)
+                if state is None or state["state"] == "unavailable":
+                    self.counters["missing"] = self.counters.get("missing", 0) + 1
+                    continue
+
+                before = json.dumps(state)
+                attributes = state["attributes"]
+                modes = attributes["supported_color_modes"]
+                if service == "turn_on":
+                    # Attributes the light cannot show are counted and dropped
+                    color = any(mode in COLOR_MODES for mode in modes)
+                    unsupported = ([key for key in COLOR_KEYS if key in data and not color]
+                                   + (["color_temp_kelvin"] if "color_temp_kelvin" in data
+                                      and "color_temp" not in modes else [])
+                                   + (["brightness"] if "brightness" in data and modes == ["onoff"] else []))
+                    if unsupported:
+                        self.counters["unsupported"] = self.counters.get("unsupported", 0) + 1
+
+                    state["state"] = "on"
+                    attributes["color_mode"] = modes[0]
+                    for key in COLOR_KEYS + ("color_temp_kelvin", "brightness"):
+                        if key in data and key not in unsupported:
+                            attributes[key] = data[key]
+                    if modes != ["onoff"] and attributes["brightness"] is None:
+                        attributes["brightness"] = 255
+                else:
+                    state["state"] = "off"
+                    attributes.update({"color_mode": None, "rgb_color": None, "hs_color": None, "xy_color": None,
+                                       "color_temp_kelvin": None, "brightness": None})
+
+                if json.dumps(state) != before:
+                    state["last_updated"] = now
+                    changed.append(json.loads(json.dumps(state)))
+                    events.append((entity, json.loads(before), changed[-1]))
+
+        for event in events:
+            self.publish(*event)
+        return changed
+
+    def revoke(self, token="revoked-token"):
+        # The old token stops working, as after deleting it in the user profile
+        self.token = token
+
+    def set_outage(self, outage):
+        if outage not in OUTAGES:
+            raise ValueError(f"Unknown outage {outage!r}")
+
+        previous, self.outage = self.outage, outage
+        if outage == "hang":
+            self.released.clear()
+        else:
+            self.released.set()
+
+        # Refusing closes the listening socket, so new connections fail right away
+        if outage == "refuse" and previous != "refuse" and self.thread is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        elif previous == "refuse" and outage != "refuse" and self.thread is not None:
+            self.httpd = self.make_server(self.httpd.server_address[:2])
+            self.start()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.calls.clear()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.released.set()
+        if self.outage != "refuse":
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local Home Assistant stand-in")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--token", default="fake-token")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds of random extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail")
+    parser.add_argument("--entities", nargs="*", default=None, help="fixed entity list (default: create on use)")
+    parser.add_argument("--outage", choices=["hang", "refuse"], default=None,
+                        help="never answer, or drop every connection right after accepting it")
+    args = parser.parse_args()
+
+    fake = FakeHA(args.token, port=args.port, entities=args.entities, latency=args.latency, jitter=args.jitter,
+                  error_rate=args.error_rate)
+    fake.set_outage(args.outage)
+    print(f"Fake Home Assistant on {fake.url} (token: {args.token})")
+    fake.httpd.serve_forever()
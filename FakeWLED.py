@@ -0,0 +1,98 @@
+import argparse
+import socket
+import threading
+import time
+
+import numpy as np
+
+from WLED import DDP_FLAGS, DNRGB, DRGB
+
+
+def decode_packet(data):
+    if data[0] == DRGB:
+        return "drgb", 0, np.frombuffer(data, dtype=np.uint8, offset=2).reshape(-1, 3)
+    if data[0] == DNRGB:
+        start = int.from_bytes(data[2:4], "big")
+        return "dnrgb", start, np.frombuffer(data, dtype=np.uint8, offset=4).reshape(-1, 3)
+    if data[0] & 0xC0 == DDP_FLAGS & 0xC0:
+        offset = int.from_bytes(data[4:8], "big")
+        return "ddp", offset // 3, np.frombuffer(data, dtype=np.uint8, offset=10).reshape(-1, 3)
+    raise ValueError(f"Unknown packet type {data[0]}")
+
+
+class FakeWLED:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.2)
+        self.host = host
+        self.port = self.sock.getsockname()[1]
+
+        # (arrival time, datagram), filled by the receiver thread
+        self.lock = threading.Lock()
+        self.packets = []
+        self.running = threading.Event()
+        self.thread = None
+
+    def receive_loop(self):
+        while self.running.is_set():
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.lock:
+                self.packets.append((time.perf_counter(), data))
+
+    def wait(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.packets) >= count:
+                    break
+            time.sleep(0.01)
+        with self.lock:
+            return list(self.packets)
+
+    def reset(self):
+        with self.lock:
+            self.packets = []
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.receive_loop, name="fake-wled", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the frames a WLED controller would receive")
+    parser.add_argument("--port", type=int, default=21324)
+    args = parser.parse_args()
+
+    with FakeWLED("0.0.0.0", args.port) as fake:
+        print(f"Listening for DRGB/DNRGB/DDP on UDP port {fake.port}")
+        try:
+            while True:
+                time.sleep(1.0)
+                packets = fake.wait(0, timeout=0)
+                fake.reset()
+                if packets:
+                    protocol, start, leds = decode_packet(packets[-1][1])
+                    print(f"{protocol:>5} {len(packets):3d} FPS  start {start:3d}  {len(leds)} LEDs  "
+                          f"first {tuple(int(c) for c in leds[0]) if len(leds) else None}")
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class FrameFingerprint:
+    def __init__(self, grid=(64, 36), tolerance=2.0, region_budget=4096, block=16, idle_after=5,
+                 probe_interval=0.25):
+        self.grid = grid
+        self.tolerance = tolerance
+        self.region_budget = region_budget
+        # Samples compared together, a lamp region covers several blocks of its own
+        self.block = max(1, int(block))
+        self.idle_after = idle_after
+        self.probe_interval = probe_interval
+
+        # The frame being checked and the last frame that was analyzed. A match never replaces the
+        # reference, so slow fades add up until they count as a change
+        self.current = None
+        self.reference = None
+        self.geometry = None
+
+        self.streak = 0
+        self.last_probe = None
+
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def reset(self):
+        self.reference = None
+        self.geometry = None
+        self.streak = 0
+        self.last_probe = None
+
+    def compute(self, frame, index=None):
+        # A coarse grid over the whole frame plus a sparse subset of the sampled pixels.
+        # frame and index may be lists, one entry per captured screen
+        frames = frame if isinstance(frame, list) else [frame]
+        indexes = index if isinstance(frame, list) else [index]
+        columns, rows = self.grid
+
+        pieces = []
+        for frame, index in zip(frames, indexes):
+            step_x = max(1, frame.width // columns)
+            step_y = max(1, frame.height // rows)
+            pieces.append(frame.pixels[step_y // 2::step_y, step_x // 2::step_x][:rows, :columns].reshape(-1, 3))
+
+            if index is not None and len(index):
+                pixels, _ = frame.flat()
+                pieces.append(pixels.take(index[::max(1, len(index) // self.region_budget)], axis=0))
+
+        size = sum(len(piece) for piece in pieces)
+        if self.current is None or len(self.current) != size:
+            self.current = np.empty((size, 3), dtype=np.int16)
+        start = 0
+        for piece in pieces:
+            np.copyto(self.current[start:start + len(piece)], piece)
+            start += len(piece)
+        return self.current
+
+    def difference(self, fingerprint):
+        # Largest mean absolute difference of any block of consecutive samples. Dithering averages out
+        # within a block, a change confined to one lamp's region or one part of the grid does not
+        # disappear in the mean over the whole fingerprint
+        diff = np.abs(fingerprint - self.reference).sum(axis=1, dtype=np.int32)
+        starts = np.arange(0, len(diff), self.block)
+        sizes = np.diff(np.append(starts, len(diff))) * 3
+        return float((np.add.reduceat(diff, starts) / sizes).max()) if len(diff) else 0.0
+
+    def unchanged(self, frame, index=None, now=None):
+        self.last_probe = now
+        fingerprint = self.compute(frame, index)
+        geometry = tuple((f.left, f.top, f.width, f.height) for f in (frame if isinstance(frame, list) else [frame]))
+
+        same = (self.reference is not None and geometry == self.geometry
+                and len(self.reference) == len(fingerprint)
+                and self.difference(fingerprint) <= self.tolerance)
+
+        if same:
+            self.hits += 1
+            self.streak += 1
+        else:
+            # This frame is analyzed and becomes the new reference
+            self.current, self.reference = self.reference, fingerprint
+            self.geometry = geometry
+            self.misses += 1
+            self.streak = 0
+        return same
+
+    def should_probe(self, now):
+        # After a few identical frames the screen is only looked at every probe_interval
+        if self.streak < self.idle_after or self.last_probe is None or now - self.last_probe >= self.probe_interval:
+            return True
+
+        self.skipped += 1
+        return False
+
+    def stats(self):
+        return {"fingerprint_hits": self.hits, "fingerprint_misses": self.misses, "probes_skipped": self.skipped}
@@ -0,0 +1,215 @@
+import argparse
+import struct
+import time
+
+import numpy as np
+
+from ScreenCapture import CaptureBackend, Frame, make_capture
+
+# Header, then every frame as raw RGB rows, then the timestamps (float64) and cursor positions (int32 x, y).
+# Frames are read straight from a memory map, so replay never copies or decodes them
+MAGIC = b"OHSFRAME"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIIIQQ")
+HEADER_SIZE = 64
+
+
+class FrameRecorder:
+    def __init__(self, path, screen_size, step=1):
+        # step: keep every step-th pixel in both directions, 2 makes the file 4 times smaller
+        self.path = path
+        self.screen_size = tuple(screen_size)
+        self.step = max(1, int(step))
+        self.width = -(-self.screen_size[0] // self.step)
+        self.height = -(-self.screen_size[1] // self.step)
+
+        self.timestamps = []
+        self.cursors = []
+        self.started = None
+
+        self.file = open(path, "wb")
+        self.file.write(bytes(HEADER_SIZE))
+
+    def add(self, pixels, cursor=(0, 0), now=None):
+        # pixels: the whole screen, (height, width, 3) uint8
+        now = time.perf_counter() if now is None else now
+        if self.started is None:
+            self.started = now
+
+        small = pixels[::self.step, ::self.step]
+        if small.shape[:2] != (self.height, self.width):
+            raise ValueError(f"Frame is {pixels.shape[1]}x{pixels.shape[0]}, the recording "
+                             f"{self.screen_size[0]}x{self.screen_size[1]}")
+        self.file.write(np.ascontiguousarray(small).data)
+        self.timestamps.append(now - self.started)
+        self.cursors.append(cursor)
+
+    def close(self):
+        if self.file is None:
+            return
+        index_offset = self.file.tell()
+        self.file.write(np.asarray(self.timestamps, dtype=np.float64).tobytes())
+        self.file.write(np.asarray(self.cursors, dtype=np.int32).reshape(-1, 2).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.screen_size[0], self.screen_size[1], self.width,
+                                    self.height, self.step, len(self.timestamps), index_offset))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameRecording:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not a frame recording")
+        (magic, version, screen_width, screen_height, width, height, step, count,
+         index_offset) = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a frame recording")
+        if not count:
+            raise ValueError(f"{path} has no frames, the recorder was not closed")
+
+        self.path = path
+        self.screen_size = (screen_width, screen_height)
+        self.step = step
+        self.frames = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(count, height, width, 3))
+        self.timestamps = np.memmap(path, dtype=np.float64, mode="r", offset=index_offset, shape=(count,))
+        self.cursors = np.memmap(path, dtype=np.int32, mode="r", offset=index_offset + 8 * count, shape=(count, 2))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def duration(self):
+        return float(self.timestamps[-1])
+
+    def at(self, seconds):
+        # Last frame captured at or before this point of the recording
+        return max(0, int(np.searchsorted(self.timestamps, seconds, side="right")) - 1)
+
+
+class ReplayCapture(CaptureBackend):
+    name = "replay"
+
+    def __init__(self, path, speed=1.0, loop=True):
+        # speed: 1 plays at the recorded rate, 2 twice as fast, 0 only moves on with advance()
+        super().__init__()
+        self.recording = FrameRecording(path)
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        self.started = None
+
+        # Downsampled recordings are scaled back up into this buffer
+        self.upscaled = None
+
+    def screen_size(self):
+        return self.recording.screen_size
+
+    def advance(self, step=1):
+        count = len(self.recording)
+        self.index = (self.index + step) % count if self.loop else min(self.index + step, count - 1)
+
+    def current(self):
+        if self.speed > 0:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now
+            elapsed = (now - self.started) * self.speed
+            duration = self.recording.duration()
+            if self.loop and duration > 0:
+                elapsed %= duration
+            self.index = self.recording.at(elapsed)
+        return self.index
+
+    def cursor_position(self):
+        x, y = self.recording.cursors[self.current()]
+        return int(x), int(y)
+
+    def grab(self, bbox=None, screen=0):
+        if bbox is None:
+            bbox = (0, 0) + tuple(self.screen_size())
+        left, top, right, bottom = bbox
+        step = self.recording.step
+
+        # A view into the memory map, nothing is copied. Downsampled recordings hand out the stored
+        # pixels covering the box, the frame's scale maps screen positions onto them
+        left, top = left // step * step, top // step * step
+        small = self.recording.frames[self.current()]
+        return Frame(small[top // step:-(-bottom // step), left // step:-(-right // step)], left, top, step)
+
+    def grab_into(self, left, top, width, height, screen=0):
+        small = self.recording.frames[self.current()]
+        step = self.recording.step
+        if step == 1:
+            return small[top:top + height, left:left + width]
+
+        # Full resolution pixels for callers that need them, scaled up from the stored ones
+        first_row, first_column = top // step, left // step
+        block = small[first_row:-(-(top + height) // step), first_column:-(-(left + width) // step)]
+        rows, columns = block.shape[:2]
+        # Columns are repeated first, then whole rows are copied step times. A steady bounding box
+        # keeps its buffer
+        if self.upscaled is None or self.upscaled.shape != (rows, step, columns * step, 3):
+            self.upscaled = np.empty((rows, step, columns * step, 3), dtype=np.uint8)
+        self.upscaled[...] = np.repeat(block, step, axis=1)[:, None]
+
+        y = top - first_row * step
+        x = left - first_column * step
+        return self.upscaled.reshape(rows * step, columns * step, 3)[y:y + height, x:x + width]
+
+
+def record(args):
+    capture = make_capture(args.capture)
+    interval = 1.0 / max(args.fps, 0.1)
+    with FrameRecorder(args.output, capture.screen_size(), args.step) as recorder:
+        end = time.perf_counter() + args.duration
+        next_frame = time.perf_counter()
+        while time.perf_counter() < end:
+            frame = capture.grab()
+            recorder.add(frame.pixels, capture.cursor_position())
+            if args.synthetic_step and hasattr(capture, "advance"):
+                capture.advance(args.synthetic_step)
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+        count = len(recorder.timestamps)
+    print(f"Recorded {count} frames of {capture.screen_size()[0]}x{capture.screen_size()[1]} "
+          f"(pixel step {args.step}) to {args.output}")
+
+
+def info(args):
+    recording = FrameRecording(args.recording)
+    width, height = recording.screen_size
+    print(f"{args.recording}: {len(recording)} frames, {recording.duration():.1f} s, {width}x{height} screen, "
+          f"stored {recording.frames.shape[2]}x{recording.frames.shape[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the screen for replay with --capture replay")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="record the screen to a file")
+    p.add_argument("output")
+    p.add_argument("--capture", choices=["pil", "synthetic"], default="pil")
+    p.add_argument("--fps", type=float, default=10.0)
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--step", type=int, default=2, help="keep every N-th pixel")
+    p.add_argument("--synthetic-step", type=int, default=3, help="color shift per frame of the synthetic screen")
+    p.set_defaults(func=record)
+
+    p = sub.add_parser("info", help="frames, duration and size of a recording")
+    p.add_argument("recording")
+    p.set_defaults(func=info)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
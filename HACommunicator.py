@@ -1,118 +1,285 @@
-import pyautogui
-import requests
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from ColorAnalysis import ColorAnalyzer
+from EntityCache import light_payload
+from HATransport import HATransport, sent_results
+from ScreenCapture import Frame, PILCapture, bounding_box
 
 
 class HACommunicator:
-    def __init__(self, url, token, entity_lst, button_status, lamp_status):
+    TRANSITIONS = {"screen": 0.5, "average": 1, "crazy": 0.2}
+
+    def __init__(self, url, token, entity_lst, button_status, lamp_status, transport=None, capture=None,
+                 suppressor=None, batch_step=1, analyzer=None, metrics=None, fingerprint=None,
+                 budget=None, entity_cache=None, letterbox=None):
         self.URL = url
         self.HA_TOKEN = token
 
+        # A long-lived transport keeps its keep-alive pool between ticks
+        self._transport = transport
+        self._capture = capture
+        self._analyzer = analyzer
+
+        # Shared across ticks so unchanged colors are not sent again
+        self.suppressor = suppressor
+
+        # Optional BudgetScheduler, caps lamp updates per second and sends the worst lamps first
+        self.budget = budget
+
+        # Colors that fall into the same batch_step bucket share one multi-entity call
+        self.batch_step = max(1, int(batch_step))
+
+        # Optional StageMetrics, records capture/analysis/send timing and HA response time per entity
+        self.metrics = metrics
+
+        # Optional FrameFingerprint, analysis is skipped for frames that match the previous one
+        self.fingerprint = fingerprint
+
+        # Optional EntityCache, picks the payload each light can take and skips missing lights
+        self.entity_cache = entity_cache
+
+        # Optional ActiveArea, lamp regions are moved off black bars into the picture
+        self.letterbox = letterbox
+
         self.ENTITY_LST = entity_lst
 
         self.BUTTON_STATUS = button_status
         self.LAMP_STATUS = lamp_status
 
-        self.headers = {
-            "Authorization": f"Bearer {self.HA_TOKEN}",
-            "Content-Type": "application/json",
-        }
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = HATransport(self.URL, self.HA_TOKEN)
+        return self._transport
+
+    @property
+    def capture(self):
+        if self._capture is None:
+            self._capture = PILCapture()
+        return self._capture
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            self._analyzer = ColorAnalyzer()
+        return self._analyzer
+
+    def timed(self, stage):
+        return self.metrics.timer(stage) if self.metrics is not None else nullcontext()
 
-        self.turn_on_url = f"{self.URL}/api/services/light/turn_on"
-        self.turn_off_url = f"{self.URL}/api/services/light/turn_off"
+    def is_unchanged(self, frame, index=None):
+        return self.fingerprint is not None and self.fingerprint.unchanged(frame, index, time.monotonic())
 
     def turn_off(self):
         if self.URL and self.HA_TOKEN and self.ENTITY_LST:
-            payload = {
-                "entity_id": self.ENTITY_LST,
-            }
+            entities = [e for e in self.ENTITY_LST if self.entity_cache is None or self.entity_cache.usable(e)]
+            if entities:
+                payload = {
+                    "entity_id": entities,
+                }
 
-            response = requests.post(self.turn_off_url, headers=self.headers, json=payload)
+                result = self.transport.wait([self.transport.call_service("light", "turn_off", payload)])[0]
+                self.record_result(entities, result, "off")
 
-            # print("Statuscode:", response.status_code)
-            # print("Response:", response.text)
-            if response.text == "[]":
+            # The cache knows the real state afterwards, without it a successful call has to do
+            if self.entity_cache is not None and self.entity_cache.loaded:
+                self.LAMP_STATUS.lamp_status = self.entity_cache.any_on(entities)
+            else:
                 self.LAMP_STATUS.lamp_status = False
 
-    def screen_mode(self, position_lst):
-        if self.BUTTON_STATUS:
-            self.LAMP_STATUS.lamp_status = True
+            if self.suppressor is not None:
+                self.suppressor.forget()
 
-            for entity in self.ENTITY_LST:
-                x, y = position_lst[self.ENTITY_LST.index(entity)].position
-                r, g, b = pyautogui.pixel(x, y)
+    def record_result(self, entities, result, state):
+        if self.entity_cache is None:
+            return
+        # REST answers with the list of states that changed, WebSocket only with the call context
+        self.entity_cache.assume(entities, state)
+        if isinstance(result, list):
+            self.entity_cache.update(result)
 
-                payload = {
-                    "entity_id": entity,
-                    "rgb_color": [r, g, b],
-                    "brightness": 255,
-                    "transition": 0.5
-                }
+    def sample(self, points, screen=0):
+        # One grab of the bounding box of all sampling points per tick
+        with self.timed("capture"):
+            frame = self.capture.grab(bounding_box(points, self.capture.layout().size(screen)), screen)
+        with self.timed("analysis"):
+            return [tuple(rgb) for rgb in frame.read(points).tolist()]
 
-                response = requests.post(self.turn_on_url, headers=self.headers, json=payload)
-                # print("Statuscode:", response.status_code)
-                # print("Antwort:", response.text)
+    def screen_segments(self, sampler):
+        # Every lamp region and strip segment is reduced from one frame per screen with lamps on it,
+        # each only the bounding box of that screen's regions
+        layout = self.capture.layout()
+        parts = sampler.by_screen(layout)
+        if self.letterbox is not None:
+            self.detect_letterbox([screen for screen, _, _ in parts])
+            # Regions moved into the picture, still grabbed as one bounding box per screen
+            parts = [(screen, part.retarget(self.letterbox.rect(screen), layout.size(screen)), part_rows)
+                     for screen, part, part_rows in parts]
+        with self.timed("capture"):
+            frames = [self.capture.grab(part.bbox(layout.size(screen)), screen) for screen, part, _ in parts]
+        indexes = [part.index(frame) if len(part) else None for frame, (_, part, _) in zip(frames, parts)]
+        if self.is_unchanged(frames, indexes):
+            return None
+        with self.timed("analysis"):
+            if len(parts) == 1:
+                return parts[0][1].reduce(frames[0], self.analyzer.pool)
+            rows = np.empty((int(sampler.rows[-1]), 3), dtype=np.uint8)
+            for frame, (_, part, part_rows) in zip(frames, parts):
+                rows[part_rows] = part.reduce(frame, self.analyzer.pool)
+            return rows
 
-        else:
-            if self.LAMP_STATUS.lamp_status:
-                self.turn_off()
+    def detect_letterbox(self, screens):
+        # The bars are looked for in a few thin row and column grabs, a few times per second
+        now = time.monotonic()
+        for screen in screens:
+            if self.letterbox.due(screen, now):
+                with self.timed("letterbox"):
+                    self.letterbox.probe(screen, self.capture, self.capture.layout().size(screen), now)
 
-    def crazy_mode(self):
-        if self.BUTTON_STATUS:
-            self.LAMP_STATUS.lamp_status = True
+    def screen_colors(self, sampler):
+        rows = self.screen_segments(sampler)
+        if rows is None:
+            return None
+        rows = sampler.lamp_colors(rows)
+        return [tuple(rgb) for rgb in rows.tolist()][:len(self.ENTITY_LST)]
 
-            for entity in self.ENTITY_LST:
-                x, y = pyautogui.position()
-                r, g, b = pyautogui.pixel(x, y)
+    def crazy_colors(self):
+        screen, position = self.capture.cursor_screen()
+        r, g, b = self.sample([position], screen)[0]
 
-                payload = {
-                    "entity_id": entity,
-                    "rgb_color": [r, g, b],
-                    "brightness": 255,
-                    "transition": 0.2
-                }
+        return [(r, g, b)] * len(self.ENTITY_LST)
 
-                response = requests.post(self.turn_on_url, headers=self.headers, json=payload)
-                # print("Statuscode:", response.status_code)
-                # print("Antwort:", response.text)
-        else:
-            if self.LAMP_STATUS.lamp_status:
-                self.turn_off()
-
-    def average_mode(self):
-        if self.BUTTON_STATUS:
-            self.LAMP_STATUS.lamp_status = True
-            width, height = pyautogui.size()
-
-            points = [
-                (width // 4, height // 4),
-                (3 * width // 4, height // 4),
-                (width // 4, 3 * height // 4),
-                (3 * width // 4, 3 * height // 4),
-            ]
-
-            colors = []
-            for idx, (x, y) in enumerate(points, start=1):
-                r, g, b = pyautogui.pixel(x, y)
-                colors.append((r, g, b))
-
-            n = len(colors)
-            avg_r = sum(c[0] for c in colors) / n
-            avg_g = sum(c[1] for c in colors) / n
-            avg_b = sum(c[2] for c in colors) / n
-
-            avg_color = (round(avg_r), round(avg_g), round(avg_b))
-            for entity in self.ENTITY_LST:
-                payload = {
-                    "entity_id": entity,
-                    "rgb_color": avg_color,
-                    "brightness": 255,
-                    "transition": 1
-                }
+    def average_colors(self):
+        # Whole frame, downsampled inside the analyzer to a fixed pixel budget
+        with self.timed("capture"):
+            frame = self.capture.grab()
+        if self.is_unchanged(frame):
+            return None
+        if self.letterbox is not None:
+            # The whole screen is grabbed here anyway, it is only checked for bars as often as in Screen Mode
+            now = time.monotonic()
+            if self.letterbox.due(0, now):
+                with self.timed("letterbox"):
+                    self.letterbox.update(0, frame, self.capture.layout().size(0), now)
+            frame = self.crop(frame, self.letterbox.rect(0))
+        with self.timed("analysis"):
+            avg_color = self.analyzer.analyze(frame)
+        return [avg_color] * len(self.ENTITY_LST)
+
+    def crop(self, frame, rect):
+        # View of the content rectangle, black bars left out of the average
+        if rect is None:
+            return frame
+        left, top, right, bottom = rect
+        scale = frame.scale
+        pixels = frame.pixels[(top - frame.top) // scale:-(-(bottom - frame.top) // scale),
+                              (left - frame.left) // scale:-(-(right - frame.left) // scale)]
+        return Frame(pixels, left // scale * scale, top // scale * scale, scale)
+
+    def mode_colors(self, mode, sampler):
+        if mode == "screen":
+            return self.screen_colors(sampler)
+        if mode == "average":
+            return self.average_colors()
+        if mode == "crazy":
+            return self.crazy_colors()
+        return []
+
+    def mode_segments(self, mode, sampler):
+        # One row per point lamp and per strip segment, modes without a layout fill whole strips
+        # None when the fingerprint matched and the previous result still applies
+        if mode == "screen":
+            return self.screen_segments(sampler)
+        colors = self.mode_colors(mode, sampler)
+        return sampler.expand(colors) if colors is not None else None
+
+    def send_colors(self, colors, transition, now=None, brightness=None):
+        self.LAMP_STATUS.lamp_status = True
+
+        entities = self.ENTITY_LST[:len(colors)]
+        colors = colors[:len(entities)]
+        # Per lamp brightness from the color correction, full brightness without it
+        levels = [255] * len(entities) if brightness is None else [int(b) for b in brightness[:len(entities)]]
+
+        if self.entity_cache is not None:
+            # Missing and unavailable lights are skipped, as are on/off-only lights that are already on
+            wanted = [self.entity_cache.usable(e)
+                      and not (self.entity_cache.mode(e) == "onoff" and self.entity_cache.is_on(e))
+                      for e in entities]
+            entities = [e for e, w in zip(entities, wanted) if w]
+            colors = [color for color, w in zip(colors, wanted) if w]
+            levels = [level for level, w in zip(levels, wanted) if w]
+
+        if now is None:
+            now = time.monotonic()
+        if self.suppressor is not None:
+            changed = self.suppressor.select(entities, colors, levels, now, self.budget)
+            entities = [e for e, c in zip(entities, changed) if c]
+            colors = [color for color, c in zip(colors, changed) if c]
+            levels = [level for level, c in zip(levels, changed) if c]
+
+        # Calls are issued back to back and run concurrently up to the transport's in-flight cap.
+        # Each group is keyed by its lamps, so a call still queued from an earlier tick is replaced
+        futures = []
+        groups = []
+        with self.timed("send"):
+            for group, (r, g, b), level in self.batch(entities, colors, levels):
+                payload = {"entity_id": group[0] if len(group) == 1 else group}
+                if self.entity_cache is not None:
+                    payload.update(self.entity_cache.payload(group[0], (r, g, b), level))
+                else:
+                    payload.update(light_payload("rgb", (r, g, b), level))
+                payload["transition"] = transition
+
+                start = time.perf_counter()
+                future = self.transport.call_service("light", "turn_on", payload, tuple(group))
+                if self.metrics is not None:
+                    future.add_done_callback(self.response_timer(group, start))
+                futures.append(future)
+                groups.append((group, (r, g, b), level))
+
+            try:
+                self.transport.wait(futures)
+            finally:
+                # Lamps whose call went through count as sent even when another one failed or timed out
+                for i in sent_results(futures):
+                    self.record_result(groups[i][0], futures[i].result(), "on")
+                if self.suppressor is not None:
+                    sent = [groups[i] for i in sent_results(futures)]
+                    sent_entities = [entity for group, _, _ in sent for entity in group]
+                    sent_colors = [color for group, color, _ in sent for _ in group]
+                    sent_levels = [level for group, _, level in sent for _ in group]
+                    self.suppressor.mark_sent(sent_entities, sent_colors, sent_levels, now)
+
+    def response_timer(self, entities, start):
+        def done(future):
+            if future.cancelled():
+                self.metrics.count("ha_superseded")
+                return
+            self.metrics.record_entities(entities, time.perf_counter() - start)
+            if future.exception() is not None:
+                self.metrics.count("ha_errors")
+
+        return done
+
+    def batch(self, entities, colors, levels):
+        # Only lamps with the same brightness and payload capabilities (type, kelvin range) share a call,
+        # the color is averaged within the bucket
+        groups = {}
+        for entity, color, level in zip(entities, colors, levels):
+            capabilities = self.entity_cache.capabilities(entity) if self.entity_cache is not None else ("rgb",)
+            key = (tuple(c // self.batch_step for c in color), level, capabilities)
+            groups.setdefault(key, ([], []))
+            groups[key][0].append(entity)
+            groups[key][1].append(color)
 
-                response = requests.post(self.turn_on_url, headers=self.headers, json=payload)
-                # print("Statuscode:", response.status_code)
-                # print("Antwort:", response.text)
+        batches = []
+        for (_, level, _), (group, group_colors) in groups.items():
+            n = len(group_colors)
+            color = tuple(round(sum(c[i] for c in group_colors) / n) for i in range(3))
+            batches.append((group, color, level))
 
-        else:
-            if self.LAMP_STATUS.lamp_status:
-                self.turn_off()
+        return batches
@@ -0,0 +1,163 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HAAuthError(Exception):
+    pass
+
+
+def is_timeout(error):
+    return isinstance(error, (TimeoutError, requests.Timeout))
+
+
+def is_unreachable(error):
+    # Refused, reset, timed out or closed connections, as opposed to Home Assistant answering with an error
+    return isinstance(error, (ConnectionError, requests.ConnectionError)) or is_timeout(error)
+
+
+def is_rejected(error):
+    # The token was refused, also when it stops working after it was accepted (revoked or deleted)
+    if isinstance(error, HAAuthError):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code in (401, 403)
+
+
+def wait_results(futures, timeout=None):
+    # One deadline for the whole tick, calls still running after it are left to finish on their own
+    _, pending = wait_futures(futures, timeout)
+    if pending:
+        raise TimeoutError(f"{len(pending)} of {len(futures)} Home Assistant calls did not finish in time")
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except CancelledError:
+            # Superseded by a newer call for the same lamps
+            results.append(None)
+    return results
+
+
+def sent_results(futures):
+    # Indexes of the calls that finished successfully, also after wait_results raised
+    return [i for i, future in enumerate(futures)
+            if future.done() and not future.cancelled() and future.exception() is None]
+
+
+class HATransport:
+    kind = "rest"
+
+    def __init__(self, url, token, connect_timeout=2.0, read_timeout=5.0, pool_size=4, max_in_flight=8):
+        self.URL = url.rstrip("/")
+        self.HA_TOKEN = token
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.validated = False
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.HA_TOKEN}",
+            "Content-Type": "application/json",
+        })
+
+        # Calls run on a small pool, at most max_in_flight at a time, the rest wait in its queue
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.executor = None
+        # Reentrant, a call that is already done runs its release callback right away
+        self.lock = threading.RLock()
+        self.queued = {}
+        self.stats = {"superseded": 0}
+
+        # One pool for the single Home Assistant host, kept alive across ticks
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, self.max_in_flight),
+                                   max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def matches(self, url, token, connect_timeout, read_timeout, max_in_flight=8):
+        return (self.URL == url.rstrip("/") and self.HA_TOKEN == token
+                and self.timeout == (connect_timeout, read_timeout) and self.max_in_flight == max_in_flight)
+
+    def validate(self):
+        # Once per connection: the URL has to answer like Home Assistant and accept the token
+        response = self.session.get(f"{self.URL}/api/", timeout=(self.timeout[0], self.timeout[0]))
+        if response.status_code in (401, 403):
+            raise HAAuthError("Home Assistant rejected the access token")
+        if response.status_code != 200:
+            raise HAAuthError(f"{self.URL} does not look like Home Assistant (HTTP {response.status_code})")
+        self.validated = True
+
+    def post(self, path, payload):
+        return self.session.post(f"{self.URL}{path}", json=payload, timeout=self.timeout)
+
+    def request(self, domain, service, data):
+        response = self.post(f"/api/services/{domain}/{service}", data)
+        # print("Statuscode:", response.status_code)
+        # print("Response:", response.text)
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    def call_service(self, domain, service, data, key=None):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="ha-rest")
+
+            # A call for the same lamps that is still queued would only show an outdated color
+            previous = self.queued.pop(key, None) if key is not None else None
+            if previous is not None and previous.cancel():
+                self.stats["superseded"] += 1
+
+            future = self.executor.submit(self.request, domain, service, data)
+            if key is not None:
+                self.queued[key] = future
+                future.add_done_callback(lambda f: self.release(key, f))
+
+        return future
+
+    def release(self, key, future):
+        with self.lock:
+            if self.queued.get(key) is future:
+                del self.queued[key]
+
+    def wait(self, futures):
+        # Queued calls take their turn, so the deadline covers a full connect and read
+        return wait_results(futures, sum(self.timeout))
+
+    def get(self, path):
+        return self.session.get(f"{self.URL}{path}", timeout=self.timeout)
+
+    def get_states(self):
+        response = self.get("/api/states")
+        response.raise_for_status()
+        return response.json()
+
+    def connection_stats(self):
+        opened = 0
+        sent = 0
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+
+        return {
+            "requests": sent,
+            "opened": opened,
+            "reused": max(0, sent - opened),
+        }
+
+    def close(self):
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+            self.queued.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -0,0 +1,214 @@
+import itertools
+import json
+import threading
+from concurrent.futures import Future
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+
+from HATransport import HAAuthError, wait_results
+
+
+class HAServiceError(Exception):
+    pass
+
+
+class HAWebSocketTransport:
+    kind = "websocket"
+
+    def __init__(self, url, token, connect_timeout=2.0, read_timeout=5.0, max_in_flight=8):
+        self.URL = url.rstrip("/")
+        self.HA_TOKEN = token
+
+        self.timeout = (connect_timeout, read_timeout)
+
+        if self.URL.startswith("https://"):
+            self.ws_url = "wss://" + self.URL[len("https://"):] + "/api/websocket"
+        else:
+            self.ws_url = "ws://" + self.URL.split("://", 1)[-1] + "/api/websocket"
+
+        self.lock = threading.Lock()
+        self.ws = None
+        self.reader = None
+        self.validated = False
+
+        self.ids = itertools.count(1)
+        self.pending = {}
+
+        # event type -> callback, subscribed again on every new connection
+        self.subscriptions = {}
+        self.handlers = {}
+
+        # Messages beyond max_in_flight wait here until a result comes back, newest per key only
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.backlog = {}
+
+        self.stats = {"connections": 0, "sent": 0, "results": 0, "errors": 0, "superseded": 0}
+
+    def matches(self, url, token, connect_timeout, read_timeout, max_in_flight=8):
+        return (self.URL == url.rstrip("/") and self.HA_TOKEN == token
+                and self.timeout == (connect_timeout, read_timeout) and self.max_in_flight == max_in_flight)
+
+    def connect(self):
+        connect_timeout, read_timeout = self.timeout
+
+        ws = connect(self.ws_url, open_timeout=connect_timeout, close_timeout=connect_timeout, compression=None,
+                     proxy=None, max_size=None)
+
+        try:
+            message = json.loads(ws.recv(timeout=read_timeout))
+            if message.get("type") == "auth_required":
+                ws.send(json.dumps({"type": "auth", "access_token": self.HA_TOKEN}))
+                message = json.loads(ws.recv(timeout=read_timeout))
+
+            if message.get("type") != "auth_ok":
+                raise HAAuthError(message.get("message", "Authentication failed"))
+        except ConnectionClosed as e:
+            ws.close()
+            raise ConnectionError("Home Assistant closed the WebSocket during authentication") from e
+        except Exception:
+            ws.close()
+            raise
+
+        self.ws = ws
+        self.pending = {}
+        self.handlers = {}
+        self.stats["connections"] += 1
+
+        for event_type, callback in self.subscriptions.items():
+            self.subscribe_message(event_type, callback)
+
+        self.reader = threading.Thread(target=self.read_loop, args=(ws, self.pending), name="ha-websocket",
+                                       daemon=True)
+        self.reader.start()
+
+    def validate(self):
+        # Connecting already authenticates, a wrong token fails with HAAuthError
+        with self.lock:
+            if self.ws is None:
+                self.connect()
+        self.validated = True
+
+    def send(self, message, key=None):
+        future = Future()
+
+        with self.lock:
+            if self.ws is None:
+                self.connect()
+
+            # A queued message for the same lamps would only show an outdated color
+            previous = self.backlog.pop(key, None) if key is not None else None
+            if previous is not None and previous[1].cancel():
+                self.stats["superseded"] += 1
+
+            if len(self.pending) >= self.max_in_flight:
+                self.backlog[key if key is not None else object()] = (message, future)
+            else:
+                self.transmit(message, future)
+
+        return future
+
+    def transmit(self, message, future):
+        message["id"] = next(self.ids)
+        self.pending[message["id"]] = future
+
+        try:
+            self.ws.send(json.dumps(message))
+        except ConnectionClosed as e:
+            self.pending.pop(message["id"], None)
+            self.ws = None
+            raise ConnectionError("Home Assistant WebSocket closed") from e
+
+        self.stats["sent"] += 1
+
+    def drain(self, ws):
+        # Called with the lock held whenever a result frees a slot
+        while self.backlog and self.ws is ws and len(self.pending) < self.max_in_flight:
+            key = next(iter(self.backlog))
+            message, future = self.backlog.pop(key)
+            try:
+                self.transmit(message, future)
+            except ConnectionError as e:
+                future.set_exception(e)
+
+    def subscribe(self, event_type, callback):
+        with self.lock:
+            self.subscriptions[event_type] = callback
+            if self.ws is not None:
+                self.subscribe_message(event_type, callback)
+
+    def subscribe_message(self, event_type, callback):
+        # Called with the lock held, events arrive with the id of the subscribe message
+        message = {"type": "subscribe_events", "event_type": event_type, "id": next(self.ids)}
+        self.handlers[message["id"]] = callback
+        self.ws.send(json.dumps(message))
+
+    def get_states(self):
+        return wait_results([self.send({"type": "get_states"})], self.timeout[1])[0]
+
+    def call_service(self, domain, service, data, key=None):
+        service_data = dict(data)
+        message = {
+            "type": "call_service",
+            "domain": domain,
+            "service": service,
+            "service_data": service_data,
+        }
+
+        entity_id = service_data.pop("entity_id", None)
+        if entity_id is not None:
+            message["target"] = {"entity_id": entity_id}
+
+        return self.send(message, key)
+
+    def wait(self, futures):
+        return wait_results(futures, self.timeout[1])
+
+    def read_loop(self, ws, pending):
+        try:
+            for raw in ws:
+                message = json.loads(raw)
+                if message.get("type") == "event":
+                    callback = self.handlers.get(message.get("id"))
+                    if callback is not None:
+                        callback(message.get("event", {}))
+                    continue
+                if message.get("type") != "result":
+                    continue
+
+                with self.lock:
+                    future = pending.pop(message.get("id"), None)
+                    self.stats["results"] += 1
+                    self.drain(ws)
+
+                if future is None:
+                    continue
+
+                if message.get("success"):
+                    future.set_result(message.get("result"))
+                else:
+                    self.stats["errors"] += 1
+                    error = message.get("error") or {}
+                    future.set_exception(HAServiceError(error.get("message", "Service call failed")))
+        except ConnectionClosed:
+            pass
+        finally:
+            with self.lock:
+                if self.ws is ws:
+                    self.ws = None
+                failed = list(pending.values())
+                pending.clear()
+                if self.ws is None:
+                    failed += [future for _, future in self.backlog.values()]
+                    self.backlog.clear()
+
+            for future in failed:
+                future.set_exception(ConnectionError("Home Assistant WebSocket closed"))
+
+    def close(self):
+        with self.lock:
+            ws = self.ws
+            self.ws = None
+
+        if ws is not None:
+            ws.close()
@@ -0,0 +1,98 @@
+import numpy as np
+
+STRATEGIES = ("error", "roundrobin")
+
+
+class BudgetScheduler:
+    def __init__(self, rate=0.0, entity_rate=0.0, burst=1.0, age_weight=1.0, max_wait=2.0, strategy="error"):
+        # rate: lamp updates per second over all lamps, entity_rate: per lamp, 0 means unlimited
+        self.rate = rate
+        self.entity_rate = entity_rate
+        self.burst = burst
+        self.age_weight = age_weight
+        self.max_wait = max_wait
+        self.strategy = strategy
+
+        self.tokens = None
+        self.last_refill = None
+        self.last_sent = {}
+        self.cursor = 0
+
+        # Lamps that wanted an update in the last tick but did not get one
+        self.pending = 0
+
+        self.picked = 0
+        self.deferred = 0
+
+    def configure(self, rate, entity_rate, strategy=None):
+        self.rate = max(0.0, rate)
+        self.entity_rate = max(0.0, entity_rate)
+        if strategy is not None:
+            self.strategy = strategy
+
+    def limited(self):
+        return self.rate > 0 or self.entity_rate > 0
+
+    def refill(self, now):
+        # Token bucket holding at most `burst` seconds worth of updates, and always room for one
+        capacity = max(1.0, self.rate * self.burst)
+        if self.tokens is None:
+            self.tokens = capacity
+        else:
+            self.tokens = min(capacity, self.tokens + max(0.0, now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def pick(self, entities, changed, errors, ages, now):
+        changed = np.asarray(changed, dtype=bool)
+        if not self.limited() or not changed.any():
+            self.pending = 0
+            return changed.tolist()
+
+        eligible = changed.copy()
+        if self.entity_rate > 0:
+            min_gap = 1.0 / self.entity_rate
+            eligible &= np.array([now - self.last_sent.get(e, -np.inf) >= min_gap for e in entities])
+
+        count = int(eligible.sum())
+        if self.rate > 0:
+            self.refill(now)
+            count = min(count, int(self.tokens))
+
+        candidates = np.flatnonzero(eligible)
+        if self.strategy == "roundrobin":
+            # Next lamps in list order after the last one served
+            order = candidates[np.argsort((candidates - self.cursor) % len(entities), kind="stable")]
+        else:
+            # Largest perceptual error first, growing with the time since the lamp was last sent.
+            # Lamps past max_wait go before everything else, oldest first, which bounds staleness
+            errors = np.asarray(errors, dtype=np.float64)[candidates]
+            # Never sent lamps have waited longest of all, otherwise lamps that are already in rotation
+            # can keep them out for good when the budget is short
+            ages = np.where(np.isinf(errors), np.inf, np.asarray(ages, dtype=np.float64)[candidates])
+            scores = errors * (1.0 + self.age_weight * np.minimum(ages, self.max_wait))
+            overdue = ages >= self.max_wait
+            scores = np.where(overdue, np.inf, scores)
+            order = candidates[np.lexsort((-ages, -scores))]
+
+        chosen = order[:count]
+        selected = np.zeros(len(entities), dtype=bool)
+        selected[chosen] = True
+
+        if self.strategy == "roundrobin" and len(chosen):
+            self.cursor = (int(chosen[-1]) + 1) % len(entities)
+        if self.rate > 0:
+            self.tokens -= len(chosen)
+        for index in chosen:
+            self.last_sent[entities[index]] = now
+
+        self.pending = int(changed.sum()) - len(chosen)
+        self.picked += len(chosen)
+        self.deferred += self.pending
+        return selected.tolist()
+
+    def forget(self):
+        self.last_sent.clear()
+        self.pending = 0
+
+    def stats(self):
+        return {"budget_picked": self.picked, "budget_deferred": self.deferred, "budget_pending": self.pending}
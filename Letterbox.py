@@ -0,0 +1,151 @@
+import numpy as np
+
+
+class LetterboxDetector:
+    def __init__(self, threshold=24, probes=8, confirm=4, tolerance=6, max_bar=0.3):
+        # threshold: brightest channel that still counts as black bar, probes: rows and columns looked at
+        # per check, confirm: checks a new rectangle has to be seen in a row before it is used
+        self.threshold = threshold
+        self.probes = probes
+        self.confirm = confirm
+        self.tolerance = tolerance
+        self.max_bar = max_bar
+
+        # Content rectangle (left, top, right, bottom) in screen pixels, None for the whole screen
+        self.rect = None
+        self.candidate = None
+        self.seen = 0
+
+        self.changes = 0
+
+    def reset(self):
+        self.rect = None
+        self.candidate = None
+        self.seen = 0
+
+    def bars(self, bright, size):
+        # First and last bright row (or column), None when the bars are not the same size on both
+        # sides. Uneven dark edges are a dark scene, not a letterbox
+        if not bright.any():
+            return None
+        first = int(bright.argmax())
+        last = len(bright) - int(bright[::-1].argmax())
+        before = first * size / len(bright)
+        after = (len(bright) - last) * size / len(bright)
+        if abs(before - after) > self.tolerance + 0.02 * size or max(before, after) > self.max_bar * size:
+            return None
+        return first, last
+
+    def positions(self, length):
+        return np.linspace(0, length - 1, min(self.probes, length)).astype(np.intp)
+
+    def probe_boxes(self, screen_size):
+        # The full height columns and full width rows measure() reads, as grab boxes
+        width, height = screen_size
+        return ([(x, 0, x + 1, height) for x in self.positions(width)],
+                [(0, y, width, y + 1) for y in self.positions(height)])
+
+    def measure(self, frame):
+        # A few full columns find the top and bottom bars, a few full rows the side bars
+        pixels = frame.pixels
+        height, width = pixels.shape[:2]
+        return self.measure_probes(pixels[:, self.positions(width)], pixels[self.positions(height)],
+                                   frame.left, frame.top, frame.scale)
+
+    def measure_probes(self, columns, rows, left=0, top=0, scale=1):
+        # columns: (height, n, 3), rows: (n, width, 3)
+        # numpy is slow on short trailing axes: columns are reduced as one flat row per screen row,
+        # the 3 channels of the rows with element-wise maxima
+        brightest = rows.max(axis=0)
+        brightest = np.maximum(np.maximum(brightest[:, 0], brightest[:, 1]), brightest[:, 2])
+        vertical = self.bars(columns.reshape(len(columns), -1).max(axis=1) > self.threshold, len(columns) * scale)
+        horizontal = self.bars(brightest > self.threshold, rows.shape[1] * scale)
+        if vertical is None or horizontal is None:
+            return None
+
+        (first_row, last_row), (first_column, last_column) = vertical, horizontal
+        return (left + first_column * scale, top + first_row * scale,
+                left + last_column * scale, top + last_row * scale)
+
+    def close(self, a, b):
+        return a is not None and b is not None and max(abs(x - y) for x, y in zip(a, b)) <= self.tolerance
+
+    def update(self, frame, screen_size):
+        # frame: the whole screen
+        return self.settle(self.measure(frame), screen_size)
+
+    def settle(self, measured, screen_size):
+        # Black frames and uneven bars leave the rectangle as it is, a new one has to be measured
+        # `confirm` times in a row, so fades and dark scenes do not make it jump
+        if measured is None or self.close(measured, self.rect or (0, 0) + tuple(screen_size)):
+            self.candidate = None
+            self.seen = 0
+            return self.rect
+
+        if self.close(measured, self.candidate):
+            self.seen += 1
+        else:
+            self.candidate = measured
+            self.seen = 1
+
+        if self.seen >= self.confirm:
+            full = self.close(self.candidate, (0, 0) + tuple(screen_size))
+            self.rect = None if full else self.candidate
+            self.candidate = None
+            self.seen = 0
+            self.changes += 1
+        return self.rect
+
+
+class ActiveArea:
+    def __init__(self, interval=0.25, **settings):
+        # One detector per screen, created when a screen is first seen. interval: seconds between
+        # checks of a screen, bars change with the video, not from frame to frame
+        self.interval = interval
+        self.settings = settings
+        self.detectors = {}
+        self.checked = {}
+
+    def detector(self, screen):
+        if screen not in self.detectors:
+            self.detectors[screen] = LetterboxDetector(**self.settings)
+        return self.detectors[screen]
+
+    def rect(self, screen):
+        return self.detector(screen).rect
+
+    def due(self, screen, now):
+        last = self.checked.get(screen)
+        return last is None or now - last >= self.interval
+
+    def update(self, screen, frame, screen_size, now=None):
+        if now is not None:
+            self.checked[screen] = now
+        return self.detector(screen).update(frame, screen_size)
+
+    def probe(self, screen, capture, screen_size, now=None):
+        # Only the rows and columns the detector reads are grabbed, a few thin strips instead of the
+        # whole screen. Grabs of one screen share a buffer, so each strip is copied out right away
+        detector = self.detector(screen)
+        column_boxes, row_boxes = detector.probe_boxes(screen_size)
+        width, height = screen_size
+        columns = np.empty((height, len(column_boxes), 3), dtype=np.uint8)
+        rows = np.empty((len(row_boxes), width, 3), dtype=np.uint8)
+        for i, box in enumerate(column_boxes):
+            columns[:, i] = capture.grab(box, screen).pixels[:, 0]
+        for i, box in enumerate(row_boxes):
+            rows[i] = capture.grab(box, screen).pixels[0]
+
+        if now is not None:
+            self.checked[screen] = now
+        return detector.settle(detector.measure_probes(columns, rows), screen_size)
+
+    def reset(self):
+        for detector in self.detectors.values():
+            detector.reset()
+        self.checked.clear()
+
+    def stats(self):
+        rects = [detector.rect for detector in self.detectors.values() if detector.rect is not None]
+        return {"letterbox_changes": sum(detector.changes for detector in self.detectors.values()),
+                "letterboxed_screens": len(rects)}
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGES = ("capture", "analysis", "filter", "send")
+
+# Upper bucket edges in milliseconds, the last bucket takes everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class RollingHistogram:
+    def __init__(self, size=512):
+        # Ring buffer of the most recent samples in seconds
+        self.samples = np.zeros(size)
+        self.count = 0
+        self.total = 0
+
+    def add(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.total += 1
+
+    def values(self):
+        return self.samples[:min(self.count, len(self.samples))]
+
+    def summary(self):
+        values = self.values() * 1000
+        if not len(values):
+            return {"count": self.total, "mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0,
+                    "buckets": [0] * (len(BUCKETS_MS) + 1)}
+
+        p50, p99 = np.percentile(values, (50, 99))
+        buckets = np.bincount(np.searchsorted(BUCKETS_MS, values), minlength=len(BUCKETS_MS) + 1)
+        return {
+            "count": self.total,
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+            "max_ms": float(values.max()),
+            "buckets": buckets.tolist(),
+        }
+
+
+class StageMetrics:
+    def __init__(self, size=512):
+        self.lock = threading.Lock()
+        self.size = size
+
+        self.stages = {stage: RollingHistogram(size) for stage in STAGES}
+        self.entities = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = RollingHistogram(self.size)
+            self.stages[stage].add(seconds)
+
+    def record_entities(self, entities, seconds):
+        with self.lock:
+            for entity in entities:
+                if entity not in self.entities:
+                    self.entities[entity] = RollingHistogram(self.size)
+                self.entities[entity].add(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def reset(self):
+        with self.lock:
+            self.stages = {stage: RollingHistogram(self.size) for stage in STAGES}
+            self.entities = {}
+            self.counters = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "uptime_s": time.time() - self.started,
+                "buckets_ms": list(BUCKETS_MS),
+                "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+                "entities": {entity: histogram.summary() for entity, histogram in self.entities.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def to_text(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+
+        # One "name{labels} value" line per metric, readable by humans and by Prometheus
+        lines = []
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"openhome_{name} {value}")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"openhome_{name}_total {value}")
+        for group, label in (("stages", "stage"), ("entities", "entity")):
+            prefix = "openhome_stage" if group == "stages" else "openhome_ha_response"
+            for key, summary in sorted(snapshot[group].items()):
+                lines.append(f'{prefix}_count{{{label}="{key}"}} {summary["count"]}')
+                for field in ("mean_ms", "p50_ms", "p99_ms", "max_ms"):
+                    lines.append(f'{prefix}_{field}{{{label}="{key}"}} {summary[field]:.3f}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        snapshot = self.snapshot()
+        text = json.dumps(snapshot, indent=2) if path.endswith(".json") else self.to_text(snapshot)
+
+        # Written next to the target and renamed, so readers never see half a file
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.to_text().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.snapshot()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
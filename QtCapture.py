@@ -0,0 +1,111 @@
+import numpy as np
+from PyQt6.QtCore import QObject, QThread, QCoreApplication, Qt, pyqtSignal
+from PyQt6.QtGui import QCursor, QGuiApplication, QImage
+
+from ScreenCapture import CaptureBackend, ScreenLayout
+
+
+def ordered_screens():
+    # Screen 0 is always the primary screen, the others keep Qt's order
+    primary = QGuiApplication.primaryScreen()
+    return sorted(QGuiApplication.screens(), key=lambda screen: screen is not primary)
+
+
+class QtGrabber(QObject):
+    requested = pyqtSignal(int, int, int, int, int)
+
+    def __init__(self, capture):
+        super().__init__()
+        self.capture = capture
+        self.result = None
+        self.requested.connect(self.grab, Qt.ConnectionType.BlockingQueuedConnection)
+
+    def grab(self, screen, left, top, width, height):
+        layout = self.capture.layout()
+        screens = self.capture.qt_screens
+        if not screens:
+            self.result = None
+            return
+
+        # grabWindow works in device independent pixels relative to the screen, lamp positions are
+        # physical pixels on their own screen
+        screen = layout.clamp(screen)
+        dpr = layout.screens[screen][4]
+        pm = screens[screen].grabWindow(0, int(left / dpr), int(top / dpr),
+                                        max(1, round(width / dpr)), max(1, round(height / dpr)))
+        self.result = pm.toImage().convertToFormat(QImage.Format.Format_RGB888)
+
+
+class QtCapture(CaptureBackend):
+    name = "qt"
+
+    def __init__(self):
+        super().__init__()
+        self.qt_screens = []
+
+        # QScreen.grabWindow has to run on the GUI thread, other threads hand the request over
+        self.grabber = QtGrabber(self)
+
+        # The layout is read once and again only when a screen is added, removed or changes
+        app = QGuiApplication.instance()
+        app.screenAdded.connect(self.layout_changed)
+        app.screenRemoved.connect(self.layout_changed)
+        app.primaryScreenChanged.connect(self.layout_changed)
+        self.layout_changed()
+
+    def layout_changed(self, *_):
+        screens = ordered_screens()
+        for screen in screens:
+            if screen not in self.qt_screens:
+                screen.geometryChanged.connect(self.layout_changed)
+                screen.logicalDotsPerInchChanged.connect(self.layout_changed)
+        self.qt_screens = screens
+        self.screen_layout = None
+
+    def layout(self):
+        if self.screen_layout is None:
+            geometries = [(screen.geometry(), screen.devicePixelRatio()) for screen in self.qt_screens]
+            self.screen_layout = ScreenLayout([(g.x(), g.y(), g.width(), g.height(), dpr) for g, dpr in geometries])
+        return self.screen_layout
+
+    def screen_names(self):
+        return [screen.name() for screen in self.qt_screens]
+
+    def screen_size(self):
+        if not self.qt_screens:
+            raise RuntimeError("No screen available")
+        return self.layout().size(0)
+
+    def cursor_position(self):
+        return self.cursor_screen()[1]
+
+    def cursor_screen(self):
+        pos = QCursor.pos()
+        return self.layout().locate(pos.x(), pos.y())
+
+    def grab_into(self, left, top, width, height, screen=0):
+        if QThread.currentThread() is QCoreApplication.instance().thread():
+            self.grabber.grab(screen, left, top, width, height)
+        else:
+            self.grabber.requested.emit(screen, left, top, width, height)
+
+        if self.grabber.result is None:
+            raise RuntimeError("Screen capture failed")
+
+        image = self.grabber.result
+        self.grabber.result = None
+
+        ptr = image.constBits()
+        ptr.setsize(image.sizeInBytes())
+        rows = np.frombuffer(ptr, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+        grabbed = rows[:, :image.width() * 3].reshape(image.height(), image.width(), 3)
+
+        pixels = self.reserve(width, height, screen)
+        h = min(height, grabbed.shape[0])
+        w = min(width, grabbed.shape[1])
+        pixels[:h, :w] = grabbed[:h, :w]
+        if h < height:
+            pixels[h:] = pixels[h - 1:h] if h else 0
+        if w < width:
+            pixels[:, w:] = pixels[:, w - 1:w] if w else 0
+        return pixels
@@ -0,0 +1,337 @@
+import copy
+
+import numpy as np
+
+from TiledAnalysis import chunk_bounds
+
+DEFAULT_REGION = {
+    "shape": "circle",
+    "radius": 10,
+    "width": 40,
+    "height": 40,
+    "weighting": "uniform",
+}
+
+DEFAULT_STRIP = {
+    "path": "around",
+    "segments": 30,
+    "depth": 60,
+    "reverse": False,
+}
+
+# Edges in clockwise order, every edge runs from its first to its second corner
+STRIP_PATHS = {
+    "bottom": ("bottom",),
+    "top": ("top",),
+    "left": ("left",),
+    "right": ("right",),
+    "u": ("left", "top", "right"),
+    "around": ("bottom", "left", "top", "right"),
+}
+
+
+class SamplingRegion:
+    segments = 1
+    screen = 0
+
+    def __init__(self, center, shape="circle", radius=10, width=40, height=40, weighting="uniform"):
+        self.center = (int(center[0]), int(center[1]))
+        self.shape = shape
+        self.radius = radius
+        self.width = width
+        self.height = height
+        self.weighting = weighting
+
+        if shape == "rect":
+            half_w = max(0, width // 2)
+            half_h = max(0, height // 2)
+        else:
+            half_w = half_h = max(0, radius)
+
+        dy, dx = np.mgrid[-half_h:half_h + 1, -half_w:half_w + 1]
+        if shape == "rect":
+            inside = np.ones(dx.shape, dtype=bool)
+        else:
+            inside = dx * dx + dy * dy <= half_w * half_w
+
+        dx = dx[inside]
+        dy = dy[inside]
+
+        if weighting == "gaussian":
+            sigma_x = max(half_w / 2.0, 0.5)
+            sigma_y = max(half_h / 2.0, 0.5)
+            weights = np.exp(-0.5 * ((dx / sigma_x) ** 2 + (dy / sigma_y) ** 2))
+        else:
+            weights = np.ones(dx.shape)
+
+        self.xs = (dx + self.center[0]).astype(np.intp)
+        self.ys = (dy + self.center[1]).astype(np.intp)
+        self.weights = (weights / weights.sum()).astype(np.float32)
+        self.starts = np.zeros(1, dtype=np.intp)
+
+    @classmethod
+    def from_settings(cls, center, settings):
+        values = dict(DEFAULT_REGION)
+        values.update(settings)
+        return cls(center, **{key: values[key] for key in DEFAULT_REGION})
+
+    def settings(self):
+        return {key: getattr(self, key) for key in DEFAULT_REGION}
+
+
+class StripRegion:
+    screen = 0
+
+    def __init__(self, bounds, path="around", segments=30, depth=60, reverse=False, pixel_budget=256):
+        left, top, right, bottom = bounds
+        self.bounds = bounds
+        self.path = path
+        self.segments = max(1, int(segments))
+        self.depth = max(1, int(depth))
+        self.reverse = bool(reverse)
+        self.center = ((left + right) // 2, (top + bottom) // 2)
+
+        # Corner coordinates and inward normal of every edge, walked clockwise
+        edges = {
+            "bottom": ((right, bottom), (left, bottom), (0, -1)),
+            "left": ((left, bottom), (left, top), (1, 0)),
+            "top": ((left, top), (right, top), (0, 1)),
+            "right": ((right, top), (right, bottom), (-1, 0)),
+        }
+        path_edges = [edges[name] for name in STRIP_PATHS[path]]
+        if self.reverse:
+            path_edges = [(end, start, normal) for start, end, normal in reversed(path_edges)]
+
+        starts = np.array([start for start, _, _ in path_edges], dtype=np.float64)
+        ends = np.array([end for _, end, _ in path_edges], dtype=np.float64)
+        normals = np.array([normal for _, _, normal in path_edges], dtype=np.float64)
+        lengths = np.abs(ends - starts).sum(axis=1)
+        directions = (ends - starts) / np.maximum(lengths, 1)[:, None]
+        offsets = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+        total = lengths.sum()
+
+        # Every segment has the same length, so all get the same grid of along x across samples
+        segment_length = total / self.segments
+        along = max(1, int(round(np.sqrt(pixel_budget * segment_length / self.depth))))
+        along = min(along, max(1, int(segment_length)), pixel_budget)
+        across = max(1, min(pixel_budget // along, self.depth))
+
+        arc = (np.arange(self.segments)[:, None] + (np.arange(along) + 0.5) / along) * segment_length
+        inset = (np.arange(across) + 0.5) / across * self.depth
+
+        edge = np.clip(np.searchsorted(offsets, arc, side="right") - 1, 0, len(path_edges) - 1)
+        position = starts[edge] + directions[edge] * (arc - offsets[edge])[..., None]
+        points = position[:, :, None, :] + normals[edge][:, :, None, :] * inset[None, None, :, None]
+
+        self.xs = np.clip(np.rint(points[..., 0]), left, right - 1).astype(np.intp).ravel()
+        self.ys = np.clip(np.rint(points[..., 1]), top, bottom - 1).astype(np.intp).ravel()
+        per_segment = along * across
+        self.weights = np.full(len(self.xs), 1.0 / per_segment, dtype=np.float32)
+        self.starts = np.arange(self.segments, dtype=np.intp) * per_segment
+
+    def segment_centers(self):
+        per_segment = len(self.xs) // self.segments
+        return np.stack([self.xs.reshape(self.segments, per_segment).mean(axis=1),
+                         self.ys.reshape(self.segments, per_segment).mean(axis=1)], axis=1)
+
+    def settings(self):
+        return {"type": "strip", "path": self.path, "segments": self.segments, "depth": self.depth,
+                "reverse": self.reverse}
+
+
+def make_region(center, settings, screen_size, screen=0):
+    # "type": "strip" lamps follow the screen edges, everything else samples around its position.
+    # Coordinates are physical pixels of the lamp's own screen
+    if settings.get("type") == "strip":
+        values = dict(DEFAULT_STRIP)
+        values.update(settings)
+        width, height = screen_size
+        region = StripRegion((0, 0, width, height), **{key: values[key] for key in DEFAULT_STRIP})
+    else:
+        region = SamplingRegion.from_settings(center, settings)
+    region.screen = screen
+    return region
+
+
+def remap_region(region, rect, screen_size):
+    # Copy of the region moved into the content rectangle (left, top, right, bottom) of a
+    # letterboxed screen. Point lamps keep their size and move with their scaled position, strips
+    # are squeezed onto the picture edges. Weights and segment starts stay the same
+    left, top, right, bottom = rect
+    width, height = screen_size
+    remapped = copy.copy(region)
+    if isinstance(region, StripRegion):
+        remapped.xs = (left + region.xs * (right - left) // max(width, 1)).astype(np.intp)
+        remapped.ys = (top + region.ys * (bottom - top) // max(height, 1)).astype(np.intp)
+        remapped.bounds = rect
+        remapped.center = ((left + right) // 2, (top + bottom) // 2)
+    else:
+        x, y = region.center
+        center = (left + x * (right - left) // max(width, 1), top + y * (bottom - top) // max(height, 1))
+        remapped.xs = np.clip(region.xs + (center[0] - x), left, right - 1)
+        remapped.ys = np.clip(region.ys + (center[1] - y), top, bottom - 1)
+        remapped.center = center
+    return remapped
+
+
+class RegionSampler:
+    def __init__(self, regions):
+        self.regions = list(regions)
+        self.points = [region.center for region in self.regions]
+
+        if self.regions:
+            self.xs = np.concatenate([region.xs for region in self.regions])
+            self.ys = np.concatenate([region.ys for region in self.regions])
+            self.weights = np.concatenate([region.weights for region in self.regions])[:, None]
+            sizes = [len(region.xs) for region in self.regions]
+            offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            self.starts = np.concatenate([region.starts + offset
+                                          for region, offset in zip(self.regions, offsets)]).astype(np.intp)
+        else:
+            self.xs = self.ys = np.empty(0, dtype=np.intp)
+            self.weights = np.empty((0, 1), dtype=np.float32)
+            self.starts = np.empty(0, dtype=np.intp)
+
+        # Output rows: one per point lamp, one per segment of a strip
+        self.counts = np.array([region.segments for region in self.regions], dtype=np.intp)
+        self.rows = np.concatenate(([0], np.cumsum(self.counts))).astype(np.intp)
+        self.segmented = bool((self.counts > 1).any())
+        self.labels = {}
+
+        # Frame relative indices, rebuilt only when the captured geometry changes
+        self.geometry = None
+        self.frame_index = None
+
+        # Runs of output rows reduced by one analysis thread each, per tile size
+        self.chunks = {}
+
+        # Regions grouped by screen, rebuilt only when the number of screens changes
+        self.screens = [region.screen for region in self.regions]
+        self.parts = None
+        self.parts_key = None
+
+        # Regions moved into the last content rectangle, rebuilt only when that rectangle changes
+        self.retargeted = None
+        self.remaps = 0
+
+    def __len__(self):
+        return len(self.regions)
+
+    def bbox(self, screen_size):
+        width, height = screen_size
+        if not self.regions:
+            return 0, 0, 1, 1
+
+        left = int(min(max(self.xs.min(), 0), width - 1))
+        top = int(min(max(self.ys.min(), 0), height - 1))
+        right = int(max(min(self.xs.max() + 1, width), left + 1))
+        bottom = int(max(min(self.ys.max() + 1, height), top + 1))
+        return left, top, right, bottom
+
+    def by_screen(self, layout):
+        # (screen, sampler of its regions, its rows in the output) per screen with lamps on it.
+        # With everything on one screen that is this sampler, so nothing changes for one monitor
+        key = len(layout)
+        if self.parts_key != key:
+            screens = [layout.clamp(screen) for screen in self.screens]
+            if len(set(screens)) <= 1:
+                self.parts = [(screens[0] if screens else 0, self, None)]
+            else:
+                self.parts = []
+                for screen in sorted(set(screens)):
+                    lamps = [lamp for lamp, s in enumerate(screens) if s == screen]
+                    rows = np.concatenate([np.arange(self.rows[lamp], self.rows[lamp + 1]) for lamp in lamps])
+                    self.parts.append((screen, RegionSampler([self.regions[lamp] for lamp in lamps]), rows))
+            self.parts_key = key
+        return self.parts
+
+    def retarget(self, rect, screen_size):
+        # rect: content rectangle from the letterbox detector, None when the picture fills the screen
+        if rect is None:
+            return self
+        key = (tuple(rect), tuple(screen_size))
+        if self.retargeted is None or self.retargeted[0] != key:
+            self.retargeted = (key, RegionSampler([remap_region(region, rect, screen_size)
+                                                   for region in self.regions]))
+            self.remaps += 1
+        return self.retargeted[1]
+
+    def index(self, frame):
+        pitch = frame.pixels.strides[0] // frame.pixels.strides[1]
+
+        geometry = (frame.left, frame.top, frame.width, frame.height, pitch, frame.scale)
+        if geometry != self.geometry:
+            frame_xs = np.clip((self.xs - frame.left) // frame.scale, 0, frame.width - 1)
+            frame_ys = np.clip((self.ys - frame.top) // frame.scale, 0, frame.height - 1)
+            self.frame_index = frame_ys * pitch + frame_xs
+            self.geometry = geometry
+
+        return self.frame_index
+
+    def reduce(self, frame, pool=None):
+        if not self.regions:
+            return np.empty((0, 3), dtype=np.uint8)
+
+        pixels, _ = frame.flat()
+        index = self.index(frame)
+        if pool is None or len(index) < 2 * pool.tile_pixels:
+            weighted = np.multiply(pixels.take(index, axis=0), self.weights, dtype=np.float32)
+            colors = np.add.reduceat(weighted, self.starts, axis=0)
+            return np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+
+        if pool.tile_pixels not in self.chunks:
+            self.chunks = {pool.tile_pixels: chunk_bounds(self.starts, len(index), pool.tile_pixels)}
+        bounds = np.append(self.starts, len(index))
+        colors = np.empty((len(self.starts), 3), dtype=np.float32)
+
+        def reduce_rows(rows):
+            # Same gather and sums per row as above, so the result does not change with the threads
+            first, last = rows
+            begin, end = bounds[first], bounds[last]
+            weighted = np.multiply(pixels.take(index[begin:end], axis=0), self.weights[begin:end],
+                                   dtype=np.float32)
+            colors[first:last] = np.add.reduceat(weighted, self.starts[first:last] - begin, axis=0)
+
+        pool.map(reduce_rows, self.chunks[pool.tile_pixels])
+        return np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+
+    def lamp_colors(self, rows):
+        # Strips collapse to the mean of their segments, for lamps that take one color
+        if not self.segmented:
+            return rows
+        means = np.add.reduceat(rows.astype(np.float32), self.rows[:-1], axis=0) / self.counts[:, None]
+        return np.clip(np.rint(means), 0, 255).astype(np.uint8)
+
+    def expand(self, colors):
+        # One color per lamp repeated over every segment of a strip
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        if not self.segmented:
+            return colors
+        counts = np.ones(len(colors), dtype=np.intp)
+        counts[:min(len(colors), len(self.counts))] = self.counts[:len(colors)]
+        return np.repeat(colors, counts, axis=0)
+
+    def split(self, rows, n):
+        # Per lamp: an (n, 3) segment array for strips, a plain color tuple otherwise
+        if not self.segmented:
+            return [tuple(color) for color in (rows[:n].tolist() if isinstance(rows, np.ndarray) else rows[:n])]
+
+        rows = np.asarray(rows).reshape(-1, 3)
+        lamps = []
+        for lamp in range(min(n, len(self.counts))):
+            first, last = self.rows[lamp], self.rows[lamp + 1]
+            if last > len(rows):
+                break
+            lamps.append(rows[first:last] if self.counts[lamp] > 1 else tuple(rows[first].tolist()))
+        return lamps
+
+    def row_labels(self, entities):
+        # Keys for the color filter, so it tracks every segment on its own
+        key = tuple(entities)
+        if key not in self.labels:
+            labels = []
+            for lamp, entity in enumerate(key):
+                count = self.counts[lamp] if lamp < len(self.counts) else 1
+                labels.extend([entity] if count == 1 else [f"{entity}#{i}" for i in range(count)])
+            self.labels = {key: labels}
+        return self.labels[key]
@@ -0,0 +1,18 @@
+import json
+import os
+from pathlib import Path
+
+
+def save_dir():
+    base_dir = Path(os.getenv("APPDATA", Path.home())) / "OpenhomeSync"
+    base_dir.mkdir(parents=True, exist_ok=True)
+    return base_dir
+
+
+def default_save_path():
+    return save_dir() / "save.dat"
+
+
+def load_save(path):
+    with Path(path).open("r", encoding="utf-8") as f:
+        return json.load(f)
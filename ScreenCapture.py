@@ -0,0 +1,227 @@
+import numpy as np
+
+
+def bounding_box(points, screen_size, margin=0):
+    width, height = screen_size
+
+    if not points:
+        return 0, 0, 1, 1
+
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+
+    left = max(0, min(min(xs) - margin, width - 1))
+    top = max(0, min(min(ys) - margin, height - 1))
+    right = max(left + 1, min(max(xs) + margin + 1, width))
+    bottom = max(top + 1, min(max(ys) + margin + 1, height))
+    return left, top, right, bottom
+
+
+class Frame:
+    def __init__(self, pixels, left=0, top=0, scale=1):
+        # scale: screen pixels per stored pixel, more than 1 for downsampled recordings
+        self.pixels = pixels
+        self.left = left
+        self.top = top
+        self.scale = scale
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    def pixel(self, x, y):
+        r, g, b = self.pixels[(y - self.top) // self.scale, (x - self.left) // self.scale]
+        return int(r), int(g), int(b)
+
+    def flat(self):
+        # Pixel rows as one (n, 3) array over the underlying buffer, so lookups are a single take()
+        pitch = self.pixels.strides[0] // self.pixels.strides[1]
+        count = (self.height - 1) * pitch + self.width
+        return np.lib.stride_tricks.as_strided(self.pixels, shape=(count, 3),
+                                               strides=self.pixels.strides[1:]), pitch
+
+    def read(self, points):
+        xs = (np.fromiter((p[0] for p in points), dtype=np.intp, count=len(points)) - self.left) // self.scale
+        ys = (np.fromiter((p[1] for p in points), dtype=np.intp, count=len(points)) - self.top) // self.scale
+
+        np.clip(xs, 0, self.width - 1, out=xs)
+        np.clip(ys, 0, self.height - 1, out=ys)
+        return self.pixels[ys, xs]
+
+
+class ScreenLayout:
+    def __init__(self, screens, key=None):
+        # screens: (left, top, width, height, dpr) per screen in the backend's desktop coordinates,
+        # logical pixels for Qt. Lamps and frames use physical pixels relative to their own screen,
+        # the conversion is worked out here once per layout change instead of on every grab
+        self.screens = [tuple(screen) for screen in screens] or [(0, 0, 1, 1, 1.0)]
+        self.key = key
+        self.sizes = [(max(1, round(w * dpr)), max(1, round(h * dpr))) for _, _, w, h, dpr in self.screens]
+
+    def __len__(self):
+        return len(self.screens)
+
+    def clamp(self, screen):
+        # Lamps on a screen that is gone fall back to the primary one
+        return screen if 0 <= screen < len(self.screens) else 0
+
+    def size(self, screen=0):
+        return self.sizes[self.clamp(screen)]
+
+    def to_desktop(self, screen, left, top, width, height):
+        x, y, _, _, dpr = self.screens[self.clamp(screen)]
+        return x + left / dpr, y + top / dpr, width / dpr, height / dpr
+
+    def locate(self, x, y):
+        # Desktop point -> screen and physical position on it
+        for screen, (left, top, width, height, dpr) in enumerate(self.screens):
+            if left <= x < left + width and top <= y < top + height:
+                return screen, (round((x - left) * dpr), round((y - top) * dpr))
+        left, top, _, _, dpr = self.screens[0]
+        return 0, (round((x - left) * dpr), round((y - top) * dpr))
+
+
+class CaptureBackend:
+    name = None
+
+    def __init__(self):
+        # One buffer per screen, frames of different screens are alive in the same tick
+        self.buffers = {}
+        self.screen_layout = None
+
+    def screen_size(self):
+        raise NotImplementedError
+
+    def cursor_position(self):
+        raise NotImplementedError
+
+    def layout(self):
+        # A single screen unless the backend knows more, rebuilt only when its size changes
+        size = tuple(self.screen_size())
+        if self.screen_layout is None or self.screen_layout.key != size:
+            self.screen_layout = ScreenLayout([(0, 0) + size + (1.0,)], key=size)
+        return self.screen_layout
+
+    def cursor_screen(self):
+        # Screen under the cursor and the cursor position on it
+        return 0, self.cursor_position()
+
+    def grab_into(self, left, top, width, height, screen=0):
+        raise NotImplementedError
+
+    def reserve(self, width, height, screen=0):
+        # The buffer only grows, so a steady bounding box never allocates again
+        buffer = self.buffers.get(screen)
+        if buffer is None or buffer.shape[0] < height or buffer.shape[1] < width:
+            old_h, old_w = buffer.shape[:2] if buffer is not None else (0, 0)
+            buffer = self.buffers[screen] = np.empty((max(height, old_h), max(width, old_w), 3), dtype=np.uint8)
+
+        return buffer[:height, :width]
+
+    def grab(self, bbox=None, screen=0):
+        # bbox in physical pixels of the screen, the frame keeps those coordinates
+        if bbox is None:
+            bbox = (0, 0) + tuple(self.layout().size(screen))
+
+        left, top, right, bottom = bbox
+        width = right - left
+        height = bottom - top
+
+        return Frame(self.grab_into(left, top, width, height, screen), left, top)
+
+
+class PILCapture(CaptureBackend):
+    name = "pil"
+
+    def screen_size(self):
+        import pyautogui
+
+        return tuple(pyautogui.size())
+
+    def cursor_position(self):
+        import pyautogui
+
+        return tuple(pyautogui.position())
+
+    def grab_into(self, left, top, width, height, screen=0):
+        # pyautogui only sees the primary screen
+        import pyautogui
+
+        image = pyautogui.screenshot(region=(left, top, width, height))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        pixels = self.reserve(width, height)
+        pixels[...] = np.asarray(image)
+        return pixels
+
+
+class SyntheticCapture(CaptureBackend):
+    name = "synthetic"
+
+    def __init__(self, width=1920, height=1080, seed=0, screens=1):
+        super().__init__()
+        self.size = (width, height)
+        self.cursor = (width // 2, height // 2)
+
+        # Extra screens sit to the right of the primary one, all on one desktop array
+        self.screens = max(1, screens)
+        rng = np.random.default_rng(seed)
+        # Noise over half the range: shifting it with advance() moves the mean color as well, noise
+        # over the full range would wrap around and keep the same mean
+        self.screen = rng.integers(0, 128, size=(height, width * self.screens, 3), dtype=np.uint8)
+        self.tick = 0
+
+    def screen_size(self):
+        return self.size
+
+    def cursor_position(self):
+        return self.cursor
+
+    def layout(self):
+        key = (self.size, self.screens)
+        if self.screen_layout is None or self.screen_layout.key != key:
+            width, height = self.size
+            self.screen_layout = ScreenLayout([(i * width, 0, width, height, 1.0) for i in range(self.screens)],
+                                              key=key)
+        return self.screen_layout
+
+    def set_screen(self, pixels):
+        self.screen = np.ascontiguousarray(pixels, dtype=np.uint8)
+        self.size = (self.screen.shape[1] // self.screens, self.screen.shape[0])
+
+    def advance(self, step=1):
+        # Cheap stand-in for a moving picture: shift every color channel
+        self.tick += step
+        np.add(self.screen, np.uint8(step), out=self.screen)
+
+    def grab_into(self, left, top, width, height, screen=0):
+        layout = self.layout()
+        x = layout.screens[layout.clamp(screen)][0]
+        pixels = self.reserve(width, height, screen)
+        pixels[...] = self.screen[top:top + height, x + left:x + left + width]
+        return pixels
+
+
+BACKENDS = {
+    PILCapture.name: PILCapture,
+    SyntheticCapture.name: SyntheticCapture,
+}
+
+
+def make_capture(name, replay=None, speed=1.0):
+    if name == "qt":
+        # Imported on demand so the capture layer itself never pulls in Qt
+        from QtCapture import QtCapture
+
+        return QtCapture()
+    if name == "replay":
+        from FrameRecording import ReplayCapture
+
+        return ReplayCapture(replay, speed)
+
+    return BACKENDS[name]()
@@ -0,0 +1,508 @@
+import threading
+import time
+
+import numpy as np
+
+from ChangeSuppressor import ChangeSuppressor
+from CircuitBreaker import CircuitBreaker, HAUnavailable
+from ColorCorrection import ColorCorrector
+from ColorAnalysis import ColorAnalyzer
+from ColorFilter import ColorFilter
+from EntityCache import EntityCache
+from FrameFingerprint import FrameFingerprint
+from HACommunicator import HACommunicator
+from HATransport import HATransport, is_rejected, is_timeout, is_unreachable
+from LampBudget import BudgetScheduler
+from Letterbox import ActiveArea
+from Metrics import StageMetrics
+from ScreenCapture import PILCapture
+from TickScheduler import AdaptiveScheduler
+from WLED import WLEDStreamer, is_wled
+
+RESPONSIVENESS = {"screen": 0.7, "average": 0.5, "crazy": 0.9}
+
+
+def make_transport(kind, url, token, connect_timeout, read_timeout, max_in_flight=8):
+    if kind == "websocket":
+        # websockets is only imported when the WebSocket transport is selected
+        from HAWebSocket import HAWebSocketTransport
+
+        return HAWebSocketTransport(url, token, connect_timeout, read_timeout, max_in_flight)
+
+    return HATransport(url, token, connect_timeout, read_timeout, max_in_flight=max_in_flight)
+
+
+class LatestValue:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.value = None
+        self.fresh = False
+        self.dropped = 0
+
+    def put(self, value):
+        with self.cond:
+            # An unread value is overwritten instead of queued
+            if self.fresh:
+                self.dropped += 1
+            self.value = value
+            self.fresh = True
+            self.cond.notify_all()
+
+    def get(self):
+        with self.cond:
+            return self.value
+
+    def take(self, timeout=None):
+        with self.cond:
+            if not self.fresh:
+                self.cond.wait(timeout)
+            if not self.fresh:
+                return None
+            self.fresh = False
+            return self.value
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class SyncConfig:
+    def __init__(self, url, token, entities, sampler, mode, active,
+                 connect_timeout=2.0, read_timeout=5.0, transport="rest", change_threshold=2.3,
+                 keepalive=10.0, min_fps=2.0, max_fps=20.0, batch_step=1, average_reducer="mean",
+                 smoothing="ema", responsiveness=None, stream_fps=30.0, skip_unchanged=True,
+                 probe_interval=0.25, update_budget=0.0, entity_budget=0.0, budget_strategy="error",
+                 max_in_flight=8, corrections=None, analysis_workers=0, analysis_budget=16384,
+                 letterbox=True):
+        self.url = url
+        self.token = token
+        self.entities = list(entities)
+        self.sampler = sampler
+        self.mode = mode
+        self.active = active
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.transport = transport
+        self.change_threshold = change_threshold
+        self.keepalive = keepalive
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.batch_step = batch_step
+        self.average_reducer = average_reducer
+        self.smoothing = smoothing
+        self.responsiveness = dict(RESPONSIVENESS)
+        self.responsiveness.update(responsiveness or {})
+        self.stream_fps = stream_fps
+        self.skip_unchanged = skip_unchanged
+        self.probe_interval = probe_interval
+        self.update_budget = update_budget
+        self.entity_budget = entity_budget
+        self.budget_strategy = budget_strategy
+        self.max_in_flight = max_in_flight
+        # entity -> color correction settings, see ColorCorrection.DEFAULT_CORRECTION
+        self.corrections = dict(corrections or {})
+        # Analysis threads (0: one per core) and pixels the average modes look at (0: all of them)
+        self.analysis_workers = analysis_workers
+        self.analysis_budget = analysis_budget
+        # Lamp regions follow the picture when a movie has black bars
+        self.letterbox = letterbox
+
+
+def ha_entities(entities):
+    # wled:// lamps are streamed directly and never go through Home Assistant
+    return [entity for entity in entities if not is_wled(entity)]
+
+
+class SyncFrame:
+    def __init__(self, config, colors, transition, entities=None, brightness=None):
+        self.config = config
+        self.colors = colors
+        self.transition = transition
+        self.entities = entities if entities is not None else ha_entities(config.entities)
+        self.brightness = brightness
+        self.captured_at = time.perf_counter()
+
+
+class SyncWorker:
+    def __init__(self, on_status=None, capture=None, scheduler=None, metrics=None):
+        self.on_status = on_status
+
+        # Rolling per-stage timing, read by the stats panel and the headless metrics export
+        self.metrics = metrics if metrics is not None else StageMetrics()
+
+        # Paces the capture stage from the measured capture and send latency
+        self.scheduler = scheduler if scheduler is not None else AdaptiveScheduler()
+
+        # The capture backend and its frame buffer live as long as the worker
+        self.capture_backend = capture if capture is not None else PILCapture()
+
+        self.config = LatestValue()
+        self.frames = LatestValue()
+
+        self.lamp_status = False
+        self.transport = None
+
+        # Stops calling an unreachable Home Assistant and probes it with growing pauses instead.
+        # URL and token are checked once per connection, a rejected pair is not retried until it changes
+        self.breaker = CircuitBreaker()
+        self.health = "idle"
+        self.health_key = None
+        self.rejected = None
+
+        # Light capabilities and on/off state, loaded from /api/states once per connection and kept
+        # current from call results, state_changed events (WebSocket) and a TTL
+        self.entity_cache = EntityCache()
+        self.missing_entities = []
+        self.suppressor = ChangeSuppressor()
+        self.budget = BudgetScheduler()
+        self.analyzer = ColorAnalyzer()
+        self.color_filter = ColorFilter()
+        self.corrector = ColorCorrector()
+
+        # Content rectangle per screen, lamps sitting on black bars sample the picture next to them
+        self.active_area = ActiveArea()
+        self.active_area_key = None
+
+        # Static screens: the last analysis is reused and capture drops to the probe rate
+        self.fingerprint = FrameFingerprint()
+        self.fingerprint_key = None
+        self.last_rows = None
+        self.last_output = None
+        self.last_sent_frame = 0.0
+
+        # UDP realtime stream to WLED controllers, sent from the capture thread at stream_fps
+        self.streamer = WLEDStreamer()
+        self.streaming = False
+        self.last_frame = None
+
+        self.running = threading.Event()
+        self.capture_thread = None
+        self.send_thread = None
+
+        self.capture_error = None
+        self.send_error = None
+        self.sent_frames = 0
+
+    def submit(self, config):
+        self.config.put(config)
+
+    def start(self):
+        if self.running.is_set():
+            return
+
+        self.running.set()
+        self.capture_thread = threading.Thread(target=self.capture_loop, name="sync-capture", daemon=True)
+        self.send_thread = threading.Thread(target=self.send_loop, name="sync-send", daemon=True)
+        self.capture_thread.start()
+        self.send_thread.start()
+
+    def stop(self, timeout=1.0):
+        self.running.clear()
+        self.frames.wake()
+
+        for thread in (self.capture_thread, self.send_thread):
+            if thread is not None:
+                thread.join(timeout)
+
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.streamer.close()
+        self.analyzer.pool.close()
+
+    def get_transport(self, config):
+        if (self.transport is None or self.transport.kind != config.transport
+                or not self.transport.matches(config.url, config.token, config.connect_timeout,
+                                              config.read_timeout, config.max_in_flight)):
+            if self.transport is not None:
+                self.transport.close()
+            # A new connection may point at a different Home Assistant, resend everything
+            self.suppressor.forget()
+            self.budget.forget()
+            self.entity_cache.invalidate()
+            self.transport = make_transport(config.transport, config.url, config.token,
+                                            config.connect_timeout, config.read_timeout, config.max_in_flight)
+            if self.transport.kind == "websocket":
+                self.transport.subscribe("state_changed", self.entity_cache.on_event)
+
+        return self.transport
+
+    def communicator(self, config, transport=None, entities=None, fingerprint=None):
+        entities = entities if entities is not None else ha_entities(config.entities)
+        return HACommunicator(config.url, config.token, entities, config.active, self, transport,
+                              self.capture_backend, self.suppressor, config.batch_step, self.analyzer,
+                              self.metrics, fingerprint, self.budget, self.entity_cache,
+                              self.active_area if config.letterbox else None)
+
+    def use_fingerprint(self, config):
+        # The cursor pixel of crazy mode is cheaper than any fingerprint
+        if not config.skip_unchanged or config.mode == "crazy":
+            self.fingerprint_key = None
+            return None
+
+        key = (config.mode, id(config.sampler), tuple(config.entities), config.average_reducer, config.analysis_budget,
+               config.letterbox)
+        if key != self.fingerprint_key:
+            self.fingerprint.reset()
+            self.fingerprint_key = key
+            self.last_rows = None
+        self.fingerprint.probe_interval = config.probe_interval
+        return self.fingerprint
+
+    def use_active_area(self, config):
+        # Bars found for another sampler, screen layout or before the sync was stopped or detection was
+        # switched off would keep moving the new regions until the next checks replace them
+        key = (id(config.sampler), config.letterbox, tuple(self.capture_backend.layout().screens))
+        if key != self.active_area_key:
+            self.active_area.reset()
+            self.active_area_key = key
+
+    def capture(self, config):
+        if not config.active:
+            self.streaming = False
+            self.last_output = None
+            self.active_area_key = None
+            return SyncFrame(config, None, None)
+
+        self.use_active_area(config)
+
+        self.analyzer.reducer = config.average_reducer
+        self.analyzer.pixel_budget = config.analysis_budget
+        self.analyzer.pool.configure(config.analysis_workers)
+
+        fingerprint = self.use_fingerprint(config)
+        now = time.monotonic()
+        if fingerprint is not None and self.last_rows is not None and not fingerprint.should_probe(now):
+            if self.streaming:
+                self.streamer.resend()
+            return None
+
+        comm = self.communicator(config, entities=config.entities, fingerprint=fingerprint)
+        rows = comm.mode_segments(config.mode, config.sampler)
+        unchanged = rows is None and self.last_rows is not None
+        if unchanged:
+            rows = self.last_rows
+        elif rows is None:
+            # The fingerprint matched a frame that was never analyzed, e.g. after a settings change
+            self.fingerprint.reset()
+            rows = comm.mode_segments(config.mode, config.sampler)
+        self.last_rows = rows
+
+        self.color_filter.kind = config.smoothing
+        self.color_filter.responsiveness = config.responsiveness.get(config.mode, 0.5)
+        with self.metrics.timer("filter"):
+            labels = config.sampler.row_labels(config.entities)[:len(rows)]
+            rows = self.color_filter.apply(labels, rows, now)
+
+        self.corrector.configure(config.corrections)
+
+        # Same picture, the filter has settled and no lamp is waiting for its share of the budget:
+        # nothing new to show, except for the keepalive
+        output = (rows, self.corrector.builds)
+        if (unchanged and output == self.last_output and not self.budget.pending
+                and now - self.last_sent_frame < config.keepalive):
+            if self.streaming:
+                self.streamer.resend()
+            return None
+        self.last_output = output
+        self.last_sent_frame = now
+
+        # Strips keep their segment colors for WLED, Home Assistant lights get one color per lamp
+        colors = config.sampler.split(rows, len(config.entities))
+        entities = config.entities[:len(colors)]
+        streamed = [is_wled(entity) for entity in entities]
+        self.streaming = any(streamed)
+        if self.streaming:
+            with self.metrics.timer("stream"):
+                wled = [e for e, s in zip(entities, streamed) if s]
+                self.streamer.send(wled, self.stream_colors(wled, [c for c, s in zip(colors, streamed) if s]))
+
+        colors = [color if isinstance(color, tuple) else tuple(np.rint(color.mean(axis=0)).astype(int).tolist())
+                  for color in colors]
+        entities = [e for e, s in zip(entities, streamed) if not s]
+        with self.metrics.timer("correct"):
+            colors, brightness = self.corrector.apply(entities, [c for c, s in zip(colors, streamed) if not s])
+        transition = self.scheduler.transition(HACommunicator.TRANSITIONS.get(config.mode, 0.5))
+        return SyncFrame(config, [tuple(color) for color in colors.tolist()], transition, entities,
+                         brightness.tolist())
+
+    def stream_colors(self, entities, colors):
+        if self.corrector.identity:
+            return colors
+
+        # Every segment of every streamed lamp goes through the tables in one call, WLED gets the
+        # brightness folded into the color
+        counts = [len(color) if isinstance(color, np.ndarray) else 1 for color in colors]
+        rows = self.corrector.dimmed([e for e, n in zip(entities, counts) for _ in range(n)],
+                                     np.concatenate([np.asarray(c, dtype=np.uint8).reshape(-1, 3) for c in colors]))
+        return [part if n > 1 else tuple(part[0].tolist())
+                for part, n in zip(np.split(rows, np.cumsum(counts)[:-1]), counts)]
+
+    def send(self, frame):
+        if not frame.entities:
+            # Nothing to do for Home Assistant, WLED falls back on its own after the realtime timeout
+            self.lamp_status = frame.colors is not None
+            return
+        if frame.colors is None and not self.lamp_status:
+            self.health = "idle"
+            return
+
+        config = frame.config
+        if (config.url, config.token) != self.health_key:
+            self.health_key = (config.url, config.token)
+            self.breaker.reset()
+            self.rejected = None
+            self.health = "connecting"
+
+        if self.rejected is not None:
+            raise HAUnavailable(self.rejected)
+        now = time.monotonic()
+        if not self.breaker.allow(now):
+            raise HAUnavailable(f"Home Assistant unreachable, next try in {self.breaker.retry_in(now):.0f} s")
+
+        transport = self.get_transport(config)
+        try:
+            if not transport.validated:
+                transport.validate()
+            if self.entity_cache.stale(time.monotonic()):
+                self.entity_cache.load(transport.get_states(), time.monotonic())
+            self.missing_entities = self.entity_cache.missing(frame.entities)
+
+            comm = self.communicator(config, transport, frame.entities)
+
+            self.suppressor.threshold = config.change_threshold
+            self.suppressor.max_staleness = config.keepalive
+            self.budget.configure(config.update_budget, config.entity_budget, config.budget_strategy)
+
+            if frame.colors is not None:
+                comm.send_colors(frame.colors, frame.transition, brightness=frame.brightness)
+            else:
+                comm.turn_off()
+        except Exception as e:
+            # Wrong or revoked token, or a URL that is not Home Assistant at all. A token that stops
+            # working later is rejected the same way, not retried on every tick
+            rejected = is_rejected(e) or (not transport.validated and isinstance(e, ValueError))
+            if is_unreachable(e) or not (transport.validated or rejected):
+                self.breaker.failure(time.monotonic(), trip=is_timeout(e))
+                if self.breaker.state == "open":
+                    # Calls still queued for a dead connection are dropped, the probe starts fresh
+                    self.health = "offline"
+                    self.drop_transport()
+                else:
+                    self.health = "degraded"
+            elif rejected:
+                self.rejected = str(e)
+                self.health = "rejected"
+                self.drop_transport()
+            else:
+                # Home Assistant answered, just not with success
+                self.breaker.success()
+                self.health = "degraded"
+            raise
+
+        self.breaker.success()
+        self.health = "ok"
+
+    def drop_transport(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def capture_loop(self):
+        while self.running.is_set():
+            start = time.perf_counter()
+
+            config = self.config.get()
+            if config is not None:
+                self.scheduler.configure(config.min_fps, config.max_fps)
+                try:
+                    frame = self.capture(config)
+                    self.capture_error = None
+
+                    # While streaming, capture runs at stream_fps but Home Assistant still gets
+                    # frames only at the rate the scheduler allows
+                    now = time.perf_counter()
+                    if frame is not None and (not self.streaming or self.last_frame is None
+                                              or self.scheduler.next_delay(now - self.last_frame) == 0):
+                        self.last_frame = now
+                        self.frames.put(frame)
+                    elif frame is None:
+                        # Unchanged frames never reach the send stage, keep the counters current anyway
+                        self.report()
+                except Exception as e:
+                    self.capture_error = str(e)
+                    self.metrics.count("capture_errors")
+                    self.report()
+
+            elapsed = time.perf_counter() - start
+            self.scheduler.record_capture(elapsed)
+
+            delay = self.scheduler.next_delay(elapsed)
+            if self.streaming and config is not None:
+                delay = min(delay, max(0.0, 1.0 / max(config.stream_fps, 1.0) - elapsed))
+            time.sleep(delay)
+
+    def send_loop(self):
+        while self.running.is_set():
+            frame = self.frames.take(timeout=0.5)
+            if frame is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.send(frame)
+                self.sent_frames += 1
+                self.send_error = None
+            except HAUnavailable as e:
+                # Skipped without calling Home Assistant, not a failure of its own
+                self.send_error = str(e)
+                self.report(frame)
+                continue
+            except Exception as e:
+                self.send_error = str(e)
+                self.metrics.count("send_errors")
+
+            self.scheduler.record_send(time.perf_counter() - start, self.send_error is None)
+
+            self.report(frame)
+
+    def report(self, frame=None):
+        if frame is not None:
+            self.metrics.record("latency", time.perf_counter() - frame.captured_at)
+        self.metrics.set("fps", round(self.scheduler.fps(), 2))
+        self.metrics.set("dropped_frames", self.frames.dropped)
+        self.metrics.set("sent_frames", self.sent_frames)
+        self.metrics.set("sent_updates", self.suppressor.sent)
+        self.metrics.set("suppressed_updates", self.suppressor.suppressed)
+        self.metrics.set("stream_packets", self.streamer.stats["packets"])
+        for name, value in list(self.fingerprint.stats().items()) + list(self.budget.stats().items()):
+            self.metrics.set(name, value)
+        for name, value in list(self.entity_cache.stats().items()) + list(self.analyzer.pool.stats().items()):
+            self.metrics.set(name, value)
+        for name, value in self.active_area.stats().items():
+            self.metrics.set(name, value)
+        self.metrics.set("missing_entities", len(self.missing_entities))
+        self.metrics.set("breaker_trips", self.breaker.trips)
+        self.metrics.set("breaker_probes", self.breaker.probes)
+
+        if self.on_status is None:
+            return
+
+        status = {
+            "lamp_status": self.lamp_status,
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.frames.dropped,
+            "sent_updates": self.suppressor.sent,
+            "suppressed_updates": self.suppressor.suppressed,
+            "error": self.send_error or self.capture_error,
+            "health": self.health,
+            "missing_entities": list(self.missing_entities),
+            "retry_in": self.breaker.retry_in(time.monotonic()),
+        }
+        status.update(self.fingerprint.stats())
+        status.update(self.budget.stats())
+        status.update(self.scheduler.stats())
+        if frame is not None:
+            status["latency_ms"] = (time.perf_counter() - frame.captured_at) * 1000
+
+        self.on_status(status)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class AdaptiveScheduler:
+    def __init__(self, min_fps=2.0, max_fps=20.0, backoff=1.5, speedup=0.9, headroom=0.6, smoothing=0.2):
+        self.lock = threading.Lock()
+
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.backoff = backoff
+        self.speedup = speedup
+        self.headroom = headroom
+        self.smoothing = smoothing
+
+        self.interval = self.clamp(0.1)
+
+        # Exponential moving averages of the measured stage latencies
+        self.capture_time = 0.0
+        self.send_time = 0.0
+        self.achieved_interval = None
+        self.last_send = None
+
+    def clamp(self, interval):
+        return min(max(interval, 1.0 / self.max_fps), 1.0 / self.min_fps)
+
+    def configure(self, min_fps, max_fps):
+        with self.lock:
+            self.min_fps = max(0.1, min(min_fps, max_fps))
+            self.max_fps = max(self.min_fps, max_fps)
+            self.interval = self.clamp(self.interval)
+
+    def average(self, current, sample):
+        return sample if current == 0.0 else current + self.smoothing * (sample - current)
+
+    def record_capture(self, seconds):
+        with self.lock:
+            self.capture_time = self.average(self.capture_time, seconds)
+
+    def record_send(self, seconds, ok=True, now=None):
+        now = time.monotonic() if now is None else now
+
+        with self.lock:
+            self.send_time = self.average(self.send_time, seconds)
+
+            if self.last_send is not None:
+                gap = now - self.last_send
+                if self.achieved_interval is None:
+                    self.achieved_interval = gap
+                else:
+                    self.achieved_interval += self.smoothing * (gap - self.achieved_interval)
+            self.last_send = now
+
+            busy = self.capture_time + self.send_time
+            if not ok or self.send_time > self.interval:
+                # Home Assistant is erroring or slower than the tick rate: back off
+                self.interval = self.clamp(max(self.interval * self.backoff, busy))
+            elif busy < self.interval * self.headroom:
+                self.interval = self.clamp(self.interval * self.speedup)
+
+    def next_delay(self, elapsed):
+        with self.lock:
+            return max(0.0, self.interval - elapsed)
+
+    def transition(self, fallback):
+        # Fade for as long as it actually takes until the next update arrives
+        with self.lock:
+            if self.achieved_interval is None:
+                return fallback
+            return round(min(max(self.achieved_interval, self.interval), 1.0 / self.min_fps), 2)
+
+    def fps(self):
+        with self.lock:
+            if not self.achieved_interval:
+                return 0.0
+            return 1.0 / self.achieved_interval
+
+    def stats(self):
+        return {
+            "fps": self.fps(),
+            "interval_ms": self.interval * 1000,
+            "capture_ms": self.capture_time * 1000,
+            "send_ms": self.send_time * 1000,
+        }
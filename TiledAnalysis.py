@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+def row_tiles(height, width, tile_pixels):
+    # Horizontal bands of whole rows. They depend on the frame size only, never on the number of
+    # workers, so the merged result is the same for 1 or N threads
+    rows = max(1, tile_pixels // max(1, width))
+    return [(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+
+def chunk_bounds(starts, total, tile_pixels):
+    # Contiguous runs of output rows with about tile_pixels samples each, cut only at row starts
+    # so every row is reduced by exactly one tile
+    bounds = [0]
+    first = 0
+    for row, start in enumerate(starts):
+        if row > bounds[-1] and start - first >= tile_pixels:
+            bounds.append(row)
+            first = start
+    bounds.append(len(starts))
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+class TilePool:
+    def __init__(self, workers=0, tile_pixels=262144):
+        # workers: threads for the analysis stage, 0 means one per core and 1 runs everything inline.
+        # NumPy drops the GIL inside take, copyto, reductions and bincount, so threads working on
+        # different tiles of the same frame buffer run in parallel without copying it
+        self.workers = workers
+        self.tile_pixels = tile_pixels
+        self.lock = threading.Lock()
+        self.executor = None
+        self.size = 0
+
+        self.jobs = 0
+        self.tiles = 0
+
+    def configure(self, workers):
+        if workers != self.workers:
+            self.workers = workers
+            self.close()
+
+    def threads(self):
+        return self.workers if self.workers > 0 else default_workers()
+
+    def map(self, function, items):
+        # Results come back in the order of items, whatever thread finished first
+        items = list(items)
+        self.jobs += 1
+        self.tiles += len(items)
+        if len(items) < 2 or self.threads() == 1:
+            return [function(item) for item in items]
+
+        with self.lock:
+            if self.executor is None or self.size != self.threads():
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                self.size = self.threads()
+                self.executor = ThreadPoolExecutor(self.size, thread_name_prefix="sync-analysis")
+            executor = self.executor
+        return list(executor.map(function, items))
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def stats(self):
+        return {"analysis_threads": self.threads(), "analysis_tiles": self.tiles}
@@ -0,0 +1,173 @@
+import socket
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+SCHEME = "wled://"
+
+PROTOCOLS = ("drgb", "dnrgb", "ddp")
+PORTS = {"drgb": 21324, "dnrgb": 21324, "ddp": 4048}
+
+# LEDs that fit into a single datagram, see the WLED UDP realtime and DDP docs
+MAX_LEDS = {"drgb": 490, "dnrgb": 489, "ddp": 480}
+
+DRGB = 2
+DNRGB = 4
+DDP_FLAGS = 0x41  # version 1, push
+DDP_RGB24 = 0x0B
+DDP_DISPLAY = 1
+
+
+def is_wled(entity):
+    return entity.startswith(SCHEME)
+
+
+class WLEDTarget:
+    def __init__(self, host, port, protocol, start, count):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.start = start
+        self.count = count
+
+    @classmethod
+    def parse(cls, entity):
+        # wled://host[:port][/first-last][?protocol=drgb|dnrgb|ddp]
+        parts = urlsplit(entity)
+        protocol = parse_qs(parts.query).get("protocol", ["drgb"])[0].lower()
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown WLED protocol {protocol!r} in {entity}")
+
+        leds = parts.path.strip("/") or "0"
+        first, _, last = leds.partition("-")
+        start = int(first)
+        end = int(last) if last else start
+        if start < 0 or end < start:
+            raise ValueError(f"Invalid LED range {leds!r} in {entity}")
+
+        return cls(parts.hostname, parts.port or PORTS[protocol], protocol, start, end - start + 1)
+
+
+class WLEDController:
+    def __init__(self, host, port, protocol, first, last, timeout=2):
+        # Resolved once, so no name lookup happens per frame
+        self.address = (socket.gethostbyname(host), port)
+        self.protocol = protocol
+        self.first = first
+        self.count = last - first
+
+        if protocol == "drgb":
+            # DRGB always starts at LED 0, LEDs in front of the first lamp stay black
+            self.first = 0
+            self.count = last
+        if self.count > MAX_LEDS[protocol]:
+            raise ValueError(f"{self.count} LEDs do not fit into one {protocol.upper()} datagram "
+                             f"(max {MAX_LEDS[protocol]})")
+
+        # Header and pixel data share one buffer that is reused for every frame
+        if protocol == "ddp":
+            header = bytes([DDP_FLAGS, 0, DDP_RGB24, DDP_DISPLAY]) + (self.first * 3).to_bytes(4, "big") \
+                + (self.count * 3).to_bytes(2, "big")
+        elif protocol == "dnrgb":
+            header = bytes([DNRGB, timeout]) + self.first.to_bytes(2, "big")
+        else:
+            header = bytes([DRGB, timeout])
+
+        self.buffer = bytearray(header) + bytearray(self.count * 3)
+        self.leds = np.frombuffer(self.buffer, dtype=np.uint8, offset=len(header)).reshape(-1, 3)
+        self.sequence = 0
+
+        # (LED count, segment count) -> which segment every LED shows
+        self.gradients = {}
+
+    def set_color(self, start, count, color):
+        self.leds[start - self.first:start - self.first + count] = color
+
+    def set_gradient(self, start, count, colors):
+        key = (count, len(colors))
+        if key not in self.gradients:
+            self.gradients[key] = np.arange(count) * len(colors) // count
+        np.take(colors, self.gradients[key], axis=0, out=self.leds[start - self.first:start - self.first + count],
+                mode="clip")
+
+    def packet(self):
+        if self.protocol == "ddp":
+            # Sequence numbers 1..15, 0 would mean "not used"
+            self.sequence = self.sequence % 15 + 1
+            self.buffer[1] = self.sequence
+        return self.buffer
+
+
+class WLEDStreamer:
+    kind = "wled"
+
+    def __init__(self, timeout=2):
+        self.timeout = timeout
+        self.sock = None
+
+        self.layout = None
+        self.controllers = {}
+        self.targets = []
+
+        self.stats = {"frames": 0, "packets": 0, "bytes": 0, "errors": 0}
+
+    def configure(self, entities):
+        layout = tuple(entities)
+        if layout == self.layout:
+            return
+
+        targets = [(index, WLEDTarget.parse(entity)) for index, entity in enumerate(entities)]
+
+        # All lamps on the same controller and protocol go out in one datagram
+        spans = {}
+        for _, target in targets:
+            key = (target.host, target.port, target.protocol)
+            first, last = spans.get(key, (target.start, target.start + target.count))
+            spans[key] = (min(first, target.start), max(last, target.start + target.count))
+
+        self.controllers = {key: WLEDController(*key, first, last, self.timeout)
+                            for key, (first, last) in spans.items()}
+        self.targets = [(index, self.controllers[(t.host, t.port, t.protocol)], t.start, t.count)
+                        for index, t in targets]
+        self.layout = layout
+
+    def send(self, entities, colors):
+        self.configure(entities)
+        if not self.controllers:
+            return
+
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+        for index, controller, start, count in self.targets:
+            if index >= len(colors):
+                continue
+            if isinstance(colors[index], np.ndarray) and len(colors[index]) > 1:
+                # Strip segments are spread evenly over the lamp's LED range
+                controller.set_gradient(start, count, colors[index])
+            else:
+                controller.set_color(start, count, colors[index])
+
+        self.resend()
+
+    def resend(self):
+        # Also used for unchanged frames, so WLED does not time out of realtime mode
+        if self.sock is None:
+            return
+
+        for controller in self.controllers.values():
+            packet = controller.packet()
+            try:
+                self.sock.sendto(packet, controller.address)
+                self.stats["packets"] += 1
+                self.stats["bytes"] += len(packet)
+            except OSError:
+                # A full socket buffer or an unreachable controller only costs this frame
+                self.stats["errors"] += 1
+        self.stats["frames"] += 1
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,1410 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from ChangeSuppressor import ChangeSuppressor
+from FrameRecording import FrameRecorder, FrameRecording, ReplayCapture
+from ColorMath import delta_e, srgb_to_lab
+from ColorAnalysis import REDUCERS, ColorAnalyzer
+from ColorCorrection import ColorCorrector
+from ColorFilter import FILTERS, ColorFilter
+from EntityCache import EntityCache
+from FakeHA import FakeHA
+from FakeWLED import FakeWLED, decode_packet
+from FrameFingerprint import FrameFingerprint
+from HACommunicator import HACommunicator
+from HATransport import HATransport
+from HAWebSocket import HAWebSocketTransport
+from LampBudget import STRATEGIES, BudgetScheduler
+from Letterbox import ActiveArea, LetterboxDetector
+from Metrics import StageMetrics
+from Sampling import RegionSampler, SamplingRegion, StripRegion, make_region
+from SyncWorker import SyncConfig, SyncWorker, make_transport
+from TiledAnalysis import TilePool, default_workers
+from TickScheduler import AdaptiveScheduler
+from ScreenCapture import SyntheticCapture, make_capture
+from WLED import WLEDStreamer
+
+
+# Checks that failed in this run, benchmark.py exits with status 1 when there are any
+failures = []
+
+
+def check(ok, message):
+    if not ok:
+        failures.append(message)
+        print(f"FAILED: {message}")
+    return ok
+
+
+def turn_on_payload(i, tick):
+    return {
+        "entity_id": f"light.bench_{i}",
+        "rgb_color": [tick % 256, i % 256, 128],
+        "brightness": 255,
+        "transition": 0.5,
+    }
+
+
+def bench_transport(args):
+    with FakeHA() as fake:
+        headers = {"Authorization": f"Bearer {fake.token}", "Content-Type": "application/json"}
+
+        start = time.perf_counter()
+        for tick in range(args.ticks):
+            for i in range(args.lamps):
+                requests.post(f"{fake.url}/api/services/light/turn_on", headers=headers,
+                              json=turn_on_payload(i, tick))
+        bare_time = time.perf_counter() - start
+        bare_connections = fake.counters.get("connections", 0)
+
+        fake.reset()
+
+        transport = HATransport(fake.url, fake.token)
+        start = time.perf_counter()
+        for tick in range(args.ticks):
+            for i in range(args.lamps):
+                transport.post("/api/services/light/turn_on", turn_on_payload(i, tick))
+        pooled_time = time.perf_counter() - start
+        pooled_connections = fake.counters.get("connections", 0)
+        stats = transport.connection_stats()
+        transport.close()
+
+    total = args.ticks * args.lamps
+    print(f"{total} turn_on calls ({args.lamps} lamps x {args.ticks} ticks)")
+    print(f"  bare requests.post : {bare_connections:5d} connections  {bare_time * 1000 / total:7.3f} ms/call")
+    print(f"  HATransport        : {pooled_connections:5d} connections  {pooled_time * 1000 / total:7.3f} ms/call")
+    print(f"  client pool stats  : opened={stats['opened']} reused={stats['reused']}")
+
+
+def run_ticks(transport, lamps, ticks):
+    latencies = []
+    start = time.perf_counter()
+    for tick in range(ticks):
+        tick_start = time.perf_counter()
+        futures = [transport.call_service("light", "turn_on", turn_on_payload(i, tick)) for i in range(lamps)]
+        transport.wait(futures)
+        latencies.append(time.perf_counter() - tick_start)
+
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def bench_websocket(args):
+    with FakeHA() as fake:
+        print(f"{'lamps':>5} {'transport':>10} {'msg/s':>9} {'p50 tick':>9} {'p99 tick':>9}")
+        for lamps in args.lamps:
+            for transport_class in (HATransport, HAWebSocketTransport):
+                transport = transport_class(fake.url, fake.token)
+                run_ticks(transport, lamps, 2)
+                elapsed, latencies = run_ticks(transport, lamps, args.ticks)
+                transport.close()
+
+                p50 = latencies[len(latencies) // 2] * 1000
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                print(f"{lamps:5d} {transport_class.kind:>10} {lamps * args.ticks / elapsed:9.0f} "
+                      f"{p50:7.2f}ms {p99:7.2f}ms")
+
+
+def bench_fanout(args):
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+
+    with FakeHA(latency=args.latency) as fake:
+        print(f"{args.lamps} lamps, {args.latency * 1000:.0f} ms per call, {args.ticks} ticks")
+        print(f"{'transport':>10} {'cap':>4} {'p50 tick':>9} {'p99 tick':>9} {'round trips':>12}")
+        for kind in ("rest", "websocket"):
+            for cap in args.caps:
+                transport = make_transport(kind, fake.url, fake.token, 2.0, 5.0, cap)
+                comm = HACommunicator(fake.url, fake.token, entities, True, LampState(), transport)
+                latencies = []
+                for tick in range(args.ticks + 1):
+                    colors = [(tick % 256, i % 256, 128) for i in range(args.lamps)]
+                    start = time.perf_counter()
+                    comm.send_colors(colors, 0.5)
+                    latencies.append(time.perf_counter() - start)
+                transport.close()
+
+                # The first tick also opens the connections
+                latencies = latencies[1:]
+                p50 = percentile(latencies, 0.5)
+                print(f"{kind:>10} {cap:4d} {p50 * 1000:7.1f}ms {percentile(latencies, 0.99) * 1000:7.1f}ms "
+                      f"{p50 / args.latency:12.2f}")
+
+        # A burst of ticks that arrive faster than HA answers: queued calls for a lamp are replaced
+        # by the newest color instead of all being replayed
+        print()
+        print(f"{'transport':>10} {'ticks':>5} {'issued':>7} {'reached HA':>11} {'superseded':>11}")
+        for kind in ("rest", "websocket"):
+            transport = make_transport(kind, fake.url, fake.token, 2.0, 5.0, args.burst_cap)
+            transport.wait([transport.call_service("light", "turn_on", turn_on_payload(0, 0))])
+            fake.reset()
+            futures = []
+            for tick in range(args.burst):
+                futures = [transport.call_service("light", "turn_on", turn_on_payload(i, tick), (entities[i],))
+                           for i in range(args.lamps)]
+            transport.wait(futures)
+            reached = fake.counters.get("requests", 0) + fake.counters.get("ws_messages", 0)
+            transport.close()
+            print(f"{kind:>10} {args.burst:5d} {args.burst * args.lamps:7d} {reached:11d} "
+                  f"{transport.stats['superseded']:11d}")
+
+
+def bench_entities(args):
+    # A mixed installation: every kind of light, plus entries that do not exist or went unavailable
+    kinds = [("rgb",), ("hs",), ("xy",), ("color_temp",), ("brightness",), ("onoff",)]
+    lights = [(f"light.{kind[0]}_{i}", kind) for i in range(args.lamps) for kind in kinds]
+    entities = [entity for entity, _ in lights] + [f"light.missing_{i}" for i in range(args.missing)]
+    rng = np.random.default_rng(0)
+
+    print(f"{len(lights)} lights of {len(kinds)} kinds, {args.missing} missing, {args.unavailable} going "
+          f"unavailable, {args.ticks} ticks")
+    print(f"{'transport':>10} {'cache':>6} {'calls':>6} {'unsupported':>12} {'missing':>8} {'state reads':>12} "
+          f"{'lamps on':>9} {'LAMP_STATUS':>12}")
+    for kind in ("rest", "websocket"):
+        for cached in (False, True):
+            with FakeHA(entities=[]) as fake:
+                for entity, modes in lights:
+                    fake.add_entity(entity, modes)
+                transport = make_transport(kind, fake.url, fake.token, 2.0, 5.0)
+                cache = EntityCache() if cached else None
+                if cached:
+                    if kind == "websocket":
+                        transport.subscribe("state_changed", cache.on_event)
+                    cache.load(transport.get_states(), time.monotonic())
+
+                lamp_state = LampState()
+                comm = HACommunicator(fake.url, fake.token, entities, True, lamp_state, transport,
+                                      entity_cache=cache)
+                for tick in range(args.ticks):
+                    if tick == args.ticks // 2:
+                        for entity, _ in lights[:args.unavailable]:
+                            fake.set_state(entity, "unavailable")
+                        time.sleep(0.05)
+                    comm.send_colors([tuple(c) for c in rng.integers(0, 256, (len(entities), 3)).tolist()], 0.2)
+                comm.turn_off()
+                time.sleep(0.05)
+                transport.close()
+
+                # After turn_off, LAMP_STATUS should match whether any light is still on
+                on = sum(state["state"] == "on" for state in fake.get_states())
+                counters = fake.counters
+                print(f"{kind:>10} {'on' if cached else 'off':>6} {len(fake.calls):6d} "
+                      f"{counters.get('unsupported', 0):12d} {counters.get('missing', 0):8d} "
+                      f"{counters.get('state_requests', 0):12d} {on:9d} {str(lamp_state.lamp_status):>12}")
+
+
+def time_ticks(func, ticks):
+    func()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        func()
+    return (time.perf_counter() - start) * 1000 / ticks
+
+
+def real_capture(name):
+    if name != "qt":
+        return make_capture(name)
+
+    from PyQt6.QtGui import QGuiApplication
+
+    # QtCapture needs an application, kept on the capture so it lives as long as the grabs
+    app = QGuiApplication.instance() or QGuiApplication([])
+    capture = make_capture(name)
+    capture.app = app
+    return capture
+
+
+def bench_capture(args):
+    if args.backend == "synthetic":
+        capture = SyntheticCapture(args.width, args.height)
+    else:
+        capture = real_capture(args.backend)
+    width, height = capture.screen_size()
+
+    rng = random.Random(0)
+    print(f"{'lamps':>5} {'per-lamp grabs':>15} {'single frame':>13}")
+    for lamps in args.lamps:
+        positions = [(rng.randrange(width), rng.randrange(height)) for _ in range(lamps)]
+        comm = HACommunicator("", "", [f"light.bench_{i}" for i in range(lamps)], True, None,
+                              capture=capture)
+
+        # What pyautogui.pixel does on most platforms: a full screenshot per lamp
+        legacy = time_ticks(lambda: [capture.grab().pixel(x, y) for x, y in positions], args.ticks)
+        sampler = RegionSampler([SamplingRegion(p, radius=0) for p in positions])
+        single = time_ticks(lambda: comm.screen_colors(sampler), args.ticks)
+        print(f"{lamps:5d} {legacy:12.2f} ms {single:10.2f} ms")
+
+
+def bench_screens(args):
+    print(f"{args.width}x{args.height} screens side by side, {args.lamps} lamps with radius {args.radius}")
+    print(f"{'screens':>7} {'lamps on':>9} {'desktop grab':>13} {'per screen':>11} {'pixels':>10} {'grabbed':>10}")
+
+    rng = random.Random(0)
+    for screens in args.screens:
+        for spread in ("first", "all"):
+            used = 1 if spread == "first" else screens
+            placed = [(rng.randrange(used), (rng.randrange(args.radius, args.width // 4),
+                                             rng.randrange(args.radius, args.height - args.radius)))
+                      for _ in range(args.lamps)]
+
+            # Before: one frame over the bounding box of every lamp on the whole virtual desktop
+            desktop = SyntheticCapture(args.width * screens, args.height)
+            flat = RegionSampler([SamplingRegion((screen * args.width + x, y), radius=args.radius)
+                                  for screen, (x, y) in placed])
+            comm = HACommunicator("", "", [], True, None, capture=desktop)
+            whole = time_ticks(lambda: comm.screen_segments(flat), args.ticks)
+            left, top, right, bottom = flat.bbox(desktop.screen_size())
+            desktop_pixels = (right - left) * (bottom - top)
+
+            # After: lamps keep screen relative positions, every screen grabs only its own box
+            capture = SyntheticCapture(args.width, args.height, screens=screens)
+            regions = []
+            for screen, (x, y) in placed:
+                region = SamplingRegion((x, y), radius=args.radius)
+                region.screen = screen
+                regions.append(region)
+            sampler = RegionSampler(regions)
+            comm = HACommunicator("", "", [], True, None, capture=capture)
+            split = time_ticks(lambda: comm.screen_segments(sampler), args.ticks)
+            layout = capture.layout()
+            grabbed = 0
+            for screen, part, _ in sampler.by_screen(layout):
+                left, top, right, bottom = part.bbox(layout.size(screen))
+                grabbed += (right - left) * (bottom - top)
+
+            same = np.array_equal(comm.screen_segments(sampler), HACommunicator(
+                "", "", [], True, None, capture=desktop).screen_segments(flat))
+            print(f"{screens:7d} {spread:>9} {whole:10.2f} ms {split:8.2f} ms {desktop_pixels:10d} {grabbed:10d}"
+                  + ("" if same else "  colors differ"))
+
+
+def content_rect(width, height, aspect):
+    # Picture of the given aspect ratio centered on the screen, None when it fills the screen
+    if aspect > width / height:
+        bar = int(round((height - width / aspect) / 2))
+        return 0, bar, width, height - bar
+    if aspect < width / height:
+        bar = int(round((width - height * aspect) / 2))
+        return bar, 0, width - bar, height
+    return None
+
+
+def letterboxed(picture, aspect):
+    # Black bars around a picture of the given aspect ratio, centered on the screen
+    height, width = picture.shape[:2]
+    left, top, right, bottom = content_rect(width, height, aspect) or (0, 0, width, height)
+    frame = np.zeros_like(picture)
+    frame[top:bottom, left:right] = picture[top:bottom, left:right]
+    return frame
+
+
+class CountingCapture(SyntheticCapture):
+    # Grabbed pixels, what a grab costs on every backend grows with its area
+    def __init__(self, width, height):
+        super().__init__(width, height)
+        self.grabbed = 0
+
+    def grab_into(self, left, top, width, height, screen=0):
+        self.grabbed += width * height
+        return super().grab_into(left, top, width, height, screen)
+
+
+def letterbox_regions(width, height, radius):
+    # Point lamps close to every edge and one strip around the screen
+    margin = radius * 2
+    regions = [make_region(center, {"radius": radius}, (width, height))
+               for center in ((width // 4, margin), (width * 3 // 4, margin), (width // 4, height - margin),
+                              (width * 3 // 4, height - margin), (margin, height // 2), (width - margin, height // 2))]
+    regions.append(make_region(None, {"type": "strip", "segments": 30}, (width, height)))
+    return RegionSampler(regions)
+
+
+def bench_letterbox_backend(args):
+    # The same check on a real backend: probe strips against the whole screen grab it replaces
+    capture = real_capture(args.backend)
+    size = capture.layout().size(0)
+    sampler = letterbox_regions(*size, args.radius)
+    area = ActiveArea()
+    detector = area.detector(0)
+
+    def run():
+        tick = time_ticks(lambda: capture.grab(sampler.bbox(size), 0), args.ticks)
+        strips = time_ticks(lambda: area.probe(0, capture, size), args.ticks)
+        whole = time_ticks(lambda: capture.grab(None, 0), args.ticks)
+        print(f"{args.backend} backend, {size[0]}x{size[1]} screen, grabbed from a worker thread")
+        # Not checked: every grab has a fixed cost, on a small screen the strips can take longer than one
+        # whole grab even though they copy a fraction of the pixels
+        print(f"tick grab {tick:.2f} ms, check ({detector.probes} columns and {detector.probes} rows) "
+              f"{strips:.2f} ms, whole screen grab {whole:.2f} ms")
+
+    if args.backend != "qt":
+        run()
+        return
+
+    # Grabs from the sync thread are handed to the GUI thread, which has to run its event loop meanwhile
+    app = capture.app
+
+    def measure():
+        try:
+            run()
+        finally:
+            app.quit()
+
+    thread = threading.Thread(target=measure)
+    thread.start()
+    app.exec()
+    thread.join()
+
+
+def bench_letterbox(args):
+    if args.backend != "synthetic":
+        bench_letterbox_backend(args)
+        return
+
+    width, height = args.width, args.height
+    rng = np.random.default_rng(0)
+    pictures = [rng.integers(40, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(4)]
+
+    # A dark scene: black apart from one bright patch off to the side, which is no letterbox
+    dark = np.zeros((height, width, 3), dtype=np.uint8)
+    dark[height // 3:height * 2 // 3, width // 16:width // 3] = 200
+
+    sampler = letterbox_regions(width, height, args.radius)
+
+    # Checked on every tick here, so a tick stands for one check at the worker's interval
+    capture = CountingCapture(width, height)
+    area = ActiveArea(interval=0)
+    plain_metrics = StageMetrics()
+    detected_metrics = StageMetrics()
+    plain = HACommunicator("", "", [], True, None, capture=capture, metrics=plain_metrics)
+    detected = HACommunicator("", "", [], True, None, capture=capture, metrics=detected_metrics, letterbox=area)
+
+    detector = LetterboxDetector()
+    frame = capture.grab()
+    column_boxes, row_boxes = detector.probe_boxes((width, height))
+    strip_pixels = sum((right - left) * (bottom - top) for left, top, right, bottom in column_boxes + row_boxes)
+    print(f"{width}x{height} screen, {len(sampler.starts) - 30} point lamps near the edges and a 30 segment strip")
+    print(f"detector: {time_ticks(lambda: detector.measure(frame), args.ticks):.3f} ms per check "
+          f"({detector.probes} rows and {detector.probes} columns, {strip_pixels} pixels), confirmed after "
+          f"{detector.confirm} checks, one check every {ActiveArea().interval:.2f} s")
+    print(f"{'phase':>18} {'rect':>22} {'settled':>8} {'remaps':>7} {'black rows':>11} {'detected':>9} "
+          f"{'tick':>8} {'plain tick':>11} {'check':>8} {'pixels':>8} {'plain':>8}")
+
+    def tick_ms(metrics):
+        # Capture and analysis of one tick, the letterbox check is timed on its own
+        stages = metrics.snapshot()["stages"]
+        return stages["capture"]["mean_ms"] + stages["analysis"]["mean_ms"]
+
+    phases = [("16:9", 16 / 9, None), ("21:9 movie", 64 / 27, 0), ("dark scene in 21:9", None, None),
+              ("4:3 video", 4 / 3, 0), ("16:9", 16 / 9, None)]
+    aspect = 16 / 9
+    changes = 0
+    for name, phase_aspect, expected_black in phases:
+        aspect = phase_aspect if phase_aspect is not None else aspect
+        settled = None
+        plain_metrics.reset()
+        detected_metrics.reset()
+        for tick in range(args.ticks):
+            picture = dark if phase_aspect is None else pictures[tick % len(pictures)]
+            capture.set_screen(letterboxed(picture, aspect))
+            rect = area.rect(0)
+
+            # Grabbed pixels of the last tick, probe strips included
+            capture.grabbed = 0
+            rows = detected.screen_segments(sampler)
+            pixels = capture.grabbed
+            capture.grabbed = 0
+            plain_rows = plain.screen_segments(sampler)
+            plain_pixels = capture.grabbed
+
+            if area.rect(0) != rect:
+                settled = tick + 1
+                changes += 1
+            black = int((plain_rows.max(axis=1) < 24).sum())
+            found = int((rows.max(axis=1) < 24).sum())
+
+        rect = area.rect(0)
+        check_ms = detected_metrics.snapshot()["stages"]["letterbox"]["mean_ms"]
+        print(f"{name:>18} {str(rect if rect is not None else 'full screen'):>22} "
+              f"{settled if settled is not None else '-':>8} {sampler.remaps:7d} "
+              f"{black:11d} {found:9d} "
+              f"{tick_ms(detected_metrics):5.2f} ms {tick_ms(plain_metrics):8.2f} ms {check_ms:5.2f} ms "
+              f"{pixels:8d} {plain_pixels:8d}")
+        # The dark scene keeps the rectangle of the 21:9 movie before it
+        expected = content_rect(width, height, aspect)
+        check(rect == expected, f"{name}: content rectangle {rect}, expected {expected}")
+        if expected_black is not None:
+            check(found == expected_black, f"{name}: {found} lamp rows still black")
+        if phase_aspect is None:
+            check(settled is None, f"{name}: the dark scene moved the content rectangle")
+        # Regions are remapped once per new rectangle, never per tick
+        check(sampler.remaps <= changes, f"{name}: {sampler.remaps} remaps for {changes} rectangle changes")
+        # A tick with detection grabs at most the plain bounding box and the probe strips, never the whole screen
+        check(pixels <= plain_pixels + strip_pixels,
+              f"{name}: {pixels} pixels grabbed per tick, {plain_pixels} without detection and "
+              f"{strip_pixels} in the probe strips")
+
+    print(f"{len(sampler.starts)} rows per tick. black rows: rows darker than 24 on the last frame of the phase, "
+          f"without and with detection. tick: bounding box grab and analysis, check: probe strip grabs and "
+          f"detection. pixels: grabbed in the last tick with a check, plain: without detection")
+
+
+def bench_sampling(args):
+    capture = SyntheticCapture(args.width, args.height)
+    frame = capture.grab()
+
+    rng = random.Random(0)
+    print(f"{args.width}x{args.height} frame, {args.shape} regions, {args.weighting} weights")
+    print(f"{'lamps':>5} {'pixels':>9} {'build':>9} {'reduce':>9}")
+    for lamps in args.lamps:
+        positions = [(rng.randrange(args.width), rng.randrange(args.height)) for _ in range(lamps)]
+        settings = {"shape": args.shape, "radius": args.radius, "width": args.radius * 2,
+                    "height": args.radius * 2, "weighting": args.weighting}
+
+        start = time.perf_counter()
+        sampler = RegionSampler([SamplingRegion.from_settings(p, settings) for p in positions])
+        build = (time.perf_counter() - start) * 1000
+
+        reduce = time_ticks(lambda: sampler.reduce(frame), args.ticks)
+        print(f"{lamps:5d} {len(sampler.xs):9d} {build:7.2f}ms {reduce:7.2f}ms")
+
+
+class LampState:
+    lamp_status = False
+
+
+def bench_suppression(args):
+    capture = SyntheticCapture(640, 360)
+    rng = np.random.default_rng(0)
+    base = capture.screen.copy()
+
+    scenes = {
+        "static": lambda tick: None,
+        "sensor noise": lambda tick: capture.set_screen(
+            np.clip(base.astype(np.int16) + rng.integers(-1, 2, base.shape), 0, 255)),
+        "moving": lambda tick: capture.advance(7),
+    }
+
+    positions = [(40 + i * 70, 180) for i in range(args.lamps)]
+    sampler = RegionSampler([SamplingRegion(p, radius=6) for p in positions])
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+
+    with FakeHA() as fake:
+        transport = HATransport(fake.url, fake.token)
+        print(f"{args.lamps} lamps, {args.ticks} ticks at 10 Hz simulated")
+        for name, step in scenes.items():
+            capture.set_screen(base)
+            suppressor = ChangeSuppressor(args.threshold, args.keepalive)
+            comm = HACommunicator(fake.url, fake.token, entities, True, LampState(), transport, capture,
+                                  suppressor)
+            fake.reset()
+
+            for tick in range(args.ticks):
+                step(tick)
+                # Simulated clock so the keepalive is exercised without sleeping
+                comm.send_colors(comm.screen_colors(sampler), 0.5, now=tick * 0.1)
+
+            print(f"  {name:>12}: sent {suppressor.sent:5d}  suppressed {suppressor.suppressed:5d}  "
+                  f"requests {fake.counters.get('requests', 0):5d}")
+        transport.close()
+
+
+def bench_scheduler(args):
+    scheduler = AdaptiveScheduler(args.min_fps, args.max_fps)
+
+    # Home Assistant round trip per phase: healthy, slow, erroring, healthy again
+    phases = [("healthy", 0.01, True), ("slow", 0.4, True), ("errors", 0.05, False), ("recovered", 0.01, True)]
+
+    now = 0.0
+    print(f"{'phase':>10} {'interval':>9} {'fps':>6} {'transition':>11}")
+    for name, latency, ok in phases:
+        for _ in range(args.ticks):
+            scheduler.record_capture(0.002)
+            scheduler.record_send(latency, ok, now=now)
+            now += max(scheduler.interval, latency)
+        print(f"{name:>10} {scheduler.interval * 1000:7.0f}ms {scheduler.fps():6.1f} "
+              f"{scheduler.transition(0.5):10.2f}s")
+
+
+def bench_batching(args):
+    capture = SyntheticCapture(640, 360)
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+    positions = [(int((i + 0.5) * 640 / args.lamps), 180) for i in range(args.lamps)]
+    sampler = RegionSampler([SamplingRegion(p, radius=4) for p in positions])
+
+    with FakeHA() as fake:
+        transport = HATransport(fake.url, fake.token)
+        print(f"{args.lamps} lamps, {args.ticks} ticks, batch step {args.step}")
+        print(f"{'colors':>6} {'requests/tick':>14} {'ms/tick':>8}")
+        for distinct in args.colors:
+            # Vertical stripes of `distinct` flat colors with a little noise inside each stripe
+            levels = np.linspace(0, 15, distinct).astype(np.uint8) * 16 + 2
+            stripes = np.repeat(levels, -(-640 // distinct))[:640]
+            screen = np.empty((360, 640, 3), dtype=np.uint8)
+            screen[...] = stripes[None, :, None]
+            screen[..., 1] += np.random.default_rng(0).integers(0, args.noise + 1, (360, 640), dtype=np.uint8)
+            capture.set_screen(screen)
+
+            comm = HACommunicator(fake.url, fake.token, entities, True, LampState(), transport, capture,
+                                  batch_step=args.step)
+            fake.reset()
+            elapsed = time_ticks(lambda: comm.send_colors(comm.screen_colors(sampler), 0.5), args.ticks)
+            requests_per_tick = fake.counters.get("requests", 0) / (args.ticks + 1)
+            print(f"{distinct:6d} {requests_per_tick:14.1f} {elapsed:8.2f}")
+        transport.close()
+
+
+def bench_analysis(args):
+    capture = SyntheticCapture(args.width, args.height)
+    frame = capture.grab()
+
+    print(f"{args.width}x{args.height} frame, pixel budget {args.budget}")
+    for reducer in REDUCERS:
+        analyzer = ColorAnalyzer(reducer, args.budget)
+        elapsed = time_ticks(lambda: analyzer.analyze(frame), args.ticks)
+        print(f"  {reducer:>10}: {elapsed:6.2f} ms  -> {analyzer.analyze(frame)}")
+
+
+def bench_tiles(args):
+    capture = SyntheticCapture(args.width, args.height)
+    frame = capture.grab()
+
+    rng = random.Random(0)
+    regions = [SamplingRegion.from_settings((rng.randrange(args.width), rng.randrange(args.height)),
+                                            {"shape": "rect", "width": args.region, "height": args.region})
+               for _ in range(args.lamps)]
+    sampler = RegionSampler(regions)
+    workers = args.workers or sorted({1, 2, 4, default_workers()})
+
+    print(f"{args.width}x{args.height} frame, {default_workers()} cores, tiles of {args.tile_pixels} pixels")
+    print(f"  average reducers on every pixel, {args.lamps} regions of {args.region}x{args.region} "
+          f"({len(sampler.xs)} samples)")
+    print(f"{'work':>10} " + " ".join(f"{n:>7}T" for n in workers) + f" {'speedup':>8} {'same':>5}")
+
+    jobs = [(reducer, lambda pool, reducer=reducer: ColorAnalyzer(reducer, 0, pool=pool))
+            for reducer in ("mean", "saturated", "dominant")]
+    for name, make in jobs + [("regions", None)]:
+        times = []
+        results = []
+        for n in workers:
+            pool = TilePool(n, args.tile_pixels)
+            if make is None:
+                func = lambda: sampler.reduce(frame, pool)
+            else:
+                analyzer = make(pool)
+                func = lambda: analyzer.analyze(frame)
+            times.append(time_ticks(func, args.ticks))
+            results.append(np.asarray(func()).tolist())
+            pool.close()
+
+        same = all(result == results[0] for result in results)
+        print(f"{name:>10} " + " ".join(f"{t:6.1f}ms" for t in times)
+              + f" {times[0] / times[-1]:7.2f}x {'yes' if same else 'NO':>5}")
+
+
+def synthetic_footage(width, height, frames):
+    # A gradient with a bright block moving across it and a slow fade, enough for every mode to react
+    ys, xs = np.mgrid[0:height, 0:width]
+    base = np.stack([xs * 255 // max(width - 1, 1), ys * 255 // max(height - 1, 1),
+                     np.full_like(xs, 96)], axis=2).astype(np.uint8)
+    size = max(8, min(width, height) // 4)
+    for i in range(frames):
+        frame = base.copy()
+        x = (i * 17) % max(1, width - size)
+        y = (i * 7) % max(1, height - size)
+        frame[y:y + size, x:x + size] = ((i * 5) % 256, 255 - (i * 3) % 256, 200)
+        frame //= np.uint8(1 + (i // 10) % 3)
+        yield frame
+
+
+def replay_pass(capture, sampler, entities, analyzer):
+    comm = HACommunicator("", "", entities, True, None, capture=capture, analyzer=analyzer)
+    color_filter = ColorFilter("ema", 0.7)
+    labels = sampler.row_labels(entities)
+    outputs = []
+    start = time.perf_counter()
+    for tick in range(len(capture.recording)):
+        rows = color_filter.apply(labels, comm.mode_segments("screen", sampler), tick / 30.0)
+        outputs.append((np.asarray(rows).tobytes(), tuple(comm.mode_colors("average", sampler))))
+        capture.advance()
+    return (time.perf_counter() - start) * 1000 / len(capture.recording), outputs
+
+
+def bench_replay(args):
+    path = args.recording
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "footage.ohs")
+        start = time.perf_counter()
+        with FrameRecorder(path, (args.width, args.height), args.pixel_step) as recorder:
+            for i, frame in enumerate(synthetic_footage(args.width, args.height, args.frames)):
+                recorder.add(frame, (i % args.width, args.height // 2), now=i / 30.0)
+        print(f"Recorded {args.frames} synthetic {args.width}x{args.height} frames, pixel step {args.pixel_step}: "
+              f"{(time.perf_counter() - start) * 1000 / args.frames:.2f} ms per frame, "
+              f"{os.path.getsize(path) / 1e6:.1f} MB")
+
+    recording = FrameRecording(path)
+    width, height = recording.screen_size
+    print(f"{path}: {len(recording)} frames, {recording.duration():.1f} s, {width}x{height}, "
+          f"stored {recording.frames.shape[2]}x{recording.frames.shape[1]}")
+
+    capture = ReplayCapture(path, speed=0)
+    synthetic = SyntheticCapture(width, height)
+    bbox = (0, 0, width, height)
+    print(f"  full screen grab: replay {time_ticks(lambda: capture.grab(bbox), 50) * 1000:.0f} us, "
+          f"synthetic copy {time_ticks(lambda: synthetic.grab(bbox), 50) * 1000:.0f} us, "
+          f"zero copy: {np.shares_memory(capture.grab(bbox).pixels, capture.recording.frames)}")
+
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+    regions = [SamplingRegion((int((i + 0.5) * width / args.lamps), height // 2), radius=16)
+               for i in range(args.lamps)]
+    sampler = RegionSampler(regions + [StripRegion((0, 0, width, height), segments=30)])
+    entities.append("light.bench_strip")
+
+    first, outputs = replay_pass(capture, sampler, entities, ColorAnalyzer())
+    second, repeated = replay_pass(ReplayCapture(path, speed=0), sampler, entities, ColorAnalyzer())
+    print(f"  screen + average pipeline over every frame: {first:.2f} ms per frame, "
+          f"second run {second:.2f} ms, identical output: {outputs == repeated}")
+
+
+def bench_correction(args):
+    rng = np.random.default_rng(0)
+    print(f"{'lamps':>6} {'rebuild':>9} {'per frame':>10} {'per lamp':>9}")
+    for lamps in args.lamps:
+        entities = [f"light.bench_{i}" for i in range(lamps)]
+        corrections = {e: {"gamma": 1.8 + i % 5 * 0.1, "white_balance": [1.0, 0.9, 0.8], "saturation": 1.2,
+                           "min_brightness": 10, "brightness": "luminance"} for i, e in enumerate(entities)}
+        colors = rng.integers(0, 256, (lamps, 3), dtype=np.uint8)
+
+        corrector = ColorCorrector()
+        start = time.perf_counter()
+        corrector.configure(corrections)
+        rebuild = (time.perf_counter() - start) * 1000
+
+        elapsed = time_ticks(lambda: corrector.apply(entities, colors), args.ticks)
+        print(f"{lamps:6d} {rebuild:7.2f}ms {elapsed:8.3f}ms {elapsed * 1000 / lamps:7.2f}us")
+
+
+def bench_smoothing(args):
+    rng = np.random.default_rng(0)
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+
+    # Flickering video: a scene cut halfway through plus per-frame noise on every lamp
+    scene = np.where(np.arange(args.ticks)[:, None, None] < args.ticks // 2, 60.0, 180.0)
+    scene = np.broadcast_to(scene, (args.ticks, args.lamps, 3))
+    frames = np.clip(scene + rng.normal(0, args.noise, scene.shape), 0, 255).astype(np.uint8)
+    settled = slice(args.ticks // 2 + int(args.fps), args.ticks)
+
+    print(f"{args.lamps} lamps, {args.ticks} frames at {args.fps} FPS, noise sigma {args.noise}")
+    print(f"{'filter':>7} {'std dev':>8} {'sends':>6} {'suppressed':>11} {'ms/frame':>9}")
+    results = {}
+    for kind in FILTERS:
+        color_filter = ColorFilter(kind, args.responsiveness)
+        suppressor = ChangeSuppressor()
+        output = np.empty(frames.shape)
+
+        start = time.perf_counter()
+        for tick, frame in enumerate(frames):
+            now = tick / args.fps
+            colors = color_filter.apply(entities, frame, now)
+            output[tick] = colors
+            changed = suppressor.select(entities, colors, 255, now)
+            suppressor.mark_sent([e for e, c in zip(entities, changed) if c],
+                                 [color for color, c in zip(colors, changed) if c], 255, now)
+        elapsed = (time.perf_counter() - start) * 1000 / args.ticks
+
+        results[kind] = (output[settled].std(axis=0).mean(), suppressor.sent)
+        print(f"{kind:>7} {results[kind][0]:8.2f} {suppressor.sent:6d} "
+              f"{suppressor.suppressed:11d} {elapsed:9.3f}")
+
+        # One second after the cut every filter has to follow the new scene
+        level = output[settled].mean()
+        check(abs(level - 180.0) <= 3.0, f"{kind}: settles at {level:.1f} instead of 180")
+
+    # Filters have to cut the flicker and the traffic it causes, at least in half
+    for kind in FILTERS:
+        if kind != "none":
+            check(results[kind][0] <= results["none"][0] / 2, f"{kind}: std dev not reduced")
+            check(results[kind][1] <= results["none"][1] / 2, f"{kind}: sends not reduced")
+
+
+def bench_budget(args):
+    rng = np.random.default_rng(args.seed)
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+
+    # A few lamps follow fast video content, most drift slowly, some are nearly static
+    speed = rng.choice([40.0, 8.0, 1.0], size=(args.lamps, 1), p=[0.2, 0.5, 0.3])
+    steps = rng.normal(0, 1, (args.ticks, args.lamps, 3)) * speed
+    targets = np.clip(128 + np.cumsum(steps, axis=0), 0, 255).astype(np.uint8)
+    target_lab = srgb_to_lab(targets.reshape(-1, 3)).reshape(args.ticks, args.lamps, 3)
+
+    print(f"{args.lamps} lamps at {args.fps:.0f} FPS for {args.ticks / args.fps:.0f} s simulated, "
+          f"budget {args.rate:.0f} updates/s total, {args.entity_rate:.0f}/s per lamp")
+    print(f"{'strategy':>10} {'updates':>8} {'mean dE':>8} {'p99 dE':>7} {'max stale':>10}")
+    duration = args.ticks / args.fps
+    # With budget for every lamp once per max_wait, overdue lamps do not crowd out the most wrong ones.
+    # Below that both strategies end up sending the oldest lamps
+    feasible = args.rate <= 0 or args.rate * BudgetScheduler().max_wait >= args.lamps
+    results = {}
+    for strategy in STRATEGIES:
+        suppressor = ChangeSuppressor(args.threshold, args.keepalive)
+        budget = BudgetScheduler(args.rate, args.entity_rate, strategy=strategy)
+        displayed = np.zeros((args.lamps, 3), dtype=np.uint8)
+        last_update = np.zeros(args.lamps)
+        sends = np.zeros(args.lamps, dtype=np.intp)
+        errors = []
+        stale = 0.0
+
+        for tick in range(args.ticks):
+            now = tick / args.fps
+            colors = [tuple(c) for c in targets[tick].tolist()]
+            chosen = np.array(suppressor.select(entities, colors, 255, now, budget))
+            suppressor.mark_sent([e for e, c in zip(entities, chosen) if c], targets[tick][chosen], 255, now)
+            displayed[chosen] = targets[tick][chosen]
+            last_update[chosen] = now
+            sends[chosen] += 1
+
+            error = delta_e(srgb_to_lab(displayed), target_lab[tick])
+            errors.append(error)
+
+            # Staleness: how long a visibly wrong lamp has gone without an update
+            wrong = error > args.threshold
+            if wrong.any():
+                stale = max(stale, float((now - last_update[wrong]).max()))
+
+        errors = np.concatenate(errors)
+        results[strategy] = errors.mean()
+        print(f"{strategy:>10} {budget.picked:8d} {errors.mean():8.2f} {np.percentile(errors, 99):7.2f} "
+              f"{stale:9.2f}s")
+
+        # Never more than the budget plus the initial burst, overall and per lamp
+        if args.rate > 0:
+            allowed = args.rate * duration + max(1.0, args.rate * budget.burst)
+            check(budget.picked <= allowed, f"{strategy}: {budget.picked} updates, budget {allowed:.0f}")
+        if args.entity_rate > 0:
+            allowed = args.entity_rate * duration + 1
+            check(sends.max() <= allowed, f"{strategy}: a lamp got {sends.max()} updates, budget {allowed:.0f}")
+        if strategy == "error":
+            # Overdue lamps go first, oldest first. Even when every lamp is overdue at once, a wrong lamp
+            # waits at most max_wait plus one round through all lamps at the budget rate
+            bound = budget.max_wait + (args.lamps / args.rate if args.rate > 0 else 0.0) + 1.0 / args.fps
+            check(stale <= bound + 1e-9, f"error: a wrong lamp waited {stale:.2f} s, bound {bound:.2f} s")
+
+    if feasible:
+        check(results["error"] < results["roundrobin"],
+              f"error-driven mean dE {results['error']:.2f} not below round-robin {results['roundrobin']:.2f}")
+    else:
+        print("budget too small to send every lamp once per max_wait, mean error is not compared")
+
+
+def bench_fingerprint(args):
+    rng = np.random.default_rng(0)
+    picture = rng.integers(40, 200, size=(args.height, args.width, 3), dtype=np.int16)
+    capture = SyntheticCapture(args.width, args.height)
+
+    def probe(fingerprint, sampler, pixels):
+        capture.set_screen(np.clip(pixels, 0, 255).astype(np.uint8))
+        frame = capture.grab()
+        return fingerprint.unchanged(frame, sampler.index(frame))
+
+    print(f"{args.width}x{args.height} screen, lamps with radius {args.radius}")
+    for lamps in args.lamps:
+        positions = [(int((i + 0.5) * args.width / lamps), args.height // 2 + (i % 2 - 0.5) * args.height // 2)
+                     for i in range(lamps)]
+        sampler = RegionSampler([SamplingRegion(p, radius=args.radius) for p in positions])
+        region = sampler.regions[lamps // 2]
+
+        # Static, then dithering of +-1 on every pixel: both have to count as unchanged
+        fingerprint = FrameFingerprint()
+        probe(fingerprint, sampler, picture)
+        static = sum(probe(fingerprint, sampler, picture) for _ in range(10))
+        noise = sum(probe(fingerprint, sampler, picture + rng.integers(-1, 2, size=picture.shape, dtype=np.int16))
+                    for _ in range(10))
+        print(f"{lamps:3d} lamps: static {static}/10 hits, dithered {noise}/10 hits")
+        check(static == 10, f"{lamps} lamps: static frames missed")
+        check(noise == 10, f"{lamps} lamps: dithering counted as a change")
+
+        # One lamp's region gets brighter, nothing else changes
+        for rise in args.rises:
+            fingerprint = FrameFingerprint()
+            probe(fingerprint, sampler, picture)
+            changed = picture.copy()
+            changed[region.ys, region.xs] += rise
+            hit = probe(fingerprint, sampler, changed)
+            print(f"{lamps:3d} lamps: one region +{rise:<3d} {'unchanged (stale lamp)' if hit else 'changed'}")
+            check(not hit, f"{lamps} lamps: one region rising by {rise} counted as unchanged")
+
+    # Slow fade of the whole screen from 0 to 99: the analyzed frame must never fall far behind
+    sampler = RegionSampler([SamplingRegion((args.width // 2, args.height // 2), radius=args.radius)])
+    fingerprint = FrameFingerprint()
+    analyzed = lag = 0
+    misses = 0
+    for step in range(args.fade_frames):
+        level = step * 99 // (args.fade_frames - 1)
+        if not probe(fingerprint, sampler, np.full(picture.shape, level, dtype=np.int16)):
+            analyzed = level
+            misses += 1
+        lag = max(lag, level - analyzed)
+    print(f"fade 0 to 99 over {args.fade_frames} frames: {misses} analyzed, analysis at most {lag} levels behind")
+    check(lag <= 3, f"fade: analysis fell {lag} levels behind")
+
+
+def bench_idle(args):
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+    positions = [(int((i + 0.5) * args.width / args.lamps), args.height // 2) for i in range(args.lamps)]
+    sampler = RegionSampler([SamplingRegion(p, radius=16) for p in positions])
+
+    print(f"{args.lamps} lamps, {args.width}x{args.height} synthetic screen, {args.duration:.0f} s per run, "
+          f"max {args.max_fps:.0f} FPS")
+    print(f"{'mode':>7} {'screen':>7} {'fast path':>9} {'CPU':>6} {'captures':>9} {'hits':>6} {'misses':>7} "
+          f"{'skipped':>8}")
+    with FakeHA(entities=entities) as fake:
+        for mode in args.modes:
+            for moving in (False, True):
+                for skip in (False, True):
+                    capture = SyntheticCapture(args.width, args.height)
+                    worker = SyncWorker(capture=capture)
+                    worker.submit(SyncConfig(fake.url, fake.token, entities, sampler, mode, True,
+                                             max_fps=args.max_fps, skip_unchanged=skip))
+                    worker.start()
+                    time.sleep(0.5)
+
+                    worker.metrics.reset()
+                    hits, misses, skipped = worker.fingerprint.hits, worker.fingerprint.misses, worker.fingerprint.skipped
+                    cpu_start = time.process_time()
+                    end = time.perf_counter() + args.duration
+                    while time.perf_counter() < end:
+                        if moving:
+                            capture.advance(3)
+                        time.sleep(0.05)
+                    cpu = (time.process_time() - cpu_start) / args.duration * 100
+                    captures = worker.metrics.snapshot()["stages"]["capture"]["count"]
+                    fingerprint = worker.fingerprint
+                    worker.stop()
+
+                    print(f"{mode:>7} {'moving' if moving else 'static':>7} {'on' if skip else 'off':>9} "
+                          f"{cpu:5.1f}% {captures:9d} {fingerprint.hits - hits:6d} {fingerprint.misses - misses:7d} "
+                          f"{fingerprint.skipped - skipped:8d}")
+
+
+def bench_outage(args):
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+    positions = [(int((i + 0.5) * 640 / args.lamps), 180) for i in range(args.lamps)]
+    sampler = RegionSampler([SamplingRegion(p, radius=4) for p in positions])
+
+    print(f"{args.lamps} lamps, {args.phase:.0f} s per phase, timeouts {args.timeout:.1f} s")
+    print(f"{'transport':>10} {'phase':>10} {'health':>9} {'calls':>6} {'auth':>5} {'longest send':>13} "
+          f"{'capture FPS':>12} {'recovered':>10}")
+    for kind in ("rest", "websocket"):
+        with FakeHA(entities=entities) as fake:
+            capture = SyntheticCapture(640, 360)
+            status = {}
+            worker = SyncWorker(on_status=status.update, capture=capture)
+
+            def config(token):
+                return SyncConfig(fake.url, token, entities, sampler, "screen", True, connect_timeout=args.timeout,
+                                  read_timeout=args.timeout, transport=kind, skip_unchanged=False)
+
+            token = fake.token
+            worker.submit(config(token))
+            worker.start()
+            time.sleep(0.5)
+
+            # Phase, outage, token the worker uses, health expected at the end of the phase
+            for phase, outage, worker_token, expected in (("up", None, token, "ok"),
+                                                          ("hang", "hang", token, "offline"),
+                                                          ("refuse", "refuse", token, "offline"),
+                                                          ("back", None, token, "ok"),
+                                                          ("bad token", None, "wrong-token", "rejected"),
+                                                          ("fixed", None, token, "ok"),
+                                                          ("revoked", None, token, "rejected")):
+                fake.set_outage(outage)
+                if phase == "revoked":
+                    # The token stops working while syncing, after it was validated
+                    fake.revoke()
+                worker.submit(config(worker_token))
+                fake.reset()
+                worker.metrics.reset()
+
+                # Time until the first successful send, for phases that start out broken
+                down = status.get("health") != "ok"
+                start = time.perf_counter()
+                recovered = None
+                while time.perf_counter() - start < args.phase:
+                    capture.advance(3)
+                    if down and recovered is None and status.get("health") == "ok":
+                        recovered = time.perf_counter() - start
+                    time.sleep(0.02)
+
+                snapshot = worker.metrics.snapshot()
+                calls = fake.counters.get("requests", 0) + fake.counters.get("ws_messages", 0)
+                longest = snapshot["stages"]["send"]["max_ms"]
+                captures = snapshot["stages"]["capture"]["count"] / args.phase
+                print(f"{kind:>10} {phase:>10} {status.get('health'):>9} {calls:6d} "
+                      f"{fake.counters.get('unauthorized', 0):5d} {longest:10.0f} ms {captures:12.1f} "
+                      f"{f'{recovered:.2f} s' if recovered is not None else '-':>10}")
+
+                check(status.get("health") == expected, f"{kind} {phase}: health {status.get('health')}, "
+                                                        f"expected {expected}")
+                # No tick blocks longer than one connect and read timeout, and capture keeps going
+                check(longest <= 2 * args.timeout * 1000 + 250, f"{kind} {phase}: a send took {longest:.0f} ms")
+                check(captures >= 1.0, f"{kind} {phase}: capture slowed to {captures:.1f} FPS")
+                if down and expected == "ok":
+                    check(recovered is not None, f"{kind} {phase}: did not recover")
+                if expected == "rejected":
+                    check(fake.counters.get("unauthorized", 0) <= 2 * args.lamps,
+                          f"{kind} {phase}: {fake.counters.get('unauthorized', 0)} calls with a rejected token")
+
+            worker.stop()
+            fake.set_outage(None)
+
+
+def bench_strip(args):
+    capture = SyntheticCapture(args.width, args.height)
+    print(f"{args.width}x{args.height} frame, strip '{args.path}' {args.depth} px deep, one core")
+    print(f"{'segments':>8} {'samples':>8} {'grab':>8} {'reduce':>8} {'filter':>8} {'stream':>8} {'max FPS':>8}")
+
+    with FakeWLED() as fake:
+        for segments in args.segments:
+            sampler = RegionSampler([StripRegion((0, 0, args.width, args.height), args.path, segments, args.depth)])
+            entities = [f"wled://127.0.0.1:{fake.port}/0-{min(segments, 480) - 1}?protocol=ddp"]
+            labels = sampler.row_labels(entities)
+            color_filter = ColorFilter("ema", 0.7)
+            streamer = WLEDStreamer()
+
+            bbox = sampler.bbox(capture.screen_size())
+            frame = capture.grab(bbox)
+            rows = sampler.reduce(frame)
+            filtered = color_filter.apply(labels, rows, 0.0)
+
+            grab = time_ticks(lambda: capture.grab(bbox), args.ticks)
+            reduce = time_ticks(lambda: sampler.reduce(frame), args.ticks)
+            tick = iter(range(1, 10 ** 9))
+            smooth = time_ticks(lambda: color_filter.apply(labels, rows, next(tick) / 30.0), args.ticks)
+            stream = time_ticks(lambda: streamer.send(entities, sampler.split(filtered, 1)), args.ticks)
+            streamer.close()
+
+            total = grab + reduce + smooth + stream
+            print(f"{segments:8d} {len(sampler.xs):8d} {grab:6.2f}ms {reduce:6.2f}ms {smooth:6.2f}ms "
+                  f"{stream:6.2f}ms {1000 / total:8.0f}")
+
+
+def bench_wled(args):
+    rng = np.random.default_rng(0)
+    print(f"{args.lamps} lamps x {args.leds} LEDs per controller, {args.frames} frames at {args.fps} FPS")
+    print(f"{'protocol':>8} {'packets':>8} {'bytes':>6} {'us/frame':>9} {'rate':>9} {'alloc/frame':>12} "
+          f"{'content':>8}")
+
+    for protocol in ("drgb", "dnrgb", "ddp"):
+        with FakeWLED() as fake:
+            first = 10 if protocol != "drgb" else 0
+            entities = [f"wled://127.0.0.1:{fake.port}/{first + i * args.leds}-{first + (i + 1) * args.leds - 1}"
+                        f"?protocol={protocol}" for i in range(args.lamps)]
+            frames = [[tuple(c) for c in rng.integers(0, 256, (args.lamps, 3)).tolist()]
+                      for _ in range(args.frames)]
+
+            streamer = WLEDStreamer()
+            streamer.send(entities, frames[0])
+            fake.wait(1)
+            fake.reset()
+
+            send_time = 0.0
+            start = time.perf_counter()
+            for i, colors in enumerate(frames):
+                tick = time.perf_counter()
+                streamer.send(entities, colors)
+                send_time += time.perf_counter() - tick
+                time.sleep(max(0.0, start + (i + 1) / args.fps - time.perf_counter()))
+            packets = fake.wait(args.frames)
+
+            # Memory kept by the streamer after a second pass, should be zero
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            for colors in frames:
+                streamer.send(entities, colors)
+            growth = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename")
+                         if os.path.basename(stat.traceback[0].filename) == "WLED.py")
+            tracemalloc.stop()
+            streamer.close()
+
+        # One datagram per frame for the one controller, each carrying exactly the lamp colors of its frame
+        wrong = 0
+        for (_, data), colors in zip(packets, frames):
+            _, offset, leds = decode_packet(data)
+            expected = np.repeat(np.array(colors, dtype=np.uint8), args.leds, axis=0)
+            wrong += not np.array_equal(leds[first - offset:], expected)
+        ok = (check(len(packets) == args.frames, f"{protocol}: {len(packets)} packets for {args.frames} frames")
+              & check(not wrong, f"{protocol}: {wrong} packets with wrong colors"))
+
+        rate = (len(packets) - 1) / (packets[-1][0] - packets[0][0]) if len(packets) > 1 else 0.0
+        print(f"{protocol:>8} {len(packets):8d} {len(packets[0][1]) if packets else 0:6d} "
+              f"{send_time * 1e6 / args.frames:9.1f} {rate:7.1f}/s {growth / args.frames:10.1f} B "
+              f"{'ok' if ok else 'MISMATCH':>8}")
+        check(abs(rate - args.fps) <= 0.1 * args.fps, f"{protocol}: {rate:.1f} packets/s instead of {args.fps}")
+        # The stats counters become int objects once they pass 256, memory that grows with the frames
+        # is what counts
+        check(growth <= 128, f"{protocol}: the streamer kept {growth} bytes over {args.frames} frames")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_e2e(fake, transport, mode, args):
+    # A recording replays one recorded frame per tick, so every run sees the same footage
+    capture = ReplayCapture(args.replay, speed=0) if args.replay else SyntheticCapture(args.width, args.height)
+    width, height = capture.screen_size()
+    entities = [f"light.bench_{i}" for i in range(args.lamps)]
+    positions = [(int((i + 0.5) * width / args.lamps), height // 2) for i in range(args.lamps)]
+    sampler = RegionSampler([SamplingRegion(p) for p in positions])
+    suppressor = ChangeSuppressor(args.threshold) if args.threshold > 0 else None
+
+    comm = HACommunicator(fake.url, fake.token, entities, True, LampState(), transport, capture, suppressor)
+
+    def tick():
+        try:
+            comm.send_colors(comm.mode_colors(mode, sampler), HACommunicator.TRANSITIONS[mode])
+            return True
+        except Exception:
+            return False
+
+    tick()
+    fake.reset()
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(args.ticks):
+        capture.advance(1 if args.replay else args.step)
+        tick_start = time.perf_counter()
+        if not tick():
+            errors += 1
+        latencies.append(time.perf_counter() - tick_start)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    # The fake server runs in this process, so CPU includes both sides of the connection
+    requests_sent = fake.counters.get("requests", 0) + fake.counters.get("ws_messages", 0)
+    return {
+        "mode": mode,
+        "transport": transport.kind,
+        "ticks": args.ticks,
+        "ticks_per_s": args.ticks / wall,
+        "requests_per_s": requests_sent / wall,
+        "p50_tick_ms": percentile(latencies, 0.5) * 1000,
+        "p99_tick_ms": percentile(latencies, 0.99) * 1000,
+        "requests_per_tick": requests_sent / args.ticks,
+        "errors": errors,
+        "cpu_percent": cpu / wall * 100,
+    }
+
+
+def bench_e2e(args):
+    results = []
+    with FakeHA(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate) as fake:
+        source = args.replay or f"{args.width}x{args.height} synthetic frames"
+        print(f"{args.lamps} lamps, {args.ticks} ticks, {source}, "
+              f"latency {args.latency * 1000:.0f}+-{args.jitter * 1000:.0f} ms, error rate {args.error_rate:.0%}")
+        print(f"{'mode':>7} {'transport':>10} {'ticks/s':>8} {'p50 tick':>9} {'p99 tick':>9} "
+              f"{'req/tick':>9} {'errors':>7} {'CPU':>6}")
+        for transport_kind in args.transport:
+            for mode in args.modes:
+                transport = make_transport(transport_kind, fake.url, fake.token, 2.0, 5.0)
+                result = run_e2e(fake, transport, mode, args)
+                transport.close()
+
+                results.append(result)
+                print(f"{mode:>7} {transport_kind:>10} {result['ticks_per_s']:8.1f} {result['p50_tick_ms']:7.2f}ms "
+                      f"{result['p99_tick_ms']:7.2f}ms {result['requests_per_tick']:9.2f} {result['errors']:7d} "
+                      f"{result['cpu_percent']:5.0f}%")
+
+    if args.output:
+        report = {
+            "benchmark": "e2e",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("func", "output")},
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+GUI_STARTUP = """
+import time
+start = time.perf_counter()
+import sys
+from PyQt6.QtWidgets import QApplication
+import main
+from headless import rss_mb
+app = QApplication(sys.argv)
+window = main.MainWindow()
+window.show()
+app.processEvents()
+print(f"Startup: {(time.perf_counter() - start) * 1000:.0f} ms, memory: {rss_mb():.1f} MB", flush=True)
+window.close()
+"""
+
+
+def run_startup(command, env):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    line = process.stdout.readline().strip()
+    wall = (time.perf_counter() - start) * 1000
+    process.terminate()
+    process.wait()
+    return wall, line
+
+
+def bench_startup(args):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    with FakeHA(entities=["light.bench_0", "light.bench_1"]) as fake, tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, "save.dat")
+        with open(config, "w", encoding="utf-8") as f:
+            json.dump({
+                "credentials": [fake.url, fake.token],
+                "lamps": ["light.bench_0", "light.bench_1"],
+                "lamp_settings": {"light.bench_0": {"position": [100, 100]},
+                                  "light.bench_1": {"position": [500, 300]}},
+            }, f)
+
+        headless = [sys.executable, "headless.py", "--config", config, "--capture", "synthetic", "--report",
+                    "--duration", "0"]
+        gui = [sys.executable, "-c", GUI_STARTUP]
+
+        for name, command in (("headless", headless), ("gui", gui)):
+            wall, line = run_startup(command, env)
+            print(f"{name:>9}: {wall:6.0f} ms wall incl. interpreter | {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Openhome Sync benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("transport", help="keep-alive pool vs. a fresh connection per call")
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_transport)
+
+    p = sub.add_parser("websocket", help="REST vs. pipelined WebSocket call_service")
+    p.add_argument("--lamps", type=int, nargs="+", default=[10, 20, 50])
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_websocket)
+
+    p = sub.add_parser("fanout", help="tick latency of concurrent per-lamp calls for several in-flight caps")
+    p.add_argument("--lamps", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.05, help="seconds added by the fake server per call")
+    p.add_argument("--caps", type=int, nargs="+", default=[1, 4, 8, 20])
+    p.add_argument("--ticks", type=int, default=20)
+    p.add_argument("--burst", type=int, default=5, help="ticks issued back to back without waiting")
+    p.add_argument("--burst-cap", type=int, default=4)
+    p.set_defaults(func=bench_fanout)
+
+    p = sub.add_parser("entities", help="payloads per light capability, with and without the /api/states cache")
+    p.add_argument("--lamps", type=int, default=3, help="lights of every kind")
+    p.add_argument("--missing", type=int, default=2)
+    p.add_argument("--unavailable", type=int, default=2)
+    p.add_argument("--ticks", type=int, default=20)
+    p.set_defaults(func=bench_entities)
+
+    p = sub.add_parser("capture", help="per-tick capture cost for 1 to 64 lamps")
+    p.add_argument("--backend", default="synthetic", choices=["synthetic", "pil", "qt"])
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--lamps", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    p.add_argument("--ticks", type=int, default=20)
+    p.set_defaults(func=bench_capture)
+
+    p = sub.add_parser("screens", help="screen mode capture over 1 to 3 monitors: whole desktop vs. per screen")
+    p.add_argument("--width", type=int, default=2560)
+    p.add_argument("--height", type=int, default=1440)
+    p.add_argument("--screens", type=int, nargs="+", default=[1, 2, 3])
+    p.add_argument("--lamps", type=int, default=12)
+    p.add_argument("--radius", type=int, default=16)
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_screens)
+
+    p = sub.add_parser("letterbox", help="black bar detection and lamp regions moved into 21:9 and 4:3 pictures")
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--radius", type=int, default=16)
+    p.add_argument("--ticks", type=int, default=40)
+    p.add_argument("--backend", default="synthetic", choices=["synthetic", "pil", "qt"],
+                   help="pil or qt time the check on the real screen instead of the synthetic phases")
+    p.set_defaults(func=bench_letterbox)
+
+    p = sub.add_parser("sampling", help="region reduction cost on a 4K frame")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--lamps", type=int, nargs="+", default=[1, 8, 32, 64])
+    p.add_argument("--radius", type=int, default=24)
+    p.add_argument("--shape", default="circle", choices=["circle", "rect"])
+    p.add_argument("--weighting", default="gaussian", choices=["uniform", "gaussian"])
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_sampling)
+
+    p = sub.add_parser("suppression", help="updates sent vs. suppressed on static and moving screens")
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--ticks", type=int, default=300)
+    p.add_argument("--threshold", type=float, default=2.3)
+    p.add_argument("--keepalive", type=float, default=10.0)
+    p.set_defaults(func=bench_suppression)
+
+    p = sub.add_parser("scheduler", help="simulated adaptive tick rate under changing HA latency")
+    p.add_argument("--min-fps", type=float, default=2.0)
+    p.add_argument("--max-fps", type=float, default=20.0)
+    p.add_argument("--ticks", type=int, default=60)
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser("batching", help="requests per tick when lamps share colors")
+    p.add_argument("--lamps", type=int, default=16)
+    p.add_argument("--colors", type=int, nargs="+", default=[1, 2, 4, 16])
+    p.add_argument("--step", type=int, default=8)
+    p.add_argument("--noise", type=int, default=3)
+    p.add_argument("--ticks", type=int, default=20)
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser("analysis", help="Average Mode reducers on a full 4K frame")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--budget", type=int, default=16384)
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_analysis)
+
+    p = sub.add_parser("tiles", help="analysis split into tiles on 1 to N threads, on a synthetic 8K frame")
+    p.add_argument("--width", type=int, default=7680)
+    p.add_argument("--height", type=int, default=4320)
+    p.add_argument("--workers", type=int, nargs="+", default=None)
+    p.add_argument("--tile-pixels", type=int, default=262144)
+    p.add_argument("--lamps", type=int, default=32)
+    p.add_argument("--region", type=int, default=320)
+    p.add_argument("--ticks", type=int, default=10)
+    p.set_defaults(func=bench_tiles)
+
+    p = sub.add_parser("replay", help="record synthetic footage and replay it through the pipeline twice")
+    p.add_argument("--recording", default=None, help="replay this recording instead of synthetic footage")
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--frames", type=int, default=120)
+    p.add_argument("--pixel-step", type=int, default=2)
+    p.add_argument("--lamps", type=int, default=8)
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("smoothing", help="temporal filters on a synthetic flickering sequence")
+    p.add_argument("--lamps", type=int, default=16)
+    p.add_argument("--ticks", type=int, default=600)
+    p.add_argument("--fps", type=float, default=20.0)
+    p.add_argument("--noise", type=float, default=8.0)
+    p.add_argument("--responsiveness", type=float, default=0.5)
+    p.set_defaults(func=bench_smoothing)
+
+    p = sub.add_parser("correction", help="per-lamp color correction tables: rebuild and per-frame cost")
+    p.add_argument("--lamps", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p.add_argument("--ticks", type=int, default=1000)
+    p.set_defaults(func=bench_correction)
+
+    p = sub.add_parser("e2e", help="every mode against the fake Home Assistant, with JSON output")
+    p.add_argument("--modes", nargs="+", default=["screen", "average", "crazy"],
+                   choices=["screen", "average", "crazy"])
+    p.add_argument("--transport", nargs="+", default=["rest", "websocket"], choices=["rest", "websocket"])
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--ticks", type=int, default=100)
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--step", type=int, default=3, help="color shift per tick of the synthetic frame")
+    p.add_argument("--threshold", type=float, default=2.3, help="change suppression in delta E, 0 disables it")
+    p.add_argument("--latency", type=float, default=0.0, help="seconds added by the fake server per call")
+    p.add_argument("--jitter", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--replay", default=None, help="replay a recording instead of synthetic frames")
+    p.add_argument("--output", default=None, help="write the results as JSON to this file")
+    p.set_defaults(func=bench_e2e)
+
+    p = sub.add_parser("budget", help="simulated error-driven vs. round-robin updates under a request budget")
+    p.add_argument("--lamps", type=int, default=40)
+    p.add_argument("--ticks", type=int, default=1200)
+    p.add_argument("--fps", type=float, default=10.0)
+    p.add_argument("--rate", type=float, default=60.0, help="lamp updates per second, all lamps together")
+    p.add_argument("--entity-rate", type=float, default=5.0, help="lamp updates per second, per lamp")
+    p.add_argument("--threshold", type=float, default=2.3)
+    p.add_argument("--keepalive", type=float, default=10.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_budget)
+
+    p = sub.add_parser("fingerprint", help="unchanged-frame detection: static, dithered, one lamp changing, slow fade")
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--lamps", type=int, nargs="+", default=[8, 32])
+    p.add_argument("--radius", type=int, default=16)
+    p.add_argument("--rises", type=int, nargs="+", default=[15, 40])
+    p.add_argument("--fade-frames", type=int, default=200)
+    p.set_defaults(func=bench_fingerprint)
+
+    p = sub.add_parser("idle", help="CPU on static vs. moving screens with and without the unchanged-frame fast path")
+    p.add_argument("--modes", nargs="+", default=["screen", "average"], choices=["screen", "average"])
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--max-fps", type=float, default=20.0)
+    p.add_argument("--duration", type=float, default=3.0)
+    p.set_defaults(func=bench_idle)
+
+    p = sub.add_parser("outage", help="sync against a Home Assistant stand-in that hangs, refuses and rejects the token")
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--phase", type=float, default=4.0, help="seconds per phase")
+    p.add_argument("--timeout", type=float, default=1.0, help="connect and read timeout")
+    p.set_defaults(func=bench_outage)
+
+    p = sub.add_parser("strip", help="edge strip segment reduction for 30 to 1000 segments")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--path", default="around", choices=["around", "u", "bottom", "top", "left", "right"])
+    p.add_argument("--depth", type=int, default=80)
+    p.add_argument("--segments", type=int, nargs="+", default=[30, 100, 300, 1000])
+    p.add_argument("--ticks", type=int, default=50)
+    p.set_defaults(func=bench_strip)
+
+    p = sub.add_parser("wled", help="UDP realtime streaming: packet contents, rate and per-frame cost")
+    p.add_argument("--lamps", type=int, default=8)
+    p.add_argument("--leds", type=int, default=30, help="LEDs per lamp")
+    p.add_argument("--frames", type=int, default=120)
+    p.add_argument("--fps", type=float, default=60.0)
+    p.set_defaults(func=bench_wled)
+
+    p = sub.add_parser("startup", help="startup time and memory of the headless runner vs. the GUI")
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
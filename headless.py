@@ -0,0 +1,155 @@
+import argparse
+import signal
+import sys
+import threading
+import time
+
+START_TIME = time.perf_counter()
+
+from SaveFile import default_save_path, load_save
+from Sampling import RegionSampler, make_region
+from ScreenCapture import ScreenLayout, make_capture
+from SyncWorker import SyncConfig, SyncWorker
+
+
+def rss_mb():
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # ru_maxrss is the peak, in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def sync_config_from_save(data, mode=None, active=True, layout=None):
+    url, token = data["credentials"]
+    entities = data["lamps"]
+    layout = layout if layout is not None else ScreenLayout([(0, 0, 1920, 1080, 1.0)])
+
+    lamp_settings = data.get("lamp_settings", {})
+    regions = []
+    for entity in entities:
+        settings = lamp_settings.get(entity, {})
+        # Positions are physical pixels on the lamp's own screen
+        screen = layout.clamp(settings.get("screen", 0))
+        regions.append(make_region(tuple(settings.get("position", (0, 0))), settings.get("region", {}),
+                                   layout.size(screen), screen))
+
+    transport = data.get("transport", {})
+    sync = data.get("sync", {})
+
+    return SyncConfig(
+        url=url,
+        token=token,
+        entities=entities,
+        sampler=RegionSampler(regions),
+        mode=mode or sync.get("mode", "screen"),
+        active=active,
+        connect_timeout=transport.get("connect_timeout", 2.0),
+        read_timeout=transport.get("read_timeout", 5.0),
+        transport=transport.get("type", "rest"),
+        change_threshold=sync.get("change_threshold", 2.3),
+        keepalive=sync.get("keepalive", 10.0),
+        min_fps=sync.get("min_fps", 2.0),
+        max_fps=sync.get("max_fps", 20.0),
+        batch_step=sync.get("batch_step", 1),
+        average_reducer=sync.get("average_reducer", "mean"),
+        smoothing=sync.get("smoothing", "ema"),
+        responsiveness=sync.get("responsiveness"),
+        stream_fps=sync.get("stream_fps", 30.0),
+        skip_unchanged=sync.get("skip_unchanged", True),
+        probe_interval=sync.get("probe_interval", 0.25),
+        update_budget=sync.get("update_budget", 0.0),
+        entity_budget=sync.get("entity_budget", 0.0),
+        budget_strategy=sync.get("budget_strategy", "error"),
+        max_in_flight=transport.get("max_in_flight", 8),
+        corrections={entity: lamp_settings[entity]["correction"] for entity in entities
+                     if "correction" in lamp_settings.get(entity, {})},
+        analysis_workers=sync.get("analysis_workers", 0),
+        analysis_budget=sync.get("analysis_budget", 16384),
+        letterbox=sync.get("letterbox", True),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Openhome Sync without a window")
+    parser.add_argument("--config", default=None, help="save.dat written by the GUI (default: the GUI's own)")
+    parser.add_argument("--mode", choices=["screen", "average", "crazy"], default=None)
+    parser.add_argument("--capture", choices=["pil", "synthetic", "replay"], default="pil")
+    parser.add_argument("--replay", default=None, help="recording made with FrameRecording.py, for --capture replay")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="1 is the recorded rate, 2 twice as fast")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--status-interval", type=float, default=0.0, help="print status every N seconds")
+    parser.add_argument("--report", action="store_true", help="print startup time and memory after the first frame")
+    parser.add_argument("--metrics-file", default=None,
+                        help="rewrite per-stage timing to this file every second (.json for JSON, else text)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve /metrics (text) and /metrics.json on this local port")
+    args = parser.parse_args()
+
+    # Strips are laid out along the edges of the screen their lamp is assigned to
+    if args.capture == "replay" and not args.replay:
+        parser.error("--capture replay needs --replay")
+    capture = make_capture(args.capture, args.replay, args.replay_speed)
+    data = load_save(args.config or default_save_path())
+    config = sync_config_from_save(data, args.mode, layout=capture.layout())
+
+    first_frame = threading.Event()
+    latest = {}
+
+    def on_status(status):
+        latest.update(status)
+        if "latency_ms" in status:
+            first_frame.set()
+
+    worker = SyncWorker(on_status=on_status, capture=capture)
+    worker.submit(config)
+    worker.start()
+
+    if args.metrics_port is not None:
+        from Metrics import serve_metrics
+
+        serve_metrics(worker.metrics, args.metrics_port)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    if args.report:
+        first_frame.wait(30)
+        rss = rss_mb()
+        print(f"Startup: {(time.perf_counter() - START_TIME) * 1000:.0f} ms to first frame, "
+              f"memory: {f'{rss:.1f} MB' if rss is not None else 'unknown'}", flush=True)
+
+    deadline = time.monotonic() + args.duration if args.duration is not None else None
+    next_status = time.monotonic() + args.status_interval
+    while not stop.is_set() and (deadline is None or time.monotonic() < deadline):
+        stop.wait(min(args.status_interval or 0.5, 1.0 if args.metrics_file else 0.5))
+        if args.metrics_file:
+            worker.metrics.write(args.metrics_file)
+        if args.status_interval and latest and time.monotonic() >= next_status:
+            next_status += args.status_interval
+            print(f"{latest.get('fps', 0):.1f} FPS, sent {latest.get('sent_updates', 0)}, "
+                  f"suppressed {latest.get('suppressed_updates', 0)}, "
+                  f"unchanged {latest.get('fingerprint_hits', 0)}/{latest.get('fingerprint_misses', 0)} "
+                  f"hit/miss, Home Assistant {latest.get('health')}, error: {latest.get('error')}", flush=True)
+
+    # Switch the lights off the same way the START button does before exiting
+    worker.submit(sync_config_from_save(data, args.mode, active=False, layout=capture.layout()))
+    end = time.monotonic() + 2.0
+    while worker.lamp_status and time.monotonic() < end:
+        time.sleep(0.05)
+    worker.stop()
+
+
+if __name__ == "__main__":
+    main()
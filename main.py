@@ -1,6 +1,4 @@
 import sys
-import os
-from pathlib import Path
 import random
 import webbrowser
 import json
@@ -18,11 +16,192 @@ from PyQt6.QtWidgets import (
     QLabel,
     QButtonGroup,
     QMessageBox,
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QFormLayout,
+    QMenu,
+    QSpinBox,
+    QDoubleSpinBox,
+    QCheckBox,
 )
-from PyQt6.QtCore import Qt, QPoint, QTimer
-from PyQt6.QtGui import QPixmap, QPainter, QFont, QIcon
+from PyQt6.QtCore import Qt, QPoint, QTimer, QObject, pyqtSignal
+from PyQt6.QtGui import QPixmap, QPainter, QFont, QIcon, QColor
+
+from ColorCorrection import correction_settings
+from QtCapture import QtCapture, ordered_screens
+from SaveFile import default_save_path, load_save, save_dir
+from Sampling import DEFAULT_REGION, DEFAULT_STRIP, RegionSampler, StripRegion, make_region
+from SyncWorker import RESPONSIVENESS, SyncWorker, SyncConfig
+
+# Connection state shown under the START button, see SyncWorker.health
+HEALTH = {
+    "idle": ("not connected", "#9a9a9a"),
+    "connecting": ("connecting", "#e0a800"),
+    "ok": ("connected", "#4caf50"),
+    "degraded": ("calls failing", "#e0a800"),
+    "offline": ("unreachable", "#eb5e28"),
+    "rejected": ("check URL and token", "#eb5e28"),
+}
+
+
+def screen_names():
+    names = []
+    for index, screen in enumerate(ordered_screens()):
+        dpr = screen.devicePixelRatio()
+        size = screen.size()
+        label = f"Screen {index + 1}: {screen.name()}" if screen.name() else f"Screen {index + 1}"
+        names.append(f"{label} ({round(size.width() * dpr)}x{round(size.height() * dpr)})")
+    return names
+
+
+class LampSettingsDialog(QDialog):
+    def __init__(self, name, region_settings, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Lamp Settings – {name}" if name else "Lamp Settings")
+
+        layout = QFormLayout(self)
+        self.form = layout
+
+        self.lamp_type = QComboBox()
+        self.lamp_type.addItem("Single lamp", "point")
+        self.lamp_type.addItem("LED strip along the screen edge", "strip")
+        self.lamp_type.setCurrentIndex(max(0, self.lamp_type.findData(region_settings.get("type", "point"))))
+
+        self.path = QComboBox()
+        self.path.addItem("All around", "around")
+        self.path.addItem("Left, top and right", "u")
+        for edge in ("bottom", "top", "left", "right"):
+            self.path.addItem(edge.capitalize(), edge)
+        self.path.setCurrentIndex(max(0, self.path.findData(region_settings.get("path", DEFAULT_STRIP["path"]))))
+
+        self.segments = QSpinBox()
+        self.segments.setRange(1, 1000)
+        self.segments.setValue(region_settings.get("segments", DEFAULT_STRIP["segments"]))
+
+        self.depth = QSpinBox()
+        self.depth.setRange(1, 1000)
+        self.depth.setValue(region_settings.get("depth", DEFAULT_STRIP["depth"]))
+
+        self.reverse = QCheckBox("Counter-clockwise")
+        self.reverse.setChecked(region_settings.get("reverse", DEFAULT_STRIP["reverse"]))
+
+        self.shape = QComboBox()
+        self.shape.addItem("Circle", "circle")
+        self.shape.addItem("Rectangle", "rect")
+        self.shape.setCurrentIndex(max(0, self.shape.findData(region_settings["shape"])))
+
+        self.radius = QSpinBox()
+        self.radius.setRange(0, 500)
+        self.radius.setValue(region_settings["radius"])
+
+        self.region_width = QSpinBox()
+        self.region_width.setRange(1, 2000)
+        self.region_width.setValue(region_settings["width"])
+
+        self.region_height = QSpinBox()
+        self.region_height.setRange(1, 2000)
+        self.region_height.setValue(region_settings["height"])
+
+        self.weighting = QComboBox()
+        self.weighting.addItem("Uniform", "uniform")
+        self.weighting.addItem("Gaussian", "gaussian")
+        self.weighting.setCurrentIndex(max(0, self.weighting.findData(region_settings["weighting"])))
+
+        layout.addRow("Lamp type", self.lamp_type)
+        layout.addRow("Strip path", self.path)
+        layout.addRow("Segments", self.segments)
+        layout.addRow("Depth (px)", self.depth)
+        layout.addRow("Direction", self.reverse)
+        layout.addRow("Region shape", self.shape)
+        layout.addRow("Radius (px)", self.radius)
+        layout.addRow("Width (px)", self.region_width)
+        layout.addRow("Height (px)", self.region_height)
+        layout.addRow("Weighting", self.weighting)
+
+        self.lamp_type.currentIndexChanged.connect(self.type_changed)
+        self.type_changed()
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def type_changed(self, *_):
+        strip = self.lamp_type.currentData() == "strip"
+        for widget in (self.path, self.segments, self.depth, self.reverse):
+            self.form.setRowVisible(widget, strip)
+        for widget in (self.shape, self.radius, self.region_width, self.region_height, self.weighting):
+            self.form.setRowVisible(widget, not strip)
+
+    def region_settings(self):
+        return {
+            "type": self.lamp_type.currentData(),
+            "path": self.path.currentData(),
+            "segments": self.segments.value(),
+            "depth": self.depth.value(),
+            "reverse": self.reverse.isChecked(),
+            "shape": self.shape.currentData(),
+            "radius": self.radius.value(),
+            "width": self.region_width.value(),
+            "height": self.region_height.value(),
+            "weighting": self.weighting.currentData(),
+        }
+
 
-from HACommunicator import HACommunicator
+class ColorCorrectionDialog(QDialog):
+    def __init__(self, name, correction, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Color Correction – {name}" if name else "Color Correction")
+
+        layout = QFormLayout(self)
+
+        def number(low, high, value, step=0.05):
+            box = QDoubleSpinBox()
+            box.setRange(low, high)
+            box.setSingleStep(step)
+            box.setValue(value)
+            return box
+
+        self.gamma = number(0.2, 5.0, correction["gamma"])
+        self.white_balance = [number(0.0, 2.0, gain) for gain in correction["white_balance"]]
+        self.saturation = number(0.0, 3.0, correction["saturation"])
+
+        self.min_brightness = QSpinBox()
+        self.min_brightness.setRange(0, 255)
+        self.min_brightness.setValue(correction["min_brightness"])
+
+        self.max_brightness = QSpinBox()
+        self.max_brightness.setRange(0, 255)
+        self.max_brightness.setValue(correction["max_brightness"])
+
+        self.brightness = QComboBox()
+        self.brightness.addItem("Fixed (max brightness)", "fixed")
+        self.brightness.addItem("Follow screen luminance", "luminance")
+        self.brightness.setCurrentIndex(max(0, self.brightness.findData(correction["brightness"])))
+
+        layout.addRow("Gamma", self.gamma)
+        for channel, box in zip(("Red", "Green", "Blue"), self.white_balance):
+            layout.addRow(f"{channel} gain", box)
+        layout.addRow("Saturation", self.saturation)
+        layout.addRow("Brightness", self.brightness)
+        layout.addRow("Min brightness", self.min_brightness)
+        layout.addRow("Max brightness", self.max_brightness)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def correction(self):
+        return {
+            "gamma": round(self.gamma.value(), 2),
+            "white_balance": [round(box.value(), 2) for box in self.white_balance],
+            "saturation": round(self.saturation.value(), 2),
+            "min_brightness": min(self.min_brightness.value(), self.max_brightness.value()),
+            "max_brightness": self.max_brightness.value(),
+            "brightness": self.brightness.currentData(),
+        }
 
 
 class MovableLamp(QWidget):
@@ -41,6 +220,10 @@ class MovableLamp(QWidget):
         self.icon_label.setFont(font)
 
         self.position = (0, 0)
+        self.screen = 0
+        self.region_settings = dict(DEFAULT_REGION)
+        self.region = make_region(self.position, self.region_settings, (1, 1))
+        self.correction = correction_settings(None)
 
         self.icon_label.setStyleSheet(
             """
@@ -127,9 +310,55 @@ class MovableLamp(QWidget):
                     # print(f'Bulb "{self.text_label.text()}" Pixel: ({px}, {py})')
                     # pyautogui.moveTo(px, py)
                     self.position = (px, py)
+                    self.update_region()
 
         super().mouseReleaseEvent(event)
 
+    def contextMenuEvent(self, event):
+        menu = QMenu(self)
+        settings_action = menu.addAction("Sampling region...")
+        correction_action = menu.addAction("Color correction...")
+
+        screen_menu = menu.addMenu("Screen")
+        screen_actions = {}
+        for index, name in enumerate(screen_names()):
+            screen_action = screen_menu.addAction(name)
+            screen_action.setCheckable(True)
+            screen_action.setChecked(index == self.screen)
+            screen_actions[screen_action] = index
+
+        action = menu.exec(event.globalPos())
+        if action in screen_actions:
+            parent = self.parentWidget()
+            self.screen = screen_actions[action]
+            self.update_region()
+            if parent is not None and hasattr(parent, "show_screen"):
+                parent.show_screen(parent.screen)
+        elif action is settings_action:
+            dialog = LampSettingsDialog(self.text_label.text(), self.region_settings, self)
+            if dialog.exec() == QDialog.DialogCode.Accepted:
+                self.set_region_settings(dialog.region_settings())
+        elif action is correction_action:
+            dialog = ColorCorrectionDialog(self.text_label.text(), self.correction, self)
+            if dialog.exec() == QDialog.DialogCode.Accepted:
+                self.correction = dialog.correction()
+
+    def set_region_settings(self, settings):
+        self.region_settings = dict(DEFAULT_REGION)
+        self.region_settings.update(settings)
+        self.icon_label.setText("📏" if self.region_settings.get("type") == "strip" else "💡")
+        self.update_region()
+
+    def update_region(self):
+        # Index masks are built here, once per drop, and reused by every tick
+        parent = self.parentWidget()
+        screen_size = (parent.screen_size(self.screen) if parent is not None and hasattr(parent, "screen_size")
+                       else (1, 1))
+        self.region = make_region(self.position, self.region_settings, screen_size, self.screen)
+
+        if parent is not None and hasattr(parent, "update_sampler"):
+            parent.update_sampler()
+
 
 class LogoCanvas(QWidget):
     def __init__(self, parent=None):
@@ -145,13 +374,23 @@ class LogoCanvas(QWidget):
             """
         )
 
-        self.pixmap = self.capture_screenshot()
+        # The canvas shows one screen at a time, lamps on other screens are hidden
+        self.screen = 0
+        self.pixmaps = {}
+        self.pixmap = self.screen_pixmap(0)
         self.scaled_pixmap = None
         self.image_rect = None
         self.logos = []
+        self.sampler = RegionSampler([])
+
+    def screen_pixmap(self, index):
+        if index not in self.pixmaps:
+            self.pixmaps[index] = self.capture_screenshot(index)
+        return self.pixmaps[index]
 
-    def capture_screenshot(self):
-        screen = QApplication.primaryScreen()
+    def capture_screenshot(self, index=0):
+        screens = ordered_screens()
+        screen = screens[index] if index < len(screens) else None
 
         if screen is None:
             pm = QPixmap(640, 360)
@@ -166,9 +405,32 @@ class LogoCanvas(QWidget):
 
         return pm
 
+    def screens_changed(self):
+        # Screenshots and sizes are taken again, lamps keep their screen if it still exists
+        self.pixmaps = {}
+        count = max(1, len(ordered_screens()))
+        for logo in self.logos:
+            if logo.screen >= count:
+                logo.screen = 0
+            logo.update_region()
+        self.show_screen(min(self.screen, count - 1))
+
+    def show_screen(self, index):
+        self.screen = index
+        self.pixmap = self.screen_pixmap(index)
+        self.rescale()
+        for logo in self.logos:
+            visible = logo.screen == index
+            logo.setVisible(visible)
+            logo.text_label.setVisible(visible)
+            if visible:
+                self.place_logo(logo, logo.position)
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
+        self.rescale()
 
+    def rescale(self):
         if self.pixmap is not None:
             self.scaled_pixmap = self.pixmap.scaled(
                 self.size(),
@@ -190,6 +452,17 @@ class LogoCanvas(QWidget):
         if self.scaled_pixmap is not None and self.image_rect is not None:
             painter.drawPixmap(self.image_rect.topLeft(), self.scaled_pixmap)
 
+            # Segment centers of every strip, so the path and the start are visible
+            screen_w, screen_h = self.screen_size()
+            for logo in self.logos:
+                if not isinstance(logo.region, StripRegion) or logo.screen != self.screen:
+                    continue
+                for i, (x, y) in enumerate(logo.region.segment_centers()):
+                    painter.setPen(QColor("#eb5e28") if i == 0 else QColor("#fffcf2"))
+                    painter.drawEllipse(QPoint(int(self.image_rect.left() + x / screen_w * self.image_rect.width()),
+                                               int(self.image_rect.top() + y / screen_h * self.image_rect.height())),
+                                        2, 2)
+
     def set_logos(self, texts):
         n = len(texts)
 
@@ -201,6 +474,7 @@ class LogoCanvas(QWidget):
         elif len(self.logos) < n:
             for _ in range(n - len(self.logos)):
                 logo = MovableLamp("", self)
+                logo.screen = self.screen
 
                 if self.image_rect is not None:
                     min_x = self.image_rect.left()
@@ -228,6 +502,33 @@ class LogoCanvas(QWidget):
         for logo, text in zip(self.logos, texts):
             logo.text_label.setText(text)
 
+        self.update_sampler()
+
+    def update_sampler(self):
+        self.sampler = RegionSampler([logo.region for logo in self.logos])
+        self.update()
+
+    def screen_size(self, index=None):
+        pixmap = self.pixmap if index is None or index == self.screen else self.screen_pixmap(index)
+        if pixmap is None:
+            return 1, 1
+        dpr = pixmap.devicePixelRatio()
+        return int(pixmap.width() * dpr), int(pixmap.height() * dpr)
+
+    def place_logo(self, logo, position):
+        logo.position = (int(position[0]), int(position[1]))
+
+        if self.pixmap is None or self.image_rect is None:
+            return
+
+        dpr = self.pixmap.devicePixelRatio()
+        screen_w = self.pixmap.width() * dpr
+        screen_h = self.pixmap.height() * dpr
+
+        cx = self.image_rect.left() + position[0] / screen_w * self.image_rect.width()
+        cy = self.image_rect.top() + position[1] / screen_h * self.image_rect.height()
+        logo.move(int(round(cx - logo.width() / 2.0)), int(round(cy - logo.height() / 2.0)))
+
     def map_widget_center_to_screen(self, widget):
         if self.pixmap is None or self.image_rect is None or self.scaled_pixmap is None:
             return None
@@ -295,6 +596,56 @@ class ToggleButton(QPushButton):
         """
 
 
+class WorkerSignals(QObject):
+    status = pyqtSignal(dict)
+
+
+class StatsPanel(QLabel):
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+
+        font = QFont("Consolas", 8)
+        font.setStyleHint(QFont.StyleHint.Monospace)
+        self.setFont(font)
+        self.setStyleSheet("color: #9a9a9a; background-color: #1c1f1f; border-radius: 3px; padding: 4px;")
+
+        # Refreshed on its own slow timer, the worker never waits for the panel
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.refresh()
+
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        gauges = snapshot["gauges"]
+        counters = snapshot["counters"]
+
+        lines = [f"{gauges.get('fps', 0.0):5.1f} FPS   dropped {gauges.get('dropped_frames', 0)}   "
+                 f"errors {counters.get('send_errors', 0) + counters.get('capture_errors', 0)}"]
+        for stage in ("capture", "analysis", "filter", "correct", "stream", "send", "latency"):
+            summary = snapshot["stages"].get(stage)
+            if summary and summary["count"]:
+                lines.append(f"{stage:>8}  p50 {summary['p50_ms']:6.1f} ms  p99 {summary['p99_ms']:6.1f} ms")
+
+        if gauges.get("budget_pending"):
+            lines.append(f"budget: {gauges['budget_pending']} lamps waiting, {gauges.get('budget_deferred', 0)} deferred")
+
+        hits = gauges.get("fingerprint_hits", 0)
+        misses = gauges.get("fingerprint_misses", 0)
+        if hits + misses:
+            lines.append(f"unchanged {hits / (hits + misses):4.0%} of frames, "
+                         f"{gauges.get('probes_skipped', 0)} captures skipped")
+
+        # The slowest lamp by median Home Assistant response time
+        if snapshot["entities"]:
+            entity, summary = max(snapshot["entities"].items(), key=lambda item: item[1]["p50_ms"])
+            lines.append(f"slowest {entity}: p50 {summary['p50_ms']:.1f} ms")
+
+        self.setText("\n".join(lines))
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -304,11 +655,11 @@ class MainWindow(QMainWindow):
         self.setMinimumSize(900, 450)
         self.setStyleSheet("background-color: #131515;")
 
-        self.base_dir = Path(os.getenv("APPDATA", Path.home())) / "OpenhomeSync"
-        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.base_dir = save_dir()
 
-        self.save_path = self.base_dir / "save.dat"
+        self.save_path = default_save_path()
 
+        # Only hands config snapshots to the worker, which paces itself with an adaptive scheduler
         self.timer = QTimer()
         self.timer.setInterval(100)
 
@@ -317,6 +668,23 @@ class MainWindow(QMainWindow):
         self.dynamic_rows = []
         self.lamp_status = None
 
+        self.connect_timeout = 2.0
+        self.read_timeout = 5.0
+        self.max_in_flight = 8
+        self.change_threshold = 2.3
+        self.keepalive = 10.0
+        self.min_fps = 2.0
+        self.max_fps = 20.0
+        self.batch_step = 1
+        self.stream_fps = 30.0
+        self.skip_unchanged = True
+        self.probe_interval = 0.25
+        self.update_budget = 0.0
+        self.entity_budget = 0.0
+        self.budget_strategy = "error"
+        self.analysis_workers = 0
+        self.analysis_budget = 16384
+
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         main_layout = QHBoxLayout(central_widget)
@@ -345,8 +713,21 @@ class MainWindow(QMainWindow):
                 """
             )
 
+        self.transport_select = QComboBox()
+        self.transport_select.addItem("REST", "rest")
+        self.transport_select.addItem("WebSocket", "websocket")
+        self.transport_select.setStyleSheet(
+            """
+            QComboBox {
+                background-color: #403d39;
+                border-radius: 3px;
+            }
+            """
+        )
+
         top_layout.addWidget(self.input1)
         top_layout.addWidget(self.input2)
+        top_layout.addWidget(self.transport_select)
         left_layout.addLayout(top_layout)
 
         self.input1.textChanged.connect(self.refresh_logos)
@@ -397,7 +778,55 @@ class MainWindow(QMainWindow):
         self.mode_group.addButton(self.mode_btn3, 3)
         self.mode_btn1.setChecked(True)
 
-        select_group.setLayout(select_layout)
+        self.reducer_select = QComboBox()
+        self.reducer_select.addItem("Mean", "mean")
+        self.reducer_select.addItem("Saturated mean", "saturated")
+        self.reducer_select.addItem("Dominant color", "dominant")
+        self.reducer_select.addItem("K-means palette", "kmeans")
+        self.reducer_select.addItem("Median cut palette", "mediancut")
+        self.reducer_select.setToolTip("Color analysis used by Average Mode")
+
+        self.letterbox_check = QCheckBox("Ignore black bars")
+        self.letterbox_check.setChecked(True)
+        self.letterbox_check.setToolTip("Move lamp regions into the picture when a movie has black bars")
+
+        self.smoothing_select = QComboBox()
+        self.smoothing_select.addItem("No smoothing", "none")
+        self.smoothing_select.addItem("Smoothing: EMA", "ema")
+        self.smoothing_select.addItem("Smoothing: Spring", "spring")
+        self.smoothing_select.addItem("Smoothing: Kalman", "kalman")
+        self.smoothing_select.setCurrentIndex(1)
+
+        # Responsiveness is kept per mode, the spin box edits the selected mode
+        self.responsiveness = dict(RESPONSIVENESS)
+        self.responsiveness_spin = QSpinBox()
+        self.responsiveness_spin.setRange(0, 100)
+        self.responsiveness_spin.setSuffix(" % responsive")
+        self.responsiveness_spin.valueChanged.connect(self.responsiveness_changed)
+        self.mode_group.idClicked.connect(self.mode_changed)
+
+        for combo in (self.reducer_select, self.smoothing_select, self.responsiveness_spin):
+            combo.setStyleSheet(
+                """
+                QComboBox, QSpinBox {
+                    background-color: #403d39;
+                    border-radius: 3px;
+                }
+                """
+            )
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.smoothing_select)
+        filter_layout.addWidget(self.responsiveness_spin)
+
+        select_outer = QVBoxLayout()
+        select_outer.addLayout(select_layout)
+        select_outer.addWidget(self.reducer_select)
+        select_outer.addWidget(self.letterbox_check)
+        select_outer.addLayout(filter_layout)
+
+        select_group.setLayout(select_outer)
+        self.mode_changed()
         left_layout.addWidget(select_group)
 
         right_container = QWidget()
@@ -435,27 +864,152 @@ class MainWindow(QMainWindow):
         right_layout.addLayout(top_layout2)
 
         self.logo_canvas = LogoCanvas()
+
+        # Which screen the canvas shows, only visible with more than one screen
+        self.screen_select = QComboBox()
+        self.screen_select.setStyleSheet(
+            """
+            QComboBox {
+                background-color: #403d39;
+                border-radius: 3px;
+            }
+            """
+        )
+        self.refresh_screens()
+        self.screen_select.currentIndexChanged.connect(self.screen_changed)
+        QApplication.instance().screenAdded.connect(self.screens_changed)
+        QApplication.instance().screenRemoved.connect(self.screens_changed)
+
+        right_layout.addWidget(self.screen_select)
         right_layout.addWidget(self.logo_canvas)
 
         self.toggle_btn = ToggleButton("START")
         right_layout.addWidget(self.toggle_btn)
 
+        self.health_label = QLabel()
+        right_layout.addWidget(self.health_label)
+        self.show_health("idle")
+
+        self.status_label = QLabel("Idle")
+        self.status_label.setStyleSheet("color: #9a9a9a; font-size: 11px;")
+        right_layout.addWidget(self.status_label)
+
         main_layout.addWidget(left_container, 1)
         main_layout.addWidget(right_container, 1)
 
         self.refresh_logos()
-        self.timer.start()
 
-    def update_light(self):
-        HAComm = HACommunicator(self.input1.text(), self.input2.text(), self.collect_all_inputs(),
-                                self.toggle_btn.status, self)
+        # Capture and Home Assistant I/O run on the worker, the timer only hands over snapshots
+        self.worker_signals = WorkerSignals()
+        self.worker_signals.status.connect(self.on_worker_status)
+        self.worker = SyncWorker(on_status=self.worker_signals.status.emit, capture=QtCapture())
+        self.worker.start()
 
+        self.stats_panel = StatsPanel(self.worker.metrics)
+        right_layout.addWidget(self.stats_panel)
+
+        self.timer.start()
+
+    def current_mode(self):
         if self.mode_btn1.isChecked():
-            HAComm.screen_mode(self.logo_canvas.logos)
+            return "screen"
         if self.mode_btn2.isChecked():
-            HAComm.average_mode()
+            return "average"
         if self.mode_btn3.isChecked():
-            HAComm.crazy_mode()
+            return "crazy"
+        return None
+
+    def mode_changed(self, *_):
+        value = self.responsiveness.get(self.current_mode(), 0.5)
+        self.responsiveness_spin.blockSignals(True)
+        self.responsiveness_spin.setValue(round(value * 100))
+        self.responsiveness_spin.blockSignals(False)
+
+    def responsiveness_changed(self, value):
+        self.responsiveness[self.current_mode()] = value / 100.0
+
+    def update_light(self):
+        config = SyncConfig(
+            url=self.input1.text(),
+            token=self.input2.text(),
+            entities=self.collect_all_inputs(),
+            sampler=self.logo_canvas.sampler,
+            mode=self.current_mode(),
+            active=self.toggle_btn.status,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            transport=self.transport_select.currentData(),
+            change_threshold=self.change_threshold,
+            keepalive=self.keepalive,
+            min_fps=self.min_fps,
+            max_fps=self.max_fps,
+            batch_step=self.batch_step,
+            average_reducer=self.reducer_select.currentData(),
+            smoothing=self.smoothing_select.currentData(),
+            responsiveness=self.responsiveness,
+            stream_fps=self.stream_fps,
+            skip_unchanged=self.skip_unchanged,
+            probe_interval=self.probe_interval,
+            update_budget=self.update_budget,
+            entity_budget=self.entity_budget,
+            budget_strategy=self.budget_strategy,
+            max_in_flight=self.max_in_flight,
+            corrections={logo.text_label.text(): logo.correction for logo in self.logo_canvas.logos
+                         if logo.text_label.text()},
+            analysis_workers=self.analysis_workers,
+            analysis_budget=self.analysis_budget,
+            letterbox=self.letterbox_check.isChecked(),
+        )
+        self.worker.submit(config)
+
+    def refresh_screens(self):
+        self.screen_select.blockSignals(True)
+        self.screen_select.clear()
+        for index, name in enumerate(screen_names()):
+            self.screen_select.addItem(name, index)
+        self.screen_select.setCurrentIndex(min(self.logo_canvas.screen, self.screen_select.count() - 1))
+        self.screen_select.blockSignals(False)
+        self.screen_select.setVisible(self.screen_select.count() > 1)
+
+    def screens_changed(self, *_):
+        self.logo_canvas.screens_changed()
+        self.refresh_screens()
+
+    def screen_changed(self, index):
+        if index >= 0:
+            self.logo_canvas.show_screen(index)
+
+    def show_health(self, health, retry_in=0.0):
+        text, color = HEALTH.get(health, HEALTH["idle"])
+        if health == "offline" and retry_in > 0:
+            text += f", next try in {retry_in:.0f} s"
+        self.health_label.setText(f"● Home Assistant: {text}")
+        self.health_label.setStyleSheet(f"color: {color}; font-size: 11px;")
+
+    def on_worker_status(self, status):
+        self.lamp_status = status["lamp_status"]
+        self.show_health(status.get("health", "idle"), status.get("retry_in", 0.0))
+
+        if status["error"]:
+            self.status_label.setText(f"Error: {status['error']}")
+        elif self.toggle_btn.status:
+            text = (f"{status['fps']:.1f} FPS, synced {status['sent_frames']} frames, "
+                    f"dropped {status['dropped_frames']}, "
+                    f"sent {status['sent_updates']} / suppressed {status['suppressed_updates']} updates")
+            if "latency_ms" in status:
+                text += f", latency {status['latency_ms']:.0f} ms"
+            if status.get("missing_entities"):
+                text += f", not available in Home Assistant: {', '.join(status['missing_entities'])}"
+            self.status_label.setText(text)
+        else:
+            self.status_label.setText("Idle")
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.stats_panel.timer.stop()
+        self.worker.stop()
+
+        super().closeEvent(event)
 
     def help_click(self):
         webbrowser.open("https://github.com/Butter-mit-Brot/Openhome-Sync")
@@ -472,12 +1026,45 @@ class MainWindow(QMainWindow):
         values = [e.text().strip() for _, e in self.dynamic_rows if e.text().strip()]
 
         with self.save_path.open("w", encoding="utf-8") as f:
-            f.write(json.dumps({"credentials": credentials, "lamps": values}, indent=4))
+            f.write(json.dumps({
+                "credentials": credentials,
+                "lamps": values,
+                "lamp_settings": {
+                    logo.text_label.text(): {"region": logo.region_settings, "position": list(logo.position),
+                                             "screen": logo.screen, "correction": logo.correction}
+                    for logo in self.logo_canvas.logos if logo.text_label.text()
+                },
+                "transport": {
+                    "type": self.transport_select.currentData(),
+                    "connect_timeout": self.connect_timeout,
+                    "read_timeout": self.read_timeout,
+                    "max_in_flight": self.max_in_flight,
+                },
+                "sync": {
+                    "mode": self.current_mode(),
+                    "change_threshold": self.change_threshold,
+                    "keepalive": self.keepalive,
+                    "min_fps": self.min_fps,
+                    "max_fps": self.max_fps,
+                    "batch_step": self.batch_step,
+                    "average_reducer": self.reducer_select.currentData(),
+                    "smoothing": self.smoothing_select.currentData(),
+                    "responsiveness": self.responsiveness,
+                    "stream_fps": self.stream_fps,
+                    "skip_unchanged": self.skip_unchanged,
+                    "probe_interval": self.probe_interval,
+                    "update_budget": self.update_budget,
+                    "entity_budget": self.entity_budget,
+                    "budget_strategy": self.budget_strategy,
+                    "analysis_workers": self.analysis_workers,
+                    "analysis_budget": self.analysis_budget,
+                    "letterbox": self.letterbox_check.isChecked(),
+                },
+            }, indent=4))
 
     def load_click(self):
         try:
-            with self.save_path.open("r", encoding="utf-8") as f:
-                js_load = json.load(f)
+            js_load = load_save(self.save_path)
         except FileNotFoundError:
             return
 
@@ -485,6 +1072,37 @@ class MainWindow(QMainWindow):
         self.input1.setText(credentials[0])
         self.input2.setText(credentials[1])
 
+        transport = js_load.get("transport", {})
+        self.connect_timeout = transport.get("connect_timeout", self.connect_timeout)
+        self.read_timeout = transport.get("read_timeout", self.read_timeout)
+        self.max_in_flight = transport.get("max_in_flight", self.max_in_flight)
+        sync = js_load.get("sync", {})
+        self.change_threshold = sync.get("change_threshold", self.change_threshold)
+        self.keepalive = sync.get("keepalive", self.keepalive)
+        self.min_fps = sync.get("min_fps", self.min_fps)
+        self.max_fps = sync.get("max_fps", self.max_fps)
+        self.batch_step = sync.get("batch_step", self.batch_step)
+        self.stream_fps = sync.get("stream_fps", self.stream_fps)
+        self.skip_unchanged = sync.get("skip_unchanged", self.skip_unchanged)
+        self.probe_interval = sync.get("probe_interval", self.probe_interval)
+        self.update_budget = sync.get("update_budget", self.update_budget)
+        self.entity_budget = sync.get("entity_budget", self.entity_budget)
+        self.budget_strategy = sync.get("budget_strategy", self.budget_strategy)
+        self.analysis_workers = sync.get("analysis_workers", self.analysis_workers)
+        self.analysis_budget = sync.get("analysis_budget", self.analysis_budget)
+        self.reducer_select.setCurrentIndex(max(0, self.reducer_select.findData(sync.get("average_reducer", "mean"))))
+        self.letterbox_check.setChecked(sync.get("letterbox", True))
+        self.smoothing_select.setCurrentIndex(max(0, self.smoothing_select.findData(sync.get("smoothing", "ema"))))
+        self.responsiveness.update(sync.get("responsiveness", {}))
+        mode_button = {"screen": self.mode_btn1, "average": self.mode_btn2, "crazy": self.mode_btn3}.get(
+            sync.get("mode"))
+        if mode_button is not None:
+            mode_button.setChecked(True)
+        self.mode_changed()
+
+        index = self.transport_select.findData(transport.get("type", "rest"))
+        self.transport_select.setCurrentIndex(max(0, index))
+
         lamps = js_load["lamps"]
         for w, e in self.dynamic_rows:
             w.setParent(None)
@@ -549,6 +1167,17 @@ class MainWindow(QMainWindow):
 
         self.refresh_logos()
 
+        lamp_settings = js_load.get("lamp_settings", {})
+        for logo in self.logo_canvas.logos:
+            settings = lamp_settings.get(logo.text_label.text(), {})
+            screen = settings.get("screen", 0)
+            logo.screen = screen if screen < len(ordered_screens()) else 0
+            if "position" in settings:
+                self.logo_canvas.place_logo(logo, tuple(settings["position"]))
+            logo.set_region_settings(settings.get("region", {}))
+            logo.correction = correction_settings(settings.get("correction"))
+        self.logo_canvas.show_screen(self.logo_canvas.screen)
+
     def clear_all_dynamic_rows(self):
         for row_widget, line_edit in self.dynamic_rows:
             row_widget.setParent(None)